@@ -0,0 +1,45 @@
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+
+class HistoryBuffer:
+  """
+  Fixed length history of equally shaped entries, e.g. model temporal inputs.
+
+  Entries are appended in place after the current window, so the most recent
+  `length` entries are always one contiguous view of the storage. The window is
+  only moved back to the start of the storage once it reaches the end, which
+  happens every `capacity - length + 1` pushes, instead of shifting the whole
+  history on every push.
+  """
+  def __init__(self, length: int, shape: Union[int, Tuple[int, ...]], dtype=np.float32, capacity: Optional[int] = None):
+    self.length = length
+    self.capacity = 2 * length if capacity is None else capacity
+    assert self.capacity > length, "capacity must be larger than the history length"
+    self.buf = np.zeros((self.capacity, *np.atleast_1d(shape)), dtype=dtype)
+    self.end = length
+
+  def push(self, x) -> None:
+    if self.end == self.capacity:
+      self.buf[:self.length - 1] = self.buf[self.end - self.length + 1:self.end]
+      self.end = self.length - 1
+    self.buf[self.end] = x
+    self.end += 1
+
+  @property
+  def view(self) -> np.ndarray:
+    # oldest entry first, only valid until the next push
+    return self.buf[self.end - self.length:self.end]
+
+  @property
+  def flat(self) -> np.ndarray:
+    return self.view.reshape(-1)
+
+  @property
+  def latest(self) -> np.ndarray:
+    return self.buf[self.end - 1]
+
+  def reset(self) -> None:
+    self.buf[:] = 0
+    self.end = self.length
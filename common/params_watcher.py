@@ -0,0 +1,126 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+import time
+from typing import Dict, Iterable, Optional
+
+from openpilot.common.params_pyx import Params
+
+# from sys/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def inotify_watch(path: str, mask: int) -> Optional[int]:
+  """Returns a non-blocking inotify fd watching path, or None if inotify isn't available"""
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+  except (OSError, AttributeError):
+    return None
+
+  if fd < 0:
+    return None
+  if libc.inotify_add_watch(fd, path.encode(), mask) < 0:
+    os.close(fd)
+    return None
+  return fd
+
+
+class ParamsWatcher:
+  """
+  In-memory snapshot of a set of params for realtime loops.
+
+  Call update() once per loop iteration. It drains the inotify events of the
+  params directory and only re-reads the watched keys that were written or
+  removed since the last call, so get() and get_bool() are dict lookups.
+  Without inotify (e.g. macOS) every key is re-read once per fallback_period.
+
+  staleness is an upper bound on how long a write can go unnoticed by get().
+  """
+  def __init__(self, keys: Iterable[str], d: str = "", fallback_period: float = 1.):
+    self.params = Params(d)
+    self.keys = {self.params.check_key(k).decode() for k in keys}
+    self.values: Dict[str, Optional[bytes]] = {}
+    self.fallback_period = fallback_period
+
+    # start watching before the initial read so no write is missed
+    self.fd = inotify_watch(self.params.get_param_path(), WATCH_MASK)
+    self.last_update = 0.
+    self.last_refresh = 0.
+    self.refresh()
+
+  def __del__(self):
+    self.close()
+
+  def close(self) -> None:
+    if self.fd is not None:
+      os.close(self.fd)
+      self.fd = None
+
+  def refresh(self) -> None:
+    for k in self.keys:
+      self.values[k] = self.params.get(k)
+    self.last_update = self.last_refresh = time.monotonic()
+
+  def _read_events(self) -> Optional[set]:
+    """Names touched since the last call, or None if the snapshot needs a full refresh"""
+    assert self.fd is not None
+    changed = set()
+    while True:
+      try:
+        buf = os.read(self.fd, 4096)
+      except BlockingIOError:
+        return changed
+
+      offset = 0
+      while offset < len(buf):
+        _, mask, _, name_len = INOTIFY_EVENT.unpack_from(buf, offset)
+        offset += INOTIFY_EVENT.size
+        if mask & (IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+          return None
+        changed.add(buf[offset:offset + name_len].rstrip(b"\0").decode())
+        offset += name_len
+
+  def update(self) -> None:
+    now = time.monotonic()
+    if self.fd is None:
+      if now - self.last_refresh > self.fallback_period:
+        self.refresh()
+      self.last_update = now
+      return
+
+    changed = self._read_events()
+    if changed is None:
+      # event queue overflowed or the directory went away, fall back to polling if it can't be watched again
+      self.close()
+      self.fd = inotify_watch(self.params.get_param_path(), WATCH_MASK)
+      self.refresh()
+      return
+
+    for k in changed & self.keys:
+      self.values[k] = self.params.get(k)
+    self.last_update = now
+
+  @property
+  def staleness(self) -> float:
+    """Upper bound in seconds on how old the values returned by get() can be"""
+    last = self.last_update if self.fd is not None else self.last_refresh
+    return time.monotonic() - last
+
+  def get(self, key: str, encoding: Optional[str] = None):
+    val = self.values[key]
+    return val if val is None or encoding is None else val.decode(encoding)
+
+  def get_bool(self, key: str) -> bool:
+    return self.values[key] == b"1"
@@ -1,3 +1,4 @@
+import math
 import time
 
 class Profiler():
@@ -43,3 +44,114 @@ class Profiler():
       else:
         print("%30s: %9.2f  avg: %7.2f  percent: %3.0f" % (n, ms*1000.0, ms*1000.0/self.iter, ms/self.tot*100))
     print(f"Iter clock: {self.tot / self.iter:2.6f}   TOTAL: {self.tot:2.2f}")
+
+
+class TimingHistogram:
+  """Fixed size histogram of durations, log spaced bins from 1 us to 16 s with ~19% resolution"""
+  BINS_PER_OCTAVE = 4
+  N_BINS = 24 * BINS_PER_OCTAVE
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.bins = [0] * self.N_BINS
+    self.count = 0
+    self.total = 0.
+    self.max = 0.
+
+  def record(self, dt):
+    us = dt * 1e6
+    b = int(math.log2(us) * self.BINS_PER_OCTAVE) if us > 1. else 0
+    self.bins[min(b, self.N_BINS - 1)] += 1
+    self.count += 1
+    self.total += dt
+    if dt > self.max:
+      self.max = dt
+
+  def merge(self, other):
+    self.bins = [a + b for a, b in zip(self.bins, other.bins, strict=True)]
+    self.count += other.count
+    self.total += other.total
+    self.max = max(self.max, other.max)
+
+  def percentile(self, q):
+    """Upper edge of the bin containing the q-th percentile, in seconds"""
+    if self.count == 0:
+      return 0.
+    target = q / 100. * self.count
+    cum = 0
+    for b, n in enumerate(self.bins):
+      cum += n
+      if n and cum >= target:
+        if b == self.N_BINS - 1:
+          return self.max
+        return min(2 ** ((b + 1) / self.BINS_PER_OCTAVE) * 1e-6, self.max)
+    return self.max
+
+
+class LoopTimer:
+  """
+  Always-on timing of the sections of a realtime loop.
+
+  Call start() where an iteration starts doing work, checkpoint(name) at the end
+  of each section and end() at the end of the iteration. Each section, the total
+  and the period between end() calls go into a fixed size histogram, which
+  costs about a microsecond per call. Every publish_period the p50/p99/max of each
+  one are sent to gauge(name, value), statsd by default, named
+  loop.<name>.<section>.<stat>, then the histograms start over.
+  """
+  def __init__(self, name, publish_period=60., gauge=None):
+    self.name = name
+    self.publish_period = publish_period
+    self.gauge = gauge
+    self.sections = {}
+    self.start_time = self.last_time = self.last_end = self.last_publish = time.monotonic()
+
+  def _histogram(self, name):
+    hist = self.sections.get(name)
+    if hist is None:
+      hist = self.sections[name] = TimingHistogram()
+    return hist
+
+  def record(self, name, dt):
+    self._histogram(name).record(dt)
+
+  def start(self):
+    self.start_time = self.last_time = time.monotonic()
+
+  def checkpoint(self, name):
+    t = time.monotonic()
+    self._histogram(name).record(t - self.last_time)
+    self.last_time = t
+
+  def end(self):
+    t = time.monotonic()
+    self._histogram("total").record(t - self.start_time)
+    self._histogram("period").record(t - self.last_end)
+    self.last_end = t
+
+    if t - self.last_publish > self.publish_period:
+      self.publish()
+      self.last_publish = t
+
+  def stats(self):
+    return {name: {
+      'count': hist.count,
+      'mean_ms': hist.total / max(hist.count, 1) * 1e3,
+      'p50_ms': hist.percentile(50) * 1e3,
+      'p99_ms': hist.percentile(99) * 1e3,
+      'max_ms': hist.max * 1e3,
+    } for name, hist in self.sections.items() if hist.count}
+
+  def publish(self):
+    if self.gauge is None:
+      # imported here so common doesn't depend on selfdrive
+      from openpilot.selfdrive.statsd import statlog
+      self.gauge = statlog.gauge
+
+    for section, stats in self.stats().items():
+      for stat, value in stats.items():
+        self.gauge(f"loop.{self.name}.{section}.{stat}", value)
+    for hist in self.sections.values():
+      hist.reset()
@@ -0,0 +1,32 @@
+import numpy as np
+import unittest
+
+from openpilot.common.history_buffer import HistoryBuffer
+
+
+class HistoryBufferTest(unittest.TestCase):
+  def test_matches_shifted_buffer(self):
+    for length, capacity in [(1, None), (5, None), (5, 6), (99, 150)]:
+      hb = HistoryBuffer(length, 8, capacity=capacity)
+      ref = np.zeros(length * 8, dtype=np.float32)
+      for i in range(3 * hb.capacity):
+        x = np.arange(8, dtype=np.float32) + i
+        ref[:-8] = ref[8:]
+        ref[-8:] = x
+        hb.push(x)
+        np.testing.assert_equal(hb.flat, ref)
+        np.testing.assert_equal(hb.latest, x)
+        self.assertTrue(hb.flat.flags['C_CONTIGUOUS'])
+        self.assertTrue(np.shares_memory(hb.flat, hb.buf))
+
+  def test_reset(self):
+    hb = HistoryBuffer(3, (2, 2))
+    for i in range(5):
+      hb.push(np.full((2, 2), i))
+    hb.reset()
+    self.assertEqual(hb.view.shape, (3, 2, 2))
+    np.testing.assert_equal(hb.view, 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
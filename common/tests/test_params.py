@@ -7,6 +7,7 @@ import uuid
 import unittest
 
 from openpilot.common.params import Params, ParamKeyType, UnknownKeyName, put_nonblocking, put_bool_nonblocking
+from openpilot.common.params_watcher import ParamsWatcher
 
 class TestParams(unittest.TestCase):
   def setUp(self):
@@ -115,6 +116,28 @@ class TestParams(unittest.TestCase):
     assert len(keys) == len(set(keys))
     assert b"CarParams" in keys
 
+  def test_params_watcher(self):
+    self.params.put_bool("IsMetric", True)
+    watcher = ParamsWatcher(["IsMetric", "ExperimentalMode"], self.tmpdir)
+    assert watcher.get_bool("IsMetric")
+    assert watcher.get("ExperimentalMode") is None
+
+    # writes show up after the next update
+    self.params.put_bool("IsMetric", False)
+    self.params.put_bool("ExperimentalMode", True)
+    assert watcher.get_bool("IsMetric")
+    watcher.update()
+    assert not watcher.get_bool("IsMetric")
+    assert watcher.get_bool("ExperimentalMode")
+    assert watcher.staleness < 1.
+
+    self.params.remove("ExperimentalMode")
+    watcher.update()
+    assert watcher.get("ExperimentalMode") is None
+
+    with self.assertRaises(UnknownKeyName):
+      ParamsWatcher(["swag"], self.tmpdir)
+
 
 if __name__ == "__main__":
   unittest.main()
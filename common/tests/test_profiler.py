@@ -0,0 +1,70 @@
+import random
+import unittest
+from unittest import mock
+
+from openpilot.common.profiler import LoopTimer, TimingHistogram
+
+
+class TestLoopTimer(unittest.TestCase):
+  def test_histogram_percentiles(self):
+    rng = random.Random(0)
+    samples = sorted(rng.lognormvariate(-7, 1) for _ in range(10000))
+    hist = TimingHistogram()
+    for dt in samples:
+      hist.record(dt)
+
+    self.assertEqual(hist.count, len(samples))
+    self.assertEqual(hist.max, samples[-1])
+    for q in (1, 50, 90, 99, 100):
+      exact = samples[int(q / 100 * len(samples)) - 1]
+      # upper edge of a bin, one bin is 2 ** (1 / 4) wide
+      self.assertGreaterEqual(hist.percentile(q), exact)
+      self.assertLessEqual(hist.percentile(q), exact * 2 ** (1 / TimingHistogram.BINS_PER_OCTAVE))
+
+  def test_histogram_range(self):
+    hist = TimingHistogram()
+    for dt in (0., 1e-9, 1e3):
+      hist.record(dt)
+    self.assertEqual(hist.bins[0], 2)
+    self.assertEqual(hist.bins[-1], 1)
+    self.assertEqual(hist.percentile(100), 1e3)
+
+  def test_histogram_merge(self):
+    rng = random.Random(0)
+    samples = [rng.lognormvariate(-7, 1) for _ in range(1000)]
+    full, a, b = TimingHistogram(), TimingHistogram(), TimingHistogram()
+    for i, dt in enumerate(samples):
+      full.record(dt)
+      (a if i % 3 else b).record(dt)
+
+    a.merge(b)
+    self.assertEqual(a.bins, full.bins)
+    self.assertEqual((a.count, a.max), (full.count, full.max))
+    self.assertAlmostEqual(a.total, full.total)
+
+  def test_publish(self):
+    t = [0.]
+    gauge = mock.Mock()
+    with mock.patch('time.monotonic', lambda: t[0]):
+      timer = LoopTimer('test', publish_period=9.95, gauge=gauge)
+      for _ in range(200):
+        t[0] += 0.09
+        timer.start()
+        t[0] += 0.002
+        timer.checkpoint("a")
+        t[0] += 0.008
+        timer.checkpoint("b")
+        timer.end()
+        if gauge.called:
+          break
+
+      gauges = {c.args[0]: c.args[1] for c in gauge.call_args_list}
+      self.assertEqual(gauges['loop.test.total.count'], 100)
+      self.assertAlmostEqual(gauges['loop.test.a.mean_ms'], 2.)
+      self.assertAlmostEqual(gauges['loop.test.b.max_ms'], 8.)
+      self.assertAlmostEqual(gauges['loop.test.period.p50_ms'], 100., delta=20.)
+      self.assertEqual(timer.stats(), {})
+
+
+if __name__ == "__main__":
+  unittest.main()
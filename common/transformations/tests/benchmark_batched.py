@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+import argparse
+import timeit
+
+from openpilot.common.transformations.tests.test_batched import FUNCTIONS, random_inputs
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Batched transformations against one cython call per point",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--points", type=int, default=10000)
+  parser.add_argument("--number", type=int, default=3)
+  args = parser.parse_args()
+
+  n, number = args.points, args.number
+  for name, inp in random_inputs(n).items():
+    f, ref = FUNCTIONS[name]
+    t_batch = timeit.timeit(lambda: f(inp), number=number) / (number * n)  # noqa: B023
+    t_single = timeit.timeit(lambda: ref(inp), number=number) / (number * n)  # noqa: B023
+    print(f"{name:>14s}: {t_batch * 1e9:7.1f} ns/point, one call per point: {t_single * 1e9:7.1f} ns/point ({t_single / t_batch:.1f}x)")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import unittest
+
+import numpy as np
+
+import openpilot.common.transformations.coordinates as coord
+import openpilot.common.transformations.orientation as orient
+from openpilot.common.transformations.orientation import numpy_wrap
+from openpilot.common.transformations import transformations as t
+
+ECEF_INIT = [-2711076.55270557, -4259167.14692758, 3884579.87669935]
+
+# batched function and the reference implementation, one cython call per input
+FUNCTIONS = {
+  'euler2quat': (orient.euler2quat, numpy_wrap(t.euler2quat_single, (3,), (4,))),
+  'quat2euler': (orient.quat2euler, numpy_wrap(t.quat2euler_single, (4,), (3,))),
+  'quat2rot': (orient.quat2rot, numpy_wrap(t.quat2rot_single, (4,), (3, 3))),
+  'rot2quat': (orient.rot2quat, numpy_wrap(t.rot2quat_single, (3, 3), (4,))),
+  'euler2rot': (orient.euler2rot, numpy_wrap(t.euler2rot_single, (3,), (3, 3))),
+  'rot2euler': (orient.rot2euler, numpy_wrap(t.rot2euler_single, (3, 3), (3,))),
+  'geodetic2ecef': (coord.geodetic2ecef, numpy_wrap(t.geodetic2ecef_single, (3,), (3,))),
+  'ecef2geodetic': (coord.ecef2geodetic, numpy_wrap(t.ecef2geodetic_single, (3,), (3,))),
+}
+
+
+def random_inputs(n, seed=0):
+  rng = np.random.default_rng(seed)
+  eulers = rng.uniform(-np.pi, np.pi, (n, 3))
+  quats = rng.normal(size=(n, 4))
+  quats /= np.linalg.norm(quats, axis=1, keepdims=True)
+  geodetic = np.column_stack([rng.uniform(-89, 89, n), rng.uniform(-180, 180, n), rng.uniform(-100, 3000, n)])
+  return {
+    'euler2quat': eulers,
+    'quat2euler': quats,
+    'quat2rot': quats,
+    'rot2quat': orient.euler2rot(eulers),
+    'euler2rot': eulers,
+    'rot2euler': orient.euler2rot(eulers),
+    'geodetic2ecef': geodetic,
+    'ecef2geodetic': coord.geodetic2ecef(geodetic),
+  }
+
+
+class TestBatched(unittest.TestCase):
+  def test_matches_single(self):
+    for name, inp in random_inputs(100).items():
+      f, ref = FUNCTIONS[name]
+      np.testing.assert_array_equal(f(inp), ref(inp))
+      # single inputs, lists and non-contiguous arrays
+      np.testing.assert_array_equal(f(inp[0]), ref(inp[0]))
+      np.testing.assert_array_equal(f(inp[0].tolist()), ref(inp[0]))
+      np.testing.assert_array_equal(f(inp[::3]), ref(inp[::3]))
+      self.assertEqual(f(inp[:0]).shape, ref(inp[:0]).shape)
+
+  def test_ecef_ned_euler(self):
+    eulers = random_inputs(100)['euler2quat']
+    for f, f_single in [(orient.ecef_euler_from_ned, t.ecef_euler_from_ned_single),
+                        (orient.ned_euler_from_ecef, t.ned_euler_from_ecef_single)]:
+      np.testing.assert_array_equal(f(ECEF_INIT, eulers), numpy_wrap(f_single, (3,), (3,))(ECEF_INIT, eulers))
+      np.testing.assert_array_equal(f(ECEF_INIT, eulers[0]), f_single(ECEF_INIT, eulers[0]))
+
+  def test_local_coord(self):
+    lc = coord.LocalCoord.from_ecef(ECEF_INIT)
+    inputs = random_inputs(100)
+    ned = np.random.default_rng(1).uniform(-1000, 1000, (100, 3))
+    for f, f_single, inp in [(lc.ecef2ned, lc.ecef2ned_single, inputs['ecef2geodetic']),
+                             (lc.ned2ecef, lc.ned2ecef_single, ned),
+                             (lc.geodetic2ned, lc.geodetic2ned_single, inputs['geodetic2ecef']),
+                             (lc.ned2geodetic, lc.ned2geodetic_single, ned)]:
+      np.testing.assert_array_equal(f(inp), np.array([f_single(x) for x in inp]))
+      np.testing.assert_array_equal(f(inp[0]), f_single(inp[0]))
+
+
+if __name__ == "__main__":
+  unittest.main()
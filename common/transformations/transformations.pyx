@@ -54,6 +54,37 @@ cdef Geodetic list2geodetic(geodetic):
     g.alt = geodetic[2]
     return g
 
+cdef inline ECEF ptr2ecef(const double *p):
+    cdef ECEF e
+    e.x = p[0]
+    e.y = p[1]
+    e.z = p[2]
+    return e
+
+cdef inline NED ptr2ned(const double *p):
+    cdef NED n
+    n.n = p[0]
+    n.e = p[1]
+    n.d = p[2]
+    return n
+
+cdef inline Geodetic ptr2geodetic(const double *p):
+    cdef Geodetic g
+    g.lat = p[0]
+    g.lon = p[1]
+    g.alt = p[2]
+    return g
+
+cdef inline void matrix2ptr(Matrix3 m, double *p):
+    cdef int j, k
+    for j in range(3):
+        for k in range(3):
+            p[3*j + k] = m(j, k)
+
+cdef double[:, :, ::1] colmajor(rot):
+    # Matrix3(double*) reads column major data
+    return np.ascontiguousarray(np.swapaxes(rot, 1, 2), dtype=np.double)
+
 def euler2quat_single(euler):
     cdef Vector3 e = Vector3(euler[0], euler[1], euler[2])
     cdef Quaternion q = euler2quat_c(e)
@@ -112,6 +143,148 @@ def ecef2geodetic_single(ecef):
     return [g.lat, g.lon, g.alt]
 
 
+# Batched versions of the functions above, taking and returning one row per input.
+# They expect C-contiguous float64 arrays of shape (N, 3), (N, 4) or (N, 3, 3).
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def euler2quat_batch(const double[:, ::1] euler):
+    cdef Py_ssize_t i, n = euler.shape[0]
+    out = np.empty((n, 4))
+    cdef double[:, ::1] o = out
+    cdef Quaternion q
+    for i in range(n):
+        q = euler2quat_c(Vector3(euler[i, 0], euler[i, 1], euler[i, 2]))
+        o[i, 0] = q.w()
+        o[i, 1] = q.x()
+        o[i, 2] = q.y()
+        o[i, 3] = q.z()
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def quat2euler_batch(const double[:, ::1] quat):
+    cdef Py_ssize_t i, n = quat.shape[0]
+    out = np.empty((n, 3))
+    cdef double[:, ::1] o = out
+    cdef Vector3 e
+    for i in range(n):
+        e = quat2euler_c(Quaternion(quat[i, 0], quat[i, 1], quat[i, 2], quat[i, 3]))
+        o[i, 0] = e(0)
+        o[i, 1] = e(1)
+        o[i, 2] = e(2)
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def quat2rot_batch(const double[:, ::1] quat):
+    cdef Py_ssize_t i, n = quat.shape[0]
+    out = np.empty((n, 3, 3))
+    cdef double[:, :, ::1] o = out
+    for i in range(n):
+        matrix2ptr(quat2rot_c(Quaternion(quat[i, 0], quat[i, 1], quat[i, 2], quat[i, 3])), &o[i, 0, 0])
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def rot2quat_batch(rot):
+    cdef double[:, :, ::1] r = colmajor(rot)
+    cdef Py_ssize_t i, n = r.shape[0]
+    out = np.empty((n, 4))
+    cdef double[:, ::1] o = out
+    cdef Quaternion q
+    for i in range(n):
+        q = rot2quat_c(Matrix3(&r[i, 0, 0]))
+        o[i, 0] = q.w()
+        o[i, 1] = q.x()
+        o[i, 2] = q.y()
+        o[i, 3] = q.z()
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def euler2rot_batch(const double[:, ::1] euler):
+    cdef Py_ssize_t i, n = euler.shape[0]
+    out = np.empty((n, 3, 3))
+    cdef double[:, :, ::1] o = out
+    for i in range(n):
+        matrix2ptr(euler2rot_c(Vector3(euler[i, 0], euler[i, 1], euler[i, 2])), &o[i, 0, 0])
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def rot2euler_batch(rot):
+    cdef double[:, :, ::1] r = colmajor(rot)
+    cdef Py_ssize_t i, n = r.shape[0]
+    out = np.empty((n, 3))
+    cdef double[:, ::1] o = out
+    cdef Vector3 e
+    for i in range(n):
+        e = rot2euler_c(Matrix3(&r[i, 0, 0]))
+        o[i, 0] = e(0)
+        o[i, 1] = e(1)
+        o[i, 2] = e(2)
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def ecef_euler_from_ned_batch(ecef_init, const double[:, ::1] ned_pose):
+    cdef ECEF init = list2ecef(ecef_init)
+    cdef Py_ssize_t i, n = ned_pose.shape[0]
+    out = np.empty((n, 3))
+    cdef double[:, ::1] o = out
+    cdef Vector3 e
+    for i in range(n):
+        e = ecef_euler_from_ned_c(init, Vector3(ned_pose[i, 0], ned_pose[i, 1], ned_pose[i, 2]))
+        o[i, 0] = e(0)
+        o[i, 1] = e(1)
+        o[i, 2] = e(2)
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def ned_euler_from_ecef_batch(ecef_init, const double[:, ::1] ecef_pose):
+    cdef ECEF init = list2ecef(ecef_init)
+    cdef Py_ssize_t i, n = ecef_pose.shape[0]
+    out = np.empty((n, 3))
+    cdef double[:, ::1] o = out
+    cdef Vector3 e
+    for i in range(n):
+        e = ned_euler_from_ecef_c(init, Vector3(ecef_pose[i, 0], ecef_pose[i, 1], ecef_pose[i, 2]))
+        o[i, 0] = e(0)
+        o[i, 1] = e(1)
+        o[i, 2] = e(2)
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def geodetic2ecef_batch(const double[:, ::1] geodetic):
+    cdef Py_ssize_t i, n = geodetic.shape[0]
+    out = np.empty((n, 3))
+    cdef double[:, ::1] o = out
+    cdef ECEF e
+    for i in range(n):
+        e = geodetic2ecef_c(ptr2geodetic(&geodetic[i, 0]))
+        o[i, 0] = e.x
+        o[i, 1] = e.y
+        o[i, 2] = e.z
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def ecef2geodetic_batch(const double[:, ::1] ecef):
+    cdef Py_ssize_t i, n = ecef.shape[0]
+    out = np.empty((n, 3))
+    cdef double[:, ::1] o = out
+    cdef Geodetic g
+    for i in range(n):
+        g = ecef2geodetic_c(ptr2ecef(&ecef[i, 0]))
+        o[i, 0] = g.lat
+        o[i, 1] = g.lon
+        o[i, 2] = g.alt
+    return out
+
+
 cdef class LocalCoord:
     cdef LocalCoord_c * lc
 
@@ -170,5 +343,65 @@ cdef class LocalCoord:
         cdef Geodetic g = self.lc.ned2geodetic(n)
         return [g.lat, g.lon, g.alt]
 
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def ecef2ned_batch(self, const double[:, ::1] ecef):
+        assert self.lc
+        cdef Py_ssize_t i, n = ecef.shape[0]
+        out = np.empty((n, 3))
+        cdef double[:, ::1] o = out
+        cdef NED r
+        for i in range(n):
+            r = self.lc.ecef2ned(ptr2ecef(&ecef[i, 0]))
+            o[i, 0] = r.n
+            o[i, 1] = r.e
+            o[i, 2] = r.d
+        return out
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def ned2ecef_batch(self, const double[:, ::1] ned):
+        assert self.lc
+        cdef Py_ssize_t i, n = ned.shape[0]
+        out = np.empty((n, 3))
+        cdef double[:, ::1] o = out
+        cdef ECEF r
+        for i in range(n):
+            r = self.lc.ned2ecef(ptr2ned(&ned[i, 0]))
+            o[i, 0] = r.x
+            o[i, 1] = r.y
+            o[i, 2] = r.z
+        return out
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def geodetic2ned_batch(self, const double[:, ::1] geodetic):
+        assert self.lc
+        cdef Py_ssize_t i, n = geodetic.shape[0]
+        out = np.empty((n, 3))
+        cdef double[:, ::1] o = out
+        cdef NED r
+        for i in range(n):
+            r = self.lc.geodetic2ned(ptr2geodetic(&geodetic[i, 0]))
+            o[i, 0] = r.n
+            o[i, 1] = r.e
+            o[i, 2] = r.d
+        return out
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def ned2geodetic_batch(self, const double[:, ::1] ned):
+        assert self.lc
+        cdef Py_ssize_t i, n = ned.shape[0]
+        out = np.empty((n, 3))
+        cdef double[:, ::1] o = out
+        cdef Geodetic r
+        for i in range(n):
+            r = self.lc.ned2geodetic(ptr2ned(&ned[i, 0]))
+            o[i, 0] = r.lat
+            o[i, 1] = r.lon
+            o[i, 2] = r.alt
+        return out
+
     def __dealloc__(self):
         del self.lc
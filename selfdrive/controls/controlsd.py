@@ -7,8 +7,9 @@ from typing import SupportsFloat
 from cereal import car, log
 from openpilot.common.numpy_fast import clip
 from openpilot.common.realtime import config_realtime_process, Priority, Ratekeeper, DT_CTRL
-from openpilot.common.profiler import Profiler
+from openpilot.common.profiler import LoopTimer
 from openpilot.common.params import Params, put_nonblocking, put_bool_nonblocking
+from openpilot.common.params_watcher import ParamsWatcher
 import cereal.messaging as messaging
 from cereal.visionipc import VisionIpcClient, VisionStreamType
 from openpilot.common.conversions import Conversions as CV
@@ -79,6 +80,7 @@ class Controls:
     self.log_sock = messaging.sub_sock('androidLog')
 
     self.params = Params()
+    self.params_watcher = ParamsWatcher(["IsMetric", "ExperimentalMode"])
     self.sm = sm
     if self.sm is None:
       ignore = ['testJoystick']
@@ -201,7 +203,7 @@ class Controls:
 
     # controlsd is driven by can recv, expected at 100Hz
     self.rk = Ratekeeper(100, print_delay_threshold=None)
-    self.prof = Profiler(False)  # off by default
+    self.loop_timer = LoopTimer('controlsd')
 
   def set_initial_state(self):
     if REPLAY:
@@ -844,32 +846,34 @@ class Controls:
 
   def step(self):
     start_time = time.monotonic()
-    self.prof.checkpoint("Ratekeeper", ignore=True)
 
-    self.is_metric = self.params.get_bool("IsMetric")
-    self.experimental_mode = self.params.get_bool("ExperimentalMode") and self.CP.openpilotLongitudinalControl
+    self.params_watcher.update()
+    self.is_metric = self.params_watcher.get_bool("IsMetric")
+    self.experimental_mode = self.params_watcher.get_bool("ExperimentalMode") and self.CP.openpilotLongitudinalControl
 
     # Sample data from sockets and get a carState
     CS = self.data_sample()
     cloudlog.timestamp("Data sampled")
-    self.prof.checkpoint("Sample")
+    # sampling blocks on can, so time from here
+    self.loop_timer.start()
 
     self.update_events(CS)
     cloudlog.timestamp("Events updated")
+    self.loop_timer.checkpoint("events")
 
     if not self.read_only and self.initialized:
       # Update control state
       self.state_transition(CS)
-      self.prof.checkpoint("State transition")
+      self.loop_timer.checkpoint("state_transition")
 
     # Compute actuators (runs PID loops and lateral MPC)
     CC, lac_log = self.state_control(CS)
-
-    self.prof.checkpoint("State Control")
+    self.loop_timer.checkpoint("state_control")
 
     # Publish data
     self.publish_logs(CS, start_time, CC, lac_log)
-    self.prof.checkpoint("Sent")
+    self.loop_timer.checkpoint("publish")
+    self.loop_timer.end()
 
     self.CS_prev = CS
 
@@ -877,7 +881,6 @@ class Controls:
     while True:
       self.step()
       self.rk.monitor_time()
-      self.prof.display()
 
 
 def main(sm=None, pm=None, logcan=None):
@@ -0,0 +1,142 @@
+# cython: language_level=3
+# cython: profile=False
+
+# the acados cython wrapper is compiled into this module, so the solver's C pointers are reachable
+# from the subclass without changing the vendored acados_template, which build.sh replaces
+include "acados_ocp_solver_pyx.pyx"
+
+CONSTRAINTS_FIELDS = ['lbx', 'ubx', 'lbu', 'ubu']
+COST_FIELDS = ['y_ref', 'yref']
+OUT_FIELDS = ['x', 'u', 'z', 'pi', 'lam', 't', 'sl', 'su']
+
+
+cdef class AcadosOcpSolverStages(AcadosOcpSolverCython):
+  """
+  AcadosOcpSolverCython with setters and getters covering consecutive shooting nodes in a single call,
+  instead of one set() or get() call per stage.
+  """
+
+  def set_all(self, str field_, value_):
+    """
+    Set numerical data for consecutive shooting nodes, starting at stage 0.
+
+      :param field: string in ['p', 'yref', 'lbx', 'ubx', 'lbu', 'ubu', 'x', 'u', 'pi', 'lam', 't', 'sl', 'su']
+      :param value: 2D array with one row per stage.
+                    Rows are truncated to the dimension of each stage, e.g. the smaller terminal cost.
+    """
+    if not isinstance(value_, np.ndarray) or value_.ndim != 2:
+      raise Exception(f"AcadosOcpSolverStages.set_all(): value must be a 2D numpy array, got {type(value_)}.")
+    field = field_.encode('utf-8')
+
+    cdef cnp.ndarray[cnp.float64_t, ndim=2] value = np.ascontiguousarray(value_, dtype=np.float64)
+    cdef int n_stages = value.shape[0]
+    cdef int width = value.shape[1]
+    cdef int stage, dims
+    cdef double *data = <double *> value.data
+
+    if n_stages > self.N + 1:
+      raise Exception(f'AcadosOcpSolverStages.set_all(): got {n_stages} stages, solver has {self.N + 1}.')
+
+    if field_ == 'p':
+      for stage in range(n_stages):
+        assert acados_solver.acados_update_params(self.capsule, stage, data + stage * width, width) == 0
+      return
+
+    if field_ not in CONSTRAINTS_FIELDS + COST_FIELDS + OUT_FIELDS or field_ == 'z':
+      raise Exception(f"AcadosOcpSolverStages.set_all(): {field_} is not a valid argument.")
+
+    for stage in range(n_stages):
+      dims = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+        self.nlp_dims, self.nlp_out, stage, field)
+      if dims > width:
+        raise Exception(f'AcadosOcpSolverStages.set_all(): mismatching dimension for field "{field_}" ' +
+                        f'at stage {stage} with dimension {dims} (you have {width})')
+
+      if field_ in CONSTRAINTS_FIELDS:
+        acados_solver_common.ocp_nlp_constraints_model_set(self.nlp_config,
+          self.nlp_dims, self.nlp_in, stage, field, <void *> (data + stage * width))
+      elif field_ in COST_FIELDS:
+        acados_solver_common.ocp_nlp_cost_model_set(self.nlp_config,
+          self.nlp_dims, self.nlp_in, stage, field, <void *> (data + stage * width))
+      else:
+        acados_solver_common.ocp_nlp_out_set(self.nlp_config,
+          self.nlp_dims, self.nlp_out, stage, field, <void *> (data + stage * width))
+
+  def cost_set_all(self, str field_, value_):
+    """
+    Set numerical data in the cost module for consecutive shooting nodes, starting at stage 0.
+
+      :param field: string, e.g. 'yref', 'W', 'Zl'
+      :param value: 2D array with one vector per stage, or 3D array with one matrix per stage.
+                    Vectors are truncated to the dimension of each stage, matrices have to match it.
+    """
+    if not isinstance(value_, np.ndarray) or value_.ndim not in (2, 3):
+      raise Exception(f"AcadosOcpSolverStages.cost_set_all(): value must be a 2D or 3D numpy array, got {type(value_)}.")
+    field = field_.encode('utf-8')
+
+    cdef int n_stages = value_.shape[0]
+    if n_stages > self.N + 1:
+      raise Exception(f'AcadosOcpSolverStages.cost_set_all(): got {n_stages} stages, solver has {self.N + 1}.')
+
+    # matrices are stored column major, so each stage is transposed before making it contiguous
+    cdef cnp.ndarray value
+    if value_.ndim == 3:
+      value = np.ascontiguousarray(np.transpose(value_, (0, 2, 1)), dtype=np.float64)
+      value_shape = (value_.shape[1], value_.shape[2])
+    else:
+      value = np.ascontiguousarray(value_, dtype=np.float64)
+      value_shape = (value_.shape[1], 0)
+
+    cdef int stride = value.strides[0] // sizeof(double)
+    cdef double *data = <double *> value.data
+    cdef int dims[2]
+    cdef int stage
+    for stage in range(n_stages):
+      acados_solver_common.ocp_nlp_cost_dims_get_from_attr(self.nlp_config,
+        self.nlp_dims, self.nlp_out, stage, field, &dims[0])
+
+      if (value_.ndim == 3 and (value_shape[0] != dims[0] or value_shape[1] != dims[1])) or \
+         (value_.ndim == 2 and (value_shape[0] < dims[0] or dims[1] != 0)):
+        raise Exception(f'AcadosOcpSolverStages.cost_set_all(): mismatching dimension for field "{field_}" ' +
+                        f'at stage {stage} with dimension {(dims[0], dims[1])} (you have {value_shape})')
+
+      acados_solver_common.ocp_nlp_cost_model_set(self.nlp_config,
+        self.nlp_dims, self.nlp_in, stage, field, <void *> (data + stage * stride))
+
+  def get_all(self, str field_, out_=None):
+    """
+    Get the last solution of the solver for consecutive shooting nodes, starting at stage 0, one row per stage.
+
+      :param field: string in ['x', 'u', 'z', 'pi', 'lam', 't', 'sl', 'su']
+      :param out: optional C-contiguous float64 array to fill, its number of rows sets the number of stages.
+                  Defaults to N+1 stages, N for 'u' and 'pi'.
+    """
+    if field_ not in OUT_FIELDS:
+      raise Exception(f'AcadosOcpSolverStages.get_all(): {field_} is an invalid argument.')
+    field = field_.encode('utf-8')
+
+    cdef int dims = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+      self.nlp_dims, self.nlp_out, 0, field)
+
+    if out_ is None:
+      out_ = np.zeros((self.N if field_ in ('u', 'pi') else self.N + 1, dims))
+    if not isinstance(out_, np.ndarray) or out_.ndim != 2 or out_.dtype != np.float64 or not out_.flags['C_CONTIGUOUS']:
+      raise Exception('AcadosOcpSolverStages.get_all(): out must be a C-contiguous 2D float64 array.')
+
+    cdef cnp.ndarray[cnp.float64_t, ndim=2] out = out_
+    cdef int n_stages = out.shape[0]
+    cdef int width = out.shape[1]
+    cdef int stage
+    if n_stages > self.N + 1 or (n_stages > self.N and field_ == 'pi'):
+      raise Exception(f'AcadosOcpSolverStages.get_all(): too many stages ({n_stages}) for field {field_}.')
+
+    for stage in range(n_stages):
+      dims = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+        self.nlp_dims, self.nlp_out, stage, field)
+      if dims != width:
+        raise Exception(f'AcadosOcpSolverStages.get_all(): mismatching dimension for field "{field_}" ' +
+                        f'at stage {stage} with dimension {dims} (you have {width})')
+      acados_solver_common.ocp_nlp_out_get(self.nlp_config,
+        self.nlp_dims, self.nlp_out, stage, field, <void *> (<double *> out.data + stage * width))
+
+    return out_
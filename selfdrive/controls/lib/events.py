@@ -1,7 +1,7 @@
 import math
 import os
 from enum import IntEnum
-from typing import Dict, Union, Callable, List, Optional
+from typing import Dict, Union, Callable, List, Optional, Set
 
 from cereal import log, car
 import cereal.messaging as messaging
@@ -43,13 +43,16 @@ class ET:
 
 # get event name from enum
 EVENT_NAME = {v: k for k, v in EventName.schema.enumerants.items()}
+NUM_EVENTS = max(EVENT_NAME) + 1
 
 
 class Events:
   def __init__(self):
     self.events: List[int] = []
     self.static_events: List[int] = []
-    self.events_prev = dict.fromkeys(EVENTS.keys(), 0)
+    # number of consecutive frames each event has been active, indexed by event name
+    self.events_prev = [0] * NUM_EVENTS
+    self.active_prev: Set[int] = set()
 
   @property
   def names(self) -> List[int]:
@@ -64,7 +67,13 @@ class Events:
     self.events.append(event_name)
 
   def clear(self) -> None:
-    self.events_prev = {k: (v + 1 if k in self.events else 0) for k, v in self.events_prev.items()}
+    # only touch the counters of events that are active now or were active last frame
+    active = set(self.events)
+    for e in self.active_prev - active:
+      self.events_prev[e] = 0
+    for e in active:
+      self.events_prev[e] += 1
+    self.active_prev = active
     self.events = self.static_events.copy()
 
   def contains(self, event_type: str) -> bool:
@@ -76,17 +85,19 @@ class Events:
 
     ret = []
     for e in self.events:
-      types = EVENTS[e].keys()
+      alerts = EVENTS[e]
       for et in event_types:
-        if et in types:
-          alert = EVENTS[e][et]
-          if not isinstance(alert, Alert):
-            alert = alert(*callback_args)
-
-          if DT_CTRL * (self.events_prev[e] + 1) >= alert.creation_delay:
-            alert.alert_type = f"{EVENT_NAME[e]}/{et}"
-            alert.event_type = et
-            ret.append(alert)
+        alert = alerts.get(et)
+        if alert is None:
+          continue
+
+        if not isinstance(alert, Alert):
+          alert = alert(*callback_args)
+
+        if DT_CTRL * (self.events_prev[e] + 1) >= alert.creation_delay:
+          alert.alert_type = ALERT_TYPES[e][et]
+          alert.event_type = et
+          ret.append(alert)
     return ret
 
   def add_from_msg(self, events):
@@ -955,6 +966,9 @@ EVENTS: Dict[int, Dict[str, Union[Alert, AlertCallbackType]]] = {
 
 }
 
+# alert type names, built once instead of every cycle
+ALERT_TYPES: Dict[int, Dict[str, str]] = {e: {et: f"{EVENT_NAME[e]}/{et}" for et in alerts} for e, alerts in EVENTS.items()}
+
 
 if __name__ == '__main__':
   # print all alerts by type and priority
@@ -10,7 +10,7 @@ from openpilot.selfdrive.modeld.constants import T_IDXS
 if __name__ == '__main__':  # generating code
   from openpilot.third_party.acados.acados_template import AcadosModel, AcadosOcp, AcadosOcpSolver
 else:
-  from openpilot.selfdrive.controls.lib.lateral_mpc_lib.c_generated_code.acados_ocp_solver_pyx import AcadosOcpSolverCython
+  from openpilot.selfdrive.controls.lib.lateral_mpc_lib.c_generated_code.acados_stages_pyx import AcadosOcpSolverStages
 
 LAT_MPC_DIR = os.path.dirname(os.path.abspath(__file__))
 EXPORT_DIR = os.path.join(LAT_MPC_DIR, "c_generated_code")
@@ -132,7 +132,7 @@ class LateralMpc():
   def __init__(self, x0=None):
     if x0 is None:
       x0 = np.zeros(X_DIM)
-    self.solver = AcadosOcpSolverCython(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
+    self.solver = AcadosOcpSolverStages(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
     self.reset(x0)
 
   def reset(self, x0=None):
@@ -141,19 +141,19 @@ class LateralMpc():
     self.x_sol = np.zeros((N+1, X_DIM))
     self.u_sol = np.zeros((N, 1))
     self.yref = np.zeros((N+1, COST_DIM))
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
-    self.solver.cost_set(N, "yref", self.yref[N][:COST_E_DIM])
+    self.solver.cost_set_all("yref", self.yref)
 
     # Somehow needed for stable init
-    for i in range(N+1):
-      self.solver.set(i, 'x', np.zeros(X_DIM))
-      self.solver.set(i, 'p', np.zeros(P_DIM))
+    self.solver.set_all('x', np.zeros((N+1, X_DIM)))
+    self.solver.set_all('p', np.zeros((N+1, P_DIM)))
     self.solver.constraints_set(0, "lbx", x0)
     self.solver.constraints_set(0, "ubx", x0)
     self.solver.solve()
     self.solution_status = 0
     self.solve_time = 0.0
+    # wall time of run() and the part of it spent outside solve()
+    self.run_time = 0.0
+    self.overhead_time = 0.0
     self.cost = 0
 
   def set_weights(self, path_weight, heading_weight,
@@ -162,11 +162,11 @@ class LateralMpc():
     W = np.asfortranarray(np.diag([path_weight, heading_weight,
                                    lat_accel_weight, lat_jerk_weight,
                                    steering_rate_weight]))
-    for i in range(N):
-      self.solver.cost_set(i, 'W', W)
+    self.solver.cost_set_all('W', np.tile(W, (N, 1, 1)))
     self.solver.cost_set(N, 'W', W[:COST_E_DIM,:COST_E_DIM])
 
   def run(self, x0, p, y_pts, heading_pts, yaw_rate_pts):
+    t0 = time.monotonic()
     x0_cp = np.copy(x0)
     p_cp = np.copy(p)
     self.solver.constraints_set(0, "lbx", x0_cp)
@@ -176,22 +176,20 @@ class LateralMpc():
     # rotation_radius = p_cp[1]
     self.yref[:,1] = heading_pts * (v_ego + SPEED_OFFSET)
     self.yref[:,2] = yaw_rate_pts * (v_ego + SPEED_OFFSET)
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
-      self.solver.set(i, "p", p_cp[i])
-    self.solver.set(N, "p", p_cp[N])
-    self.solver.cost_set(N, "yref", self.yref[N][:COST_E_DIM])
+    self.solver.cost_set_all("yref", self.yref)
+    self.solver.set_all("p", p_cp)
 
     t = time.monotonic()
     self.solution_status = self.solver.solve()
     self.solve_time = time.monotonic() - t
 
-    for i in range(N+1):
-      self.x_sol[i] = self.solver.get(i, 'x')
-    for i in range(N):
-      self.u_sol[i] = self.solver.get(i, 'u')
+    self.solver.get_all('x', self.x_sol)
+    self.solver.get_all('u', self.u_sol)
     self.cost = self.solver.get_cost()
 
+    self.run_time = time.monotonic() - t0
+    self.overhead_time = self.run_time - self.solve_time
+
 
 if __name__ == "__main__":
   ocp = gen_lat_ocp()
@@ -13,7 +13,7 @@ from openpilot.selfdrive.controls.radard import _LEAD_ACCEL_TAU
 if __name__ == '__main__':  # generating code
   from openpilot.third_party.acados.acados_template import AcadosModel, AcadosOcp, AcadosOcpSolver
 else:
-  from openpilot.selfdrive.controls.lib.longitudinal_mpc_lib.c_generated_code.acados_ocp_solver_pyx import AcadosOcpSolverCython
+  from openpilot.selfdrive.controls.lib.longitudinal_mpc_lib.c_generated_code.acados_stages_pyx import AcadosOcpSolverStages
 
 from casadi import SX, vertcat
 
@@ -222,12 +222,12 @@ def gen_long_ocp():
 class LongitudinalMpc:
   def __init__(self, mode='acc'):
     self.mode = mode
-    self.solver = AcadosOcpSolverCython(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
+    self.solver = AcadosOcpSolverStages(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
     self.reset()
     self.source = SOURCES[2]
 
   def reset(self):
-    # self.solver = AcadosOcpSolverCython(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
+    # self.solver = AcadosOcpSolverStages(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
     self.solver.reset()
     # self.solver.options_set('print_level', 2)
     self.v_solution = np.zeros(N+1)
@@ -235,14 +235,11 @@ class LongitudinalMpc:
     self.prev_a = np.array(self.a_solution)
     self.j_solution = np.zeros(N)
     self.yref = np.zeros((N+1, COST_DIM))
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
-    self.solver.cost_set(N, "yref", self.yref[N][:COST_E_DIM])
+    self.solver.cost_set_all("yref", self.yref)
     self.x_sol = np.zeros((N+1, X_DIM))
     self.u_sol = np.zeros((N,1))
     self.params = np.zeros((N+1, PARAM_DIM))
-    for i in range(N+1):
-      self.solver.set(i, 'x', np.zeros(X_DIM))
+    self.solver.set_all('x', self.x_sol)
     self.last_cloudlog_t = 0
     self.status = False
     self.crash_cnt = 0.0
@@ -252,24 +249,25 @@ class LongitudinalMpc:
     self.time_qp_solution = 0.0
     self.time_linearization = 0.0
     self.time_integrator = 0.0
+    # wall time of run() and the part of it spent outside solve()
+    self.run_time = 0.0
+    self.overhead_time = 0.0
     self.x0 = np.zeros(X_DIM)
     self.set_weights()
 
   def set_cost_weights(self, cost_weights, constraint_cost_weights):
-    W = np.asfortranarray(np.diag(cost_weights))
-    for i in range(N):
-      # TODO don't hardcode A_CHANGE_COST idx
-      # reduce the cost on (a-a_prev) later in the horizon.
-      W[4,4] = cost_weights[4] * np.interp(T_IDXS[i], [0.0, 1.0, 2.0], [1.0, 1.0, 0.0])
-      self.solver.cost_set(i, 'W', W)
+    W = np.tile(np.diag(cost_weights), (N, 1, 1))
+    # TODO don't hardcode A_CHANGE_COST idx
+    # reduce the cost on (a-a_prev) later in the horizon.
+    W[:,4,4] = cost_weights[4] * np.interp(T_IDXS[:N], [0.0, 1.0, 2.0], [1.0, 1.0, 0.0])
+    self.solver.cost_set_all('W', W)
     # Setting the slice without the copy make the array not contiguous,
     # causing issues with the C interface.
-    self.solver.cost_set(N, 'W', np.copy(W[:COST_E_DIM, :COST_E_DIM]))
+    self.solver.cost_set(N, 'W', np.copy(W[N-1, :COST_E_DIM, :COST_E_DIM]))
 
     # Set L2 slack cost on lower bound constraints
     Zl = np.array(constraint_cost_weights)
-    for i in range(N):
-      self.solver.cost_set(i, 'Zl', Zl)
+    self.solver.cost_set_all('Zl', np.tile(Zl, (N, 1)))
 
   def set_weights(self, prev_accel_constraint=True, personality=log.LongitudinalPersonality.standard):
     jerk_factor = get_jerk_factor(personality)
@@ -290,8 +288,7 @@ class LongitudinalMpc:
     self.x0[1] = v
     self.x0[2] = a
     if abs(v_prev - v) > 2.:  # probably only helps if v < v_prev
-      for i in range(0, N+1):
-        self.solver.set(i, 'x', self.x0)
+      self.solver.set_all('x', np.tile(self.x0, (N+1, 1)))
 
   @staticmethod
   def extrapolate_lead(x_lead, v_lead, a_lead, a_lead_tau):
@@ -386,9 +383,7 @@ class LongitudinalMpc:
     self.yref[:,2] = v
     self.yref[:,3] = a
     self.yref[:,5] = j
-    for i in range(N):
-      self.solver.set(i, "yref", self.yref[i])
-    self.solver.set(N, "yref", self.yref[N][:COST_E_DIM])
+    self.solver.set_all("yref", self.yref)
 
     self.params[:,2] = np.min(x_obstacles, axis=1)
     self.params[:,3] = np.copy(self.prev_a)
@@ -411,14 +406,15 @@ class LongitudinalMpc:
         self.source = 'lead1'
 
   def run(self):
-    # t0 = time.monotonic()
+    t0 = time.monotonic()
     # reset = 0
-    for i in range(N+1):
-      self.solver.set(i, 'p', self.params[i])
+    self.solver.set_all('p', self.params)
     self.solver.constraints_set(0, "lbx", self.x0)
     self.solver.constraints_set(0, "ubx", self.x0)
 
+    t_solve = time.monotonic()
     self.solution_status = self.solver.solve()
+    t_solve = time.monotonic() - t_solve
     self.solve_time = float(self.solver.get_stats('time_tot')[0])
     self.time_qp_solution = float(self.solver.get_stats('time_qp')[0])
     self.time_linearization = float(self.solver.get_stats('time_lin')[0])
@@ -431,10 +427,8 @@ class LongitudinalMpc:
     # print(f"long_mpc residuals: {res[0]:.2e}, {res[1]:.2e}, {res[2]:.2e}, {res[3]:.2e}")
     # self.solver.print_statistics()
 
-    for i in range(N+1):
-      self.x_sol[i] = self.solver.get(i, 'x')
-    for i in range(N):
-      self.u_sol[i] = self.solver.get(i, 'u')
+    self.solver.get_all('x', self.x_sol)
+    self.solver.get_all('u', self.u_sol)
 
     self.v_solution = self.x_sol[:,1]
     self.a_solution = self.x_sol[:,2]
@@ -449,6 +443,9 @@ class LongitudinalMpc:
         cloudlog.warning(f"Long mpc reset, solution_status: {self.solution_status}")
       self.reset()
       # reset = 1
+
+    self.run_time = time.monotonic() - t0
+    self.overhead_time = self.run_time - t_solve
     # print(f"long_mpc timings: total internal {self.solve_time:.2e}, external: {(time.monotonic() - t0):.2e} qp {self.time_qp_solution:.2e}, \
     # lin {self.time_linearization:.2e} qp_iter {qp_iter}, reset {reset}")
 
@@ -2,7 +2,7 @@
 import math
 import numpy as np
 from openpilot.common.numpy_fast import clip, interp
-from openpilot.common.params import Params
+from openpilot.common.params_watcher import ParamsWatcher
 from cereal import log
 
 import cereal.messaging as messaging
@@ -60,14 +60,13 @@ class LongitudinalPlanner:
     self.a_desired_trajectory = np.zeros(CONTROL_N)
     self.j_desired_trajectory = np.zeros(CONTROL_N)
     self.solverExecutionTime = 0.0
-    self.params = Params()
-    self.param_read_counter = 0
+    self.params_watcher = ParamsWatcher(['LongitudinalPersonality'])
     self.read_param()
     self.personality = log.LongitudinalPersonality.standard
 
   def read_param(self):
     try:
-      self.personality = int(self.params.get('LongitudinalPersonality'))
+      self.personality = int(self.params_watcher.get('LongitudinalPersonality'))
     except (ValueError, TypeError):
       self.personality = log.LongitudinalPersonality.standard
 
@@ -88,9 +87,8 @@ class LongitudinalPlanner:
     return x, v, a, j
 
   def update(self, sm):
-    if self.param_read_counter % 50 == 0:
-      self.read_param()
-    self.param_read_counter += 1
+    self.params_watcher.update()
+    self.read_param()
     self.mpc.mode = 'blended' if sm['controlsState'].experimentalMode else 'acc'
 
     v_ego = sm['carState'].vEgo
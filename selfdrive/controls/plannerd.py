@@ -3,6 +3,7 @@ import os
 import numpy as np
 from cereal import car
 from openpilot.common.params import Params
+from openpilot.common.profiler import LoopTimer
 from openpilot.common.realtime import Priority, config_realtime_process
 from openpilot.system.swaglog import cloudlog
 from openpilot.selfdrive.modeld.constants import T_IDXS
@@ -48,15 +49,27 @@ def plannerd_thread(sm=None, pm=None):
   if pm is None:
     pm = messaging.PubMaster(['longitudinalPlan', 'lateralPlan', 'uiPlan'])
 
+  loop_timer = LoopTimer('plannerd')
+
   while True:
     sm.update()
 
     if sm.updated['modelV2']:
+      loop_timer.start()
       lateral_planner.update(sm)
+      loop_timer.checkpoint("lateral_update")
       lateral_planner.publish(sm, pm)
       longitudinal_planner.update(sm)
+      loop_timer.checkpoint("longitudinal_update")
       longitudinal_planner.publish(sm, pm)
       publish_ui_plan(sm, pm, lateral_planner, longitudinal_planner)
+      loop_timer.checkpoint("publish")
+      # time in the solvers and in the python around them, of the updates above
+      loop_timer.record("lat_mpc_solve", lateral_planner.lat_mpc.solve_time)
+      loop_timer.record("lat_mpc_overhead", lateral_planner.lat_mpc.overhead_time)
+      loop_timer.record("long_mpc_solve", longitudinal_planner.mpc.solve_time)
+      loop_timer.record("long_mpc_overhead", longitudinal_planner.mpc.overhead_time)
+      loop_timer.end()
 
 def main(sm=None, pm=None):
   plannerd_thread(sm, pm)
@@ -8,6 +8,7 @@ import capnp
 from cereal import messaging, log, car
 from openpilot.common.numpy_fast import interp
 from openpilot.common.params import Params
+from openpilot.common.profiler import LoopTimer
 from openpilot.common.realtime import Ratekeeper, Priority, config_realtime_process
 from openpilot.system.swaglog import cloudlog
 
@@ -303,6 +304,7 @@ def radard_thread(sm: Optional[messaging.SubMaster] = None, pm: Optional[messagi
 
   rk = Ratekeeper(1.0 / CP.radarTimeStep, print_delay_threshold=None)
   RD = RadarD(CP.radarTimeStep, RI.delay)
+  loop_timer = LoopTimer('radard')
 
   while 1:
     can_strings = messaging.drain_sock_raw(can_sock, wait_for_one=True)
@@ -313,8 +315,12 @@ def radard_thread(sm: Optional[messaging.SubMaster] = None, pm: Optional[messagi
 
     sm.update(0)
 
+    loop_timer.start()
     RD.update(sm, rr)
+    loop_timer.checkpoint("update")
     RD.publish(pm, -rk.remaining*1000.0)
+    loop_timer.checkpoint("publish")
+    loop_timer.end()
 
     rk.monitor_time()
 
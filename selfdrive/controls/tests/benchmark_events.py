@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import argparse
+import timeit
+
+from openpilot.selfdrive.controls.lib.events import Events, ET
+from openpilot.selfdrive.controls.tests.test_events import LegacyEvents, random_cycles
+
+
+def run(es, cycles):
+  for cycle in cycles:
+    for e in cycle:
+      es.add(e)
+    es.create_alerts([ET.PERMANENT, ET.WARNING])
+    es.clear()
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Per-cycle cost of the controlsd events bookkeeping, typical case of a few active events",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--cycles", type=int, default=1000)
+  parser.add_argument("--number", type=int, default=5)
+  args = parser.parse_args()
+
+  cycles = random_cycles(args.cycles)
+  for name, cls in (("events", Events), ("legacy", LegacyEvents)):
+    t = timeit.timeit(lambda: run(cls(), cycles), number=args.number) / (args.number * len(cycles))  # noqa: B023
+    print(f"{name:>6s}: {t * 1e6:.2f} us/cycle")
+
+
+if __name__ == "__main__":
+  main()
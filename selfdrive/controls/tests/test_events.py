@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+from cereal import car
+from openpilot.selfdrive.controls.lib.events import Events, EVENTS, ET
+
+EventName = car.CarEvent.EventName
+
+
+class LegacyEvents(Events):
+  # events_prev bookkeeping before it was indexed by event name
+  def __init__(self):
+    super().__init__()
+    self.events_prev = dict.fromkeys(EVENTS.keys(), 0)
+
+  def clear(self):
+    self.events_prev = {k: (v + 1 if k in self.events else 0) for k, v in self.events_prev.items()}
+    self.events = self.static_events.copy()
+
+
+def random_cycles(n, seed=0):
+  rng = random.Random(seed)
+  names = [e for e, alerts in EVENTS.items() if all(not callable(a) for a in alerts.values())]
+  active = rng.sample(names, 5)
+  cycles = []
+  for _ in range(n):
+    # mostly persistent events, like a drive
+    if rng.random() < 0.05:
+      active[rng.randrange(len(active))] = rng.choice(names)
+    cycles.append([e for e in active if rng.random() < 0.9])
+  return cycles
+
+
+class TestEvents(unittest.TestCase):
+  def test_counters_match_legacy(self):
+    events, legacy = Events(), LegacyEvents()
+    for es in (events, legacy):
+      es.add(EventName.wrongGear, static=True)
+
+    for cycle in random_cycles(2000):
+      for es in (events, legacy):
+        for e in cycle:
+          es.add(e)
+
+      self.assertEqual(events.names, legacy.names)
+      for e in EVENTS:
+        self.assertEqual(events.events_prev[e], legacy.events_prev[e])
+
+      alert_types = [ET.PERMANENT, ET.WARNING, ET.NO_ENTRY, ET.SOFT_DISABLE]
+      alerts = [(a.alert_type, a.event_type) for a in events.create_alerts(alert_types)]
+      legacy_alerts = [(a.alert_type, a.event_type) for a in legacy.create_alerts(alert_types)]
+      self.assertEqual(alerts, legacy_alerts)
+
+      for es in (events, legacy):
+        es.clear()
+
+
+if __name__ == "__main__":
+  unittest.main()
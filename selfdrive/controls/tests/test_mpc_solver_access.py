@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+import unittest
+import numpy as np
+
+from openpilot.selfdrive.controls.lib.drive_helpers import CAR_ROTATION_RADIUS
+from openpilot.selfdrive.controls.lib.lateral_mpc_lib import lat_mpc
+from openpilot.selfdrive.controls.lib.lateral_mpc_lib.lat_mpc import LateralMpc
+from openpilot.selfdrive.controls.lib.longitudinal_mpc_lib import long_mpc
+from openpilot.selfdrive.controls.lib.longitudinal_mpc_lib.long_mpc import LongitudinalMpc
+
+
+def solve_per_stage(solver, n, x0, p, yref, W, cost_e_dim, yref_cost=True, Zl=None):
+  # one call per stage, as the planners did before the bulk accessors
+  for i in range(n):
+    solver.cost_set(i, 'W', W[i])
+    if Zl is not None:
+      solver.cost_set(i, 'Zl', Zl[i])
+  solver.cost_set(n, 'W', np.copy(W[n-1, :cost_e_dim, :cost_e_dim]))
+  set_yref = solver.cost_set if yref_cost else solver.set
+  for i in range(n):
+    set_yref(i, 'yref', yref[i])
+  set_yref(n, 'yref', yref[n][:cost_e_dim])
+  for i in range(n+1):
+    solver.set(i, 'p', p[i])
+  solver.constraints_set(0, 'lbx', x0)
+  solver.constraints_set(0, 'ubx', x0)
+  status = solver.solve()
+  return status, np.array([solver.get(i, 'x') for i in range(n+1)]), np.array([solver.get(i, 'u') for i in range(n)])
+
+
+def solve_bulk(solver, n, x0, p, yref, W, cost_e_dim, yref_cost=True, Zl=None):
+  solver.cost_set_all('W', W)
+  if Zl is not None:
+    solver.cost_set_all('Zl', Zl)
+  solver.cost_set(n, 'W', np.copy(W[n-1, :cost_e_dim, :cost_e_dim]))
+  # the terminal row is truncated to the terminal cost dims
+  (solver.cost_set_all if yref_cost else solver.set_all)('yref', yref)
+  solver.set_all('p', p)
+  solver.constraints_set(0, 'lbx', x0)
+  solver.constraints_set(0, 'ubx', x0)
+  status = solver.solve()
+  return status, solver.get_all('x'), solver.get_all('u')
+
+
+class TestMpcSolverAccess(unittest.TestCase):
+  def setUp(self):
+    self.rng = np.random.default_rng(0)
+
+  def test_round_trip(self):
+    solver = LateralMpc().solver
+    N, X_DIM = lat_mpc.N, lat_mpc.X_DIM
+
+    x = self.rng.normal(size=(N+1, X_DIM))
+    solver.set_all('x', x)
+    for i in range(N+1):
+      np.testing.assert_array_equal(solver.get(i, 'x'), x[i])
+    np.testing.assert_array_equal(solver.get_all('x'), x)
+
+    # u has no terminal stage
+    u = self.rng.normal(size=(N, 1))
+    for i in range(N):
+      solver.set(i, 'u', u[i])
+    out = np.zeros((N, 1))
+    self.assertIs(solver.get_all('u', out), out)
+    np.testing.assert_array_equal(out, u)
+
+    # fewer rows than stages only sets the first ones
+    solver.set_all('x', np.zeros((2, X_DIM)))
+    np.testing.assert_array_equal(solver.get_all('x')[:2], 0.)
+    np.testing.assert_array_equal(solver.get_all('x')[2:], x[2:])
+
+  def test_dims(self):
+    solver = LateralMpc().solver
+    N, X_DIM = lat_mpc.N, lat_mpc.X_DIM
+
+    with self.assertRaisesRegex(Exception, f'got {N+2} stages'):
+      solver.set_all('x', np.zeros((N+2, X_DIM)))
+    with self.assertRaisesRegex(Exception, 'mismatching dimension'):
+      solver.set_all('x', np.zeros((N+1, X_DIM-1)))
+    with self.assertRaisesRegex(Exception, 'mismatching dimension'):
+      solver.get_all('x', np.zeros((N+1, X_DIM+1)))
+    with self.assertRaisesRegex(Exception, 'C-contiguous'):
+      solver.get_all('x', np.zeros((N+1, X_DIM), order='F'))
+    with self.assertRaisesRegex(Exception, 'too many stages'):
+      solver.get_all('x', np.zeros((N+2, X_DIM)))
+    # the terminal stage has no u
+    with self.assertRaisesRegex(Exception, 'mismatching dimension'):
+      solver.get_all('u', np.zeros((N+1, 1)))
+    with self.assertRaisesRegex(Exception, 'mismatching dimension'):
+      solver.cost_set_all('W', np.zeros((N, lat_mpc.COST_DIM+1, lat_mpc.COST_DIM+1)))
+
+  def test_lateral_matches_per_stage(self):
+    N, COST_DIM = lat_mpc.N, lat_mpc.COST_DIM
+    x0 = np.array([0., 0.5, 0.05, 0.001])
+    p = np.column_stack([20. * np.ones(N+1), CAR_ROTATION_RADIUS * np.ones(N+1)])
+    W = np.tile(np.diag([1., .1, 0., .05, 800.]), (N, 1, 1))
+
+    ref, bulk = LateralMpc().solver, LateralMpc().solver
+    for _ in range(3):
+      yref = np.zeros((N+1, COST_DIM))
+      yref[:, :3] = self.rng.normal(scale=0.1, size=(N+1, 3))
+      expected = solve_per_stage(ref, N, x0, p, yref, W, lat_mpc.COST_E_DIM)
+      status, x_sol, u_sol = solve_bulk(bulk, N, x0, p, yref, W, lat_mpc.COST_E_DIM)
+      self.assertEqual(status, expected[0])
+      np.testing.assert_array_equal(x_sol, expected[1])
+      np.testing.assert_array_equal(u_sol, expected[2])
+
+  def test_longitudinal_matches_per_stage(self):
+    N, COST_DIM = long_mpc.N, long_mpc.COST_DIM
+    x0 = np.array([0., 15., 0.])
+    p = np.zeros((N+1, long_mpc.PARAM_DIM))
+    p[:, 0] = long_mpc.ACCEL_MIN
+    p[:, 1] = 2.
+    p[:, 2] = 60. + 10. * long_mpc.T_IDXS
+    p[:, 4] = 1.45
+    p[:, 5] = 1.
+    # stage dependent weights, as set by set_cost_weights
+    W = np.tile(np.diag([1., .2, .25, 1., 10., 5.]), (N, 1, 1))
+    W[:, 4, 4] *= np.linspace(1., 0.1, N)
+    Zl = np.tile([3e4, 3e4, 3e4, 100.], (N, 1))
+
+    ref, bulk = LongitudinalMpc().solver, LongitudinalMpc().solver
+    for _ in range(3):
+      yref = np.zeros((N+1, COST_DIM))
+      yref[:, 1] = 15. * long_mpc.T_IDXS + self.rng.normal(size=N+1)
+      yref[:, 2] = 15. + self.rng.normal(size=N+1)
+      expected = solve_per_stage(ref, N, x0, p, yref, W, long_mpc.COST_E_DIM, yref_cost=False, Zl=Zl)
+      status, x_sol, u_sol = solve_bulk(bulk, N, x0, p, yref, W, long_mpc.COST_E_DIM, yref_cost=False, Zl=Zl)
+      self.assertEqual(status, expected[0])
+      np.testing.assert_array_equal(x_sol, expected[1])
+      np.testing.assert_array_equal(u_sol, expected[2])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -10,12 +10,13 @@ import gc
 import os
 import capnp
 import numpy as np
-from typing import List, NoReturn, Optional
+from typing import List, NamedTuple, NoReturn, Optional
 
 from cereal import log
 import cereal.messaging as messaging
 from openpilot.common.conversions import Conversions as CV
 from openpilot.common.params import Params, put_nonblocking
+from openpilot.common.profiler import LoopTimer
 from openpilot.common.realtime import set_realtime_priority
 from openpilot.common.transformations.orientation import rot_from_euler, euler_from_rot
 from openpilot.system.swaglog import cloudlog
@@ -46,16 +47,40 @@ def is_calibration_valid(rpy: np.ndarray) -> bool:
   return (PITCH_LIMITS[0] < rpy[1] < PITCH_LIMITS[1]) and (YAW_LIMITS[0] < rpy[2] < YAW_LIMITS[1])  # type: ignore
 
 
-def sanity_clip(rpy: np.ndarray) -> np.ndarray:
-  if np.isnan(rpy).any():
-    rpy = RPY_INIT
-  return np.array([rpy[0],
-                   np.clip(rpy[1], PITCH_LIMITS[0] - .005, PITCH_LIMITS[1] + .005),
-                   np.clip(rpy[2], YAW_LIMITS[0] - .005, YAW_LIMITS[1] + .005)])
+def sanity_clip(rpys: np.ndarray) -> np.ndarray:
+  rpys = np.where(np.isnan(rpys).any(axis=1, keepdims=True), RPY_INIT, rpys)
+  return np.stack([rpys[:, 0],
+                   np.clip(rpys[:, 1], PITCH_LIMITS[0] - .005, PITCH_LIMITS[1] + .005),
+                   np.clip(rpys[:, 2], YAW_LIMITS[0] - .005, YAW_LIMITS[1] + .005)], axis=1)
+
+
+def observed_rpys_from_trans(trans: np.ndarray) -> np.ndarray:
+  """Roll, pitch and yaw of the camera relative to the direction of travel, for rows of cameraOdometry trans"""
+  return np.stack([np.zeros(len(trans)),
+                   -np.arctan2(trans[:, 2], trans[:, 0]),
+                   np.arctan2(trans[:, 1], trans[:, 0])], axis=1)
+
+
+def new_rpys_from_observed(smooth_rpys: np.ndarray, observed_rpys: np.ndarray) -> np.ndarray:
+  """Calibration that each observation implies, given the calibration it was made with"""
+  return sanity_clip(euler_from_rot(np.matmul(rot_from_euler(smooth_rpys), rot_from_euler(observed_rpys))))
+
 
 def moving_avg_with_linear_decay(prev_mean: np.ndarray, new_val: np.ndarray, idx: int, block_size: float) -> np.ndarray:
   return (idx*prev_mean + (block_size - idx) * new_val) / block_size
 
+
+class CalibrationTrajectory(NamedTuple):
+  """Calibration after each cameraOdometry sample, as it would be published in liveCalibration"""
+  new_rpy: np.ndarray  # NaN for samples that were not used
+  rpy_calib: np.ndarray
+  wide_from_device_euler: np.ndarray
+  height: np.ndarray
+  valid_blocks: np.ndarray
+  cal_status: np.ndarray
+  cal_perc: np.ndarray
+
+
 class Calibrator:
   def __init__(self, param_put: bool = False):
     self.param_put = param_put
@@ -194,11 +219,8 @@ class Calibrator:
     if not (straight_and_fast and certain_if_calib):
       return None
 
-    observed_rpy = np.array([0,
-                             -np.arctan2(trans[2], trans[0]),
-                             np.arctan2(trans[1], trans[0])])
-    new_rpy = euler_from_rot(rot_from_euler(self.get_smooth_rpy()).dot(rot_from_euler(observed_rpy)))
-    new_rpy = sanity_clip(new_rpy)
+    observed_rpy = observed_rpys_from_trans(np.array([[trans[0], trans[1], trans[2]]]))
+    new_rpy = new_rpys_from_observed(np.array([self.get_smooth_rpy()]), observed_rpy)[0]
 
     if len(wide_from_device_euler) == 3:
       new_wide_from_device_euler = np.array(wide_from_device_euler)
@@ -225,6 +247,116 @@ class Calibrator:
 
     return new_rpy
 
+  def get_cal_perc(self) -> int:
+    return min(100 * (self.valid_blocks * BLOCK_SIZE + self.idx) // (INPUTS_NEEDED * BLOCK_SIZE), 100)
+
+  def handle_cam_odom_batch(self, v_ego: np.ndarray,
+                                  trans: np.ndarray,
+                                  rot: np.ndarray,
+                                  wide_from_device_euler: Optional[np.ndarray],
+                                  trans_std: np.ndarray,
+                                  road_transform_trans: Optional[np.ndarray],
+                                  road_transform_trans_std: Optional[np.ndarray]) -> CalibrationTrajectory:
+    """
+    Same as handle_v_ego and handle_cam_odom for each of N cameraOdometry samples, given as arrays with
+    a row per sample, with the same results. The optional inputs can be None, like an empty list for
+    handle_cam_odom.
+
+    The calibration only changes when a block is complete, so all samples that go into a block are
+    filtered, rotated and clipped at once. Only the running average of the block is updated per sample,
+    with the same operations as handle_cam_odom.
+    """
+    v_ego = np.asarray(v_ego, dtype=np.float64)
+    n = len(v_ego)
+    trans, rot, trans_std = (np.asarray(a, dtype=np.float64).reshape(n, 3) for a in (trans, rot, trans_std))
+
+    straight_and_fast = (v_ego > MIN_SPEED_FILTER) & (trans[:, 0] > MIN_SPEED_FILTER) & (np.abs(rot[:, 2]) < MAX_YAW_RATE_FILTER)
+    certain = np.arctan2(trans_std[:, 1], trans[:, 0]) < MAX_VEL_ANGLE_STD
+    if road_transform_trans_std is not None:
+      certain &= np.asarray(road_transform_trans_std, dtype=np.float64).reshape(n, 3)[:, 2] < MAX_HEIGHT_STD
+    # samples used when calibrated, and before INPUTS_NEEDED blocks
+    used_idxs = (np.flatnonzero(straight_and_fast & certain), np.flatnonzero(straight_and_fast))
+
+    observed_rpys = observed_rpys_from_trans(trans)
+    new_wide_from_device_eulers = np.tile(WIDE_FROM_DEVICE_EULER_INIT, (n, 1)) if wide_from_device_euler is None else \
+                                  np.asarray(wide_from_device_euler, dtype=np.float64).reshape(n, 3)
+    new_heights = np.tile(HEIGHT_INIT, (n, 1)) if road_transform_trans is None else \
+                  np.asarray(road_transform_trans, dtype=np.float64).reshape(n, 3)[:, 2:]
+
+    ret = CalibrationTrajectory(np.full((n, 3), np.nan), np.zeros((n, 3)), np.zeros((n, 3)), np.zeros((n, 1)),
+                                np.zeros(n, dtype=int), np.zeros(n, dtype=int), np.zeros(n, dtype=int))
+
+    def record(sl, old_rpy_weights, idxs):
+      smooth = old_rpy_weights[:, None] > 0
+      ret.rpy_calib[sl] = np.where(smooth, old_rpy_weights[:, None] * self.old_rpy + (1.0 - old_rpy_weights[:, None]) * self.rpy, self.rpy)
+      ret.wide_from_device_euler[sl] = self.wide_from_device_euler
+      ret.height[sl] = self.height
+      ret.valid_blocks[sl] = self.valid_blocks
+      ret.cal_status[sl] = self.cal_status
+      ret.cal_perc[sl] = np.minimum(100 * (self.valid_blocks * BLOCK_SIZE + idxs) // (INPUTS_NEEDED * BLOCK_SIZE), 100)
+
+    # update_status may change the calibration on the first used sample, after that only when a block is complete
+    status_updated = False
+    i = 0
+    while i < n:
+      idxs = used_idxs[self.valid_blocks < INPUTS_NEEDED]
+      start = np.searchsorted(idxs, i)
+      wanted = BLOCK_SIZE - self.idx if status_updated else 1
+      used = idxs[start:start + wanted]
+      end = used[-1] + 1 if len(used) == wanted else n
+
+      old_rpy_weights = np.zeros(end - i)
+      old_rpy_weight = self.old_rpy_weight
+      for k in range(end - i):
+        if old_rpy_weight <= 0:
+          break
+        old_rpy_weight = max(0.0, old_rpy_weight - 1/SMOOTH_CYCLES)
+        old_rpy_weights[k] = old_rpy_weight
+      self.old_rpy_weight = old_rpy_weight
+
+      if len(used):
+        weights = old_rpy_weights[used - i, None]
+        smooth_rpys = np.where(weights > 0, weights * self.old_rpy + (1.0 - weights) * self.rpy, self.rpy)
+        new_rpys = new_rpys_from_observed(smooth_rpys, observed_rpys[used])
+        ret.new_rpy[used] = new_rpys
+
+        # same operations on the block averages as one sample at a time
+        new_vals = np.hstack([new_rpys, new_wide_from_device_eulers[used], new_heights[used]])
+        block = np.hstack([self.rpys[self.block_idx], self.wide_from_device_eulers[self.block_idx], self.heights[self.block_idx]])
+        for k, new_val in enumerate(new_vals):
+          block = moving_avg_with_linear_decay(block, new_val, self.idx + k, float(BLOCK_SIZE))
+        self.rpys[self.block_idx], self.wide_from_device_eulers[self.block_idx], self.heights[self.block_idx] = block[:3], block[3:6], block[6:]
+
+      # samples before the last used one see the calibration as it was
+      last = end - 1 if len(used) == wanted else end
+      used_before = np.cumsum(np.isin(np.arange(i, last), used))
+      record(slice(i, last), old_rpy_weights[:last - i], self.idx + used_before)
+
+      if len(used) == wanted:
+        self.idx = (self.idx + len(used)) % BLOCK_SIZE
+        if self.idx == 0:
+          self.block_idx += 1
+          self.valid_blocks = max(self.block_idx, self.valid_blocks)
+          self.block_idx = self.block_idx % INPUTS_WANTED
+        self.update_status()
+        status_updated = True
+        record(slice(last, end), np.array([self.old_rpy_weight]), np.array([self.idx]))
+      else:
+        self.idx += len(used)
+        if len(used):
+          self.update_status()
+      i = end
+
+    if n:
+      self.v_ego = float(v_ego[-1])
+
+    if self.not_car:
+      ret.valid_blocks[:] = INPUTS_NEEDED
+      ret.cal_status[:] = log.LiveCalibrationData.Status.calibrated
+      ret.cal_perc[:] = 100
+      ret.rpy_calib[:] = 0.
+    return ret
+
   def get_msg(self) -> capnp.lib.capnp._DynamicStructBuilder:
     smooth_rpy = self.get_smooth_rpy()
 
@@ -233,7 +365,7 @@ class Calibrator:
 
     liveCalibration.validBlocks = self.valid_blocks
     liveCalibration.calStatus = self.cal_status
-    liveCalibration.calPerc = min(100 * (self.valid_blocks * BLOCK_SIZE + self.idx) // (INPUTS_NEEDED * BLOCK_SIZE), 100)
+    liveCalibration.calPerc = self.get_cal_perc()
     liveCalibration.rpyCalib = smooth_rpy.tolist()
     liveCalibration.rpyCalibSpread = self.calib_spread.tolist()
     liveCalibration.wideFromDeviceEuler = self.wide_from_device_euler.tolist()
@@ -263,10 +395,12 @@ def calibrationd_thread(sm: Optional[messaging.SubMaster] = None, pm: Optional[m
     pm = messaging.PubMaster(['liveCalibration'])
 
   calibrator = Calibrator(param_put=True)
+  loop_timer = LoopTimer('calibrationd')
 
   while 1:
     timeout = 0 if sm.frame == -1 else 100
     sm.update(timeout)
+    loop_timer.start()
 
     calibrator.not_car = sm['carParams'].notCar
 
@@ -281,10 +415,14 @@ def calibrationd_thread(sm: Optional[messaging.SubMaster] = None, pm: Optional[m
 
       if DEBUG and new_rpy is not None:
         print('got new rpy', new_rpy)
+      loop_timer.checkpoint("handle_cam_odom")
 
     # 4Hz driven by cameraOdometry
     if sm.frame % 5 == 0:
       calibrator.send_data(pm)
+      loop_timer.checkpoint("publish")
+
+    loop_timer.end()
 
 
 def main(sm: Optional[messaging.SubMaster] = None, pm: Optional[messaging.PubMaster] = None) -> NoReturn:
@@ -3,17 +3,19 @@ import math
 import os
 import time
 import shutil
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
 from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from enum import IntEnum
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, FrozenSet, Tuple
 
 import numpy as np
 
 from cereal import log, messaging
 from openpilot.common.params import Params, put_nonblocking
 from laika import AstroDog
-from laika.constants import SECS_IN_HR, SECS_IN_MIN
+from laika.constants import SECS_IN_HR, SECS_IN_MIN, SECS_IN_WEEK
 from laika.downloader import DownloadFailed
 from laika.ephemeris import EphemerisType, GPSEphemeris, GLONASSEphemeris, ephemeris_structs, parse_qcom_ephem
 from laika.gps_time import GPSTime
@@ -70,6 +72,70 @@ def get_log_eph_source(ephem):
     source = EphemerisSource.internet
   return source
 
+def create_ephem_status(eph):
+  status = log.GnssMeasurements.EphemerisStatus.new_message()
+  status.constellationId = ConstellationId.from_rinex_char(eph.prn[0]).value
+  status.svId = get_sv_id(eph.prn)
+  status.type = get_log_eph_type(eph).value
+  status.source = get_log_eph_source(eph).value
+  status.tow = eph.epoch.tow
+  status.gpsWeek = eph.epoch.week
+  return status
+
+def gps_seconds(t: GPSTime) -> float:
+  return t.week * SECS_IN_WEEK + t.tow
+
+
+class PrnEphemerides:
+  """Ephemerides of one prn, with their statuses and indexed by the start of their validity interval"""
+  def __init__(self, ephems: List):
+    self.source = ephems
+    self.size = len(ephems)
+    self.statuses = [create_ephem_status(eph) for eph in ephems]
+    self.starts: Optional[List[float]] = None
+
+  def unchanged(self, ephems: List) -> bool:
+    return ephems is self.source and len(ephems) == self.size
+
+  def valid(self, t: GPSTime) -> List:
+    if self.starts is None:
+      self.sorted = sorted(self.source, key=lambda e: gps_seconds(e.epoch) - e.max_time_diff)
+      self.starts = [gps_seconds(e.epoch) - e.max_time_diff for e in self.sorted]
+      self.max_duration = max((2 * e.max_time_diff for e in self.source), default=0)
+    # only the ephemerides starting at most max_duration before t can still be valid
+    t_secs = gps_seconds(t)
+    lo = bisect_left(self.starts, t_secs - self.max_duration - 1)
+    hi = bisect_right(self.starts, t_secs + 1)
+    return [e for e in self.sorted[lo:hi] if e.valid(t)]
+
+
+class EphemerisStore:
+  """
+  Index of an AstroDog ephemeris dict (navs or qcom_polys) by prn. AstroDog replaces the list of a prn
+  when new ephemerides are added, so only the prns whose list changed are indexed again on sync.
+  """
+  def __init__(self):
+    self.prns: Dict[str, PrnEphemerides] = {}
+    self.statuses: List = []
+
+  def sync(self, ephems_dict: Dict[str, List]) -> bool:
+    changed = list(ephems_dict) != list(self.prns)
+    prns = {}
+    for prn, ephems in ephems_dict.items():
+      entry = self.prns.get(prn)
+      if entry is None or not entry.unchanged(ephems):
+        entry = PrnEphemerides(ephems)
+        changed = True
+      prns[prn] = entry
+
+    if changed:
+      self.prns = prns
+      self.statuses = [status for entry in prns.values() for status in entry.statuses]
+    return changed
+
+  def valid(self, t: GPSTime) -> List:
+    return [e for entry in self.prns.values() for e in entry.valid(t)]
+
 
 class Laikad:
   def __init__(self, valid_const=(ConstellationId.GPS, ConstellationId.GLONASS), auto_fetch_navs=True, auto_update=False,
@@ -87,13 +153,18 @@ class Laikad:
     self.gnss_kf = GNSSKalman(GENERATED_DIR, cython=True, erratic_clock=use_qcom)
 
     self.auto_fetch_navs = auto_fetch_navs
+    # orbits are fetched in a long-lived process, or in this one when blocking
     self.orbit_fetch_executor: Optional[ProcessPoolExecutor] = None
     self.orbit_fetch_future: Optional[Future] = None
+    self.orbit_fetcher: Optional[OrbitFetcher] = None
 
     self.last_report_time = GPSTime(0, 0)
     self.last_fetch_navs_t = GPSTime(0, 0)
     self.last_cached_t = GPSTime(0, 0)
+    self.last_cached_navs: FrozenSet[Tuple[str, int, float, EphemerisType]] = frozenset()
     self.save_ephemeris = save_ephemeris
+    self.nav_store = EphemerisStore()
+    self.qcom_poly_store = EphemerisStore()
     self.load_cache()
 
     self.posfix_functions = {constellation: get_posfix_sympy_fun(constellation) for constellation in (ConstellationId.GPS, ConstellationId.GLONASS)}
@@ -117,47 +188,39 @@ class Laikad:
     if not cache_bytes:
       return
 
-    nav_dict = {}
+    nav_dict: Dict[str, List] = defaultdict(list)
     try:
       with ephemeris_structs.EphemerisCache.from_bytes(cache_bytes) as ephem_cache:
         glonass_navs = [GLONASSEphemeris(data_struct, file_name=EPHEMERIS_CACHE) for data_struct in ephem_cache.glonassEphemerides]
         gps_navs = [GPSEphemeris(data_struct, file_name=EPHEMERIS_CACHE) for data_struct in ephem_cache.gpsEphemerides]
-      for e in sum([glonass_navs, gps_navs], []):
-        if e.prn not in nav_dict:
-          nav_dict[e.prn] = []
+      for e in glonass_navs + gps_navs:
         nav_dict[e.prn].append(e)
       self.astro_dog.add_navs(nav_dict)
     except Exception:
       cloudlog.exception("Error parsing cache")
     cloudlog.debug(
-      f"Loaded navs ({sum([len(nav_dict[prn]) for prn in nav_dict.keys()])}). Unique orbit and nav sats: {list(nav_dict.keys())} ")
+      f"Loaded navs ({sum(len(navs) for navs in nav_dict.values())}). Unique orbit and nav sats: {list(nav_dict.keys())} ")
 
   def cache_ephemeris(self):
 
     if self.save_ephemeris and (self.last_report_time - self.last_cached_t > SECS_IN_MIN):
-      nav_list: List = sum([v for k,v in self.astro_dog.navs.items()], [])
+      self.nav_store.sync(self.astro_dog.navs)
       #TODO this only saves currently valid ephems, when we download future ephems we should save them too
-      valid_navs = [e for e in nav_list if e.valid(self.last_report_time)]
-      if len(valid_navs) > 0:
+      valid_navs = self.nav_store.valid(self.last_report_time)
+      # the cache is only written again when the valid ephemerides changed
+      cached_navs = frozenset((e.prn, e.epoch.week, e.epoch.tow, e.eph_type) for e in valid_navs)
+      if len(valid_navs) > 0 and cached_navs != self.last_cached_navs:
         ephem_cache = ephemeris_structs.EphemerisCache(glonassEphemerides=[e.data for e in valid_navs if e.prn[0]=='R'],
                                                        gpsEphemerides=[e.data for e in valid_navs if e.prn[0]=='G'])
         put_nonblocking(EPHEMERIS_CACHE, ephem_cache.to_bytes())
+        self.last_cached_navs = cached_navs
         cloudlog.debug("Cache saved")
       self.last_cached_t = self.last_report_time
 
   def create_ephem_statuses(self):
-    ephemeris_statuses = []
-    eph_list: List = sum([v for k,v in self.astro_dog.navs.items()], []) + sum([v for k,v in self.astro_dog.qcom_polys.items()], [])
-    for eph in eph_list:
-      status = log.GnssMeasurements.EphemerisStatus.new_message()
-      status.constellationId = ConstellationId.from_rinex_char(eph.prn[0]).value
-      status.svId = get_sv_id(eph.prn)
-      status.type = get_log_eph_type(eph).value
-      status.source = get_log_eph_source(eph).value
-      status.tow = eph.epoch.tow
-      status.gpsWeek = eph.epoch.week
-      ephemeris_statuses.append(status)
-    return ephemeris_statuses
+    self.nav_store.sync(self.astro_dog.navs)
+    self.qcom_poly_store.sync(self.astro_dog.qcom_polys)
+    return self.nav_store.statuses + self.qcom_poly_store.statuses
 
 
   def get_lsq_fix(self, t, measurements):
@@ -374,35 +437,74 @@ class Laikad:
       ret = None
 
       if block:  # Used for testing purposes
-        ret = get_orbit_data(t, *astro_dog_vars)
+        if self.orbit_fetcher is None:
+          self.orbit_fetcher = OrbitFetcher(*astro_dog_vars)
+        ret = self.orbit_fetcher.fetch(t)
       elif self.orbit_fetch_future is None:
-        self.orbit_fetch_executor = ProcessPoolExecutor(max_workers=1)
-        self.orbit_fetch_future = self.orbit_fetch_executor.submit(get_orbit_data, t, *astro_dog_vars)
+        if self.orbit_fetch_executor is None:
+          self.orbit_fetch_executor = ProcessPoolExecutor(max_workers=1, initializer=init_orbit_fetcher, initargs=astro_dog_vars)
+        self.orbit_fetch_future = self.orbit_fetch_executor.submit(get_orbit_data, t)
       elif self.orbit_fetch_future.done():
-        ret = self.orbit_fetch_future.result()
-        self.orbit_fetch_executor = self.orbit_fetch_future = None
+        try:
+          ret = self.orbit_fetch_future.result()
+        except BrokenProcessPool:
+          cloudlog.exception("Orbit fetch process died, restarting it on the next fetch")
+          self.orbit_fetch_executor = None
+        self.orbit_fetch_future = None
 
       if ret is not None:
         if ret[0] is None:
           self.last_fetch_navs_t = ret[2]
         else:
-          self.astro_dog.navs, self.astro_dog.navs_fetched_times, self.last_fetch_navs_t = ret
+          new_navs, self.astro_dog.navs_fetched_times, self.last_fetch_navs_t = ret
+          self.astro_dog.navs.update(new_navs)
           self.cache_ephemeris()
 
 
-def get_orbit_data(t: GPSTime, valid_const, auto_update, valid_ephem_types, cache_dir):
-  astro_dog = AstroDog(valid_const=valid_const, auto_update=auto_update, valid_ephem_types=valid_ephem_types, cache_dir=cache_dir)
-  cloudlog.info(f"Start to download/parse navs for time {t.as_datetime()}")
-  start_time = time.monotonic()
-  try:
-    astro_dog.get_navs(t)
-    cloudlog.info(f"Done parsing navs. Took {time.monotonic() - start_time:.1f}s")
-    cloudlog.debug(f"Downloaded navs ({sum([len(v) for v in astro_dog.navs])}): {list(astro_dog.navs.keys())}" +
-                   f"With time range: {[f'{start.as_datetime()}, {end.as_datetime()}' for (start,end) in astro_dog.orbit_fetched_times._ranges]}")
-    return astro_dog.navs, astro_dog.navs_fetched_times, t
-  except (DownloadFailed, RuntimeError, ValueError, IOError) as e:
-    cloudlog.warning(f"No orbit data found or parsing failure: {e}")
-  return None, None, t
+class OrbitFetcher:
+  """
+  Downloads and parses navs with an AstroDog that is kept between fetches, sharing the download cache
+  with laikad. Each fetch only returns the navs of the prns that changed since the previous one.
+  """
+  def __init__(self, valid_const, auto_update, valid_ephem_types, cache_dir):
+    self.astro_dog = AstroDog(valid_const=valid_const, auto_update=auto_update, valid_ephem_types=valid_ephem_types,
+                              clear_old_ephemeris=True, cache_dir=cache_dir)
+    # list and its length of each prn when it was last returned
+    self.returned: Dict[str, Tuple[List, int]] = {}
+
+  def fetch(self, t: GPSTime):
+    cloudlog.info(f"Start to download/parse navs for time {t.as_datetime()}")
+    start_time = time.monotonic()
+    try:
+      self.astro_dog.get_navs(t)
+      cloudlog.info(f"Done parsing navs. Took {time.monotonic() - start_time:.1f}s")
+      cloudlog.debug(f"Downloaded navs ({sum([len(v) for v in self.astro_dog.navs])}): {list(self.astro_dog.navs.keys())}" +
+                     f"With time range: {[f'{start.as_datetime()}, {end.as_datetime()}' for (start,end) in self.astro_dog.orbit_fetched_times._ranges]}")
+    except (DownloadFailed, RuntimeError, ValueError, IOError) as e:
+      cloudlog.warning(f"No orbit data found or parsing failure: {e}")
+      return None, None, t
+
+    new_navs = {}
+    for prn, navs in self.astro_dog.navs.items():
+      returned = self.returned.get(prn)
+      if returned is None or returned[0] is not navs or returned[1] != len(navs):
+        new_navs[prn] = navs
+        self.returned[prn] = (navs, len(navs))
+    return new_navs, self.astro_dog.navs_fetched_times, t
+
+
+# fetcher of the orbit fetch process
+orbit_fetcher: Optional[OrbitFetcher] = None
+
+
+def init_orbit_fetcher(valid_const, auto_update, valid_ephem_types, cache_dir):
+  global orbit_fetcher
+  orbit_fetcher = OrbitFetcher(valid_const, auto_update, valid_ephem_types, cache_dir)
+
+
+def get_orbit_data(t: GPSTime):
+  assert orbit_fetcher is not None
+  return orbit_fetcher.fetch(t)
 
 
 def create_measurement_msg(meas: GNSSMeasurement):
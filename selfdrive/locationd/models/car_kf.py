@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import math
 import sys
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 
@@ -79,6 +79,24 @@ class CarKalman(KalmanFilter):
     ObservationKind.ROAD_FRAME_X_SPEED: np.atleast_2d(0.1**2),
   }
 
+  # states observed directly by an observation kind, for observations of the current estimate
+  observed_states = {
+    ObservationKind.STIFFNESS: States.STIFFNESS,
+    ObservationKind.STEER_RATIO: States.STEER_RATIO,
+  }
+
+  # observation kinds stacked into one, applied in a single update when observed together in this order
+  stacked_obs = {
+    ObservationKind.STEER_ANGLE_X_SPEED: (ObservationKind.STEER_ANGLE, ObservationKind.ROAD_FRAME_X_SPEED),
+    ObservationKind.YAW_RATE_ROLL_OFFSET_PARAMS: (ObservationKind.ROAD_FRAME_YAW_RATE, ObservationKind.ROAD_ROLL,
+                                                  ObservationKind.ANGLE_OFFSET_FAST, ObservationKind.STIFFNESS,
+                                                  ObservationKind.STEER_RATIO),
+    ObservationKind.ROLL_OFFSET_PARAMS: (ObservationKind.ROAD_ROLL, ObservationKind.ANGLE_OFFSET_FAST,
+                                         ObservationKind.STIFFNESS, ObservationKind.STEER_RATIO),
+    ObservationKind.OFFSET_PARAMS: (ObservationKind.ANGLE_OFFSET_FAST, ObservationKind.STIFFNESS, ObservationKind.STEER_RATIO),
+  }
+  stacked_kinds = {kinds: kind for kind, kinds in stacked_obs.items()}
+
   global_vars = [
     'mass',
     'rotational_inertia',
@@ -157,6 +175,8 @@ class CarKalman(KalmanFilter):
       [sp.Matrix([sf]), ObservationKind.STIFFNESS, None],
       [sp.Matrix([theta]), ObservationKind.ROAD_ROLL, None],
     ]
+    obs_h = {kind: h for h, kind, _ in obs_eqs}
+    obs_eqs += [[sp.Matrix.vstack(*[obs_h[k] for k in kinds]), kind, None] for kind, kinds in CarKalman.stacked_obs.items()]
 
     gen_code(generated_dir, name, f_sym, dt, state_sym, obs_eqs, dim_state, dim_state, global_vars=global_vars)
 
@@ -174,6 +194,58 @@ class CarKalman(KalmanFilter):
     self.filter = EKF_sym_pyx(generated_dir, self.name, self.Q, self.initial_x, self.P_initial,
                               dim_state, dim_state_err, global_vars=self.global_vars, logger=cloudlog)
 
+    # (z, R) buffers of n observations of a kind, keyed by (kind, n), reused by predict_and_observe_multi
+    self.obs_buffers: Dict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]] = {}
+
+  def get_obs_buffers(self, kind: int, n: int, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    key = (kind, n)
+    if key not in self.obs_buffers:
+      self.obs_buffers[key] = (np.zeros((n, dim)), np.zeros((n, dim, dim)))
+    return self.obs_buffers[key]
+
+  def predict_and_observe_multi(self, t: float, observations: Sequence[Tuple[int, Optional[float], Optional[float]]]):
+    """
+    Predicts to t once and applies scalar observations of several kinds in order. Observations
+    are (kind, value, variance), a variance of None uses the observation noise of the kind. A value
+    of None observes the current estimate of the state in observed_states, which bounds its std
+    without moving it.
+
+    Observations with the kinds of a stacked kind in stacked_obs are applied in one update with
+    independent noise. Since the observations are linear in the state this matches updates one
+    after the other, except that observations of the current estimate read it before the update
+    instead of after the preceding observations. Otherwise consecutive observations of the same
+    kind go to the filter in one batch.
+    """
+    stacked_kind = self.stacked_kinds.get(tuple(kind for kind, _, _ in observations))
+    if stacked_kind is not None:
+      z, R = self.get_obs_buffers(stacked_kind, 1, len(observations))
+      x = self.filter.state()
+      for i, (kind, value, variance) in enumerate(observations):
+        z[0, i] = x[self.observed_states[kind]].item() if value is None else value
+        R[0, i, i] = self.obs_noise[kind].item() if variance is None else variance
+      self.filter.predict_and_update_batch(t, stacked_kind, z, R)
+      return
+
+    batches: List[Tuple[int, List[Optional[float]], List[float]]] = []
+    for kind, value, variance in observations:
+      variance = self.obs_noise[kind].item() if variance is None else variance
+      # a None value reads the state when its batch is applied, so it has to start a new one
+      if len(batches) and batches[-1][0] == kind and value is not None:
+        batches[-1][1].append(value)
+        batches[-1][2].append(variance)
+      else:
+        batches.append((kind, [value], [variance]))
+
+    for kind, values, variances in batches:
+      z, R = self.get_obs_buffers(kind, len(values), 1)
+      if values[0] is None:
+        values[0] = self.filter.state()[self.observed_states[kind]].item()
+      z[:, 0] = values
+      R[:, 0, 0] = variances
+      # a batch applies its observations one after the other, like separate calls. Only the first
+      # batch predicts, the following ones are at the filter time and predict with dt=0, which leaves
+      # the state and covariance untouched
+      self.filter.predict_and_update_batch(t, kind, z, R)
 
 if __name__ == "__main__":
   generated_dir = sys.argv[2]
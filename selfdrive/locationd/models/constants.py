@@ -41,6 +41,12 @@ class ObservationKind:
   ROAD_FRAME_X_SPEED = 30  # (x) [m/s]
   ROAD_ROLL = 31  # [rad]
 
+  # stacked observations of paramsd, each applied in one update
+  STEER_ANGLE_X_SPEED = 36  # (steer angle [rad], x speed [m/s])
+  YAW_RATE_ROLL_OFFSET_PARAMS = 37  # (yaw rate [rad/s], roll [rad], fast angle offset [rad], stiffness [-], steer ratio [-])
+  ROLL_OFFSET_PARAMS = 38  # (roll [rad], fast angle offset [rad], stiffness [-], steer ratio [-])
+  OFFSET_PARAMS = 39  # (fast angle offset [rad], stiffness [-], steer ratio [-])
+
   names = [
     'Unknown',
     'No observation',
@@ -79,6 +85,10 @@ class ObservationKind:
     'NO accel',
     'ORB features wide camera',
     'ECEF_VEL',
+    'Steer Angle and x speed',
+    'Yaw rate, roll, fast angle offset, stiffness and steer ratio',
+    'Roll, fast angle offset, stiffness and steer ratio',
+    'Fast angle offset, stiffness and steer ratio',
   ]
 
   @classmethod
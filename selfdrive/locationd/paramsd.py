@@ -8,6 +8,7 @@ import cereal.messaging as messaging
 from cereal import car
 from cereal import log
 from openpilot.common.params import Params, put_nonblocking
+from openpilot.common.profiler import LoopTimer
 from openpilot.common.realtime import config_realtime_process, DT_MDL
 from openpilot.common.numpy_fast import clip
 from openpilot.selfdrive.locationd.models.car_kf import CarKalman, ObservationKind, States
@@ -68,27 +69,19 @@ class ParamsLearner:
       yaw_rate_valid = yaw_rate_valid and abs(self.yaw_rate) < 1  # rad/s
 
       if self.active:
+        observations = []
         if msg.posenetOK:
-
           if yaw_rate_valid:
-            self.kf.predict_and_observe(t,
-                                        ObservationKind.ROAD_FRAME_YAW_RATE,
-                                        np.array([[-self.yaw_rate]]),
-                                        np.array([np.atleast_2d(self.yaw_rate_std**2)]))
-
-          self.kf.predict_and_observe(t,
-                                      ObservationKind.ROAD_ROLL,
-                                      np.array([[self.roll]]),
-                                      np.array([np.atleast_2d(roll_std**2)]))
-        self.kf.predict_and_observe(t, ObservationKind.ANGLE_OFFSET_FAST, np.array([[0]]))
+            observations.append((ObservationKind.ROAD_FRAME_YAW_RATE, -self.yaw_rate, self.yaw_rate_std**2))
+          observations.append((ObservationKind.ROAD_ROLL, self.roll, roll_std**2))
+        observations.append((ObservationKind.ANGLE_OFFSET_FAST, 0., None))
 
         # We observe the current stiffness and steer ratio (with a high observation noise) to bound
         # the respective estimate STD. Otherwise the STDs keep increasing, causing rapid changes in the
         # states in longer routes (especially straight stretches).
-        stiffness = float(self.kf.x[States.STIFFNESS].item())
-        steer_ratio = float(self.kf.x[States.STEER_RATIO].item())
-        self.kf.predict_and_observe(t, ObservationKind.STIFFNESS, np.array([[stiffness]]))
-        self.kf.predict_and_observe(t, ObservationKind.STEER_RATIO, np.array([[steer_ratio]]))
+        observations.append((ObservationKind.STIFFNESS, None, None))
+        observations.append((ObservationKind.STEER_RATIO, None, None))
+        self.kf.predict_and_observe_multi(t, observations)
 
     elif which == 'carState':
       self.steering_angle = msg.steeringAngleDeg
@@ -98,8 +91,10 @@ class ParamsLearner:
       self.active = self.speed > 1 and in_linear_region
 
       if self.active:
-        self.kf.predict_and_observe(t, ObservationKind.STEER_ANGLE, np.array([[math.radians(msg.steeringAngleDeg)]]))
-        self.kf.predict_and_observe(t, ObservationKind.ROAD_FRAME_X_SPEED, np.array([[self.speed]]))
+        self.kf.predict_and_observe_multi(t, [
+          (ObservationKind.STEER_ANGLE, math.radians(msg.steeringAngleDeg), None),
+          (ObservationKind.ROAD_FRAME_X_SPEED, self.speed, None),
+        ])
 
     if not self.active:
       # Reset time when stopped so uncertainty doesn't grow
@@ -115,26 +110,38 @@ def check_valid_with_hysteresis(current_valid: bool, val: float, threshold: floa
   return current_valid
 
 
-def main(sm=None, pm=None):
-  config_realtime_process([0, 1, 2, 3], 5)
-
-  DEBUG = bool(int(os.getenv("DEBUG", "0")))
-  REPLAY = bool(int(os.getenv("REPLAY", "0")))
-
-  if sm is None:
-    sm = messaging.SubMaster(['liveLocationKalman', 'carState'], poll=['liveLocationKalman'])
-  if pm is None:
-    pm = messaging.PubMaster(['liveParameters'])
+def reset_if_not_finite(learner: ParamsLearner, CP) -> ParamsLearner:
+  """The learner, or a new one with the default values if its estimate has NaNs or infs"""
+  if not all(map(math.isfinite, learner.kf.x)):
+    cloudlog.error("NaN in liveParameters estimate. Resetting to default values")
+    return ParamsLearner(CP, CP.steerRatio, 1.0, 0.0)
+  return learner
 
-  params_reader = Params()
-  # wait for stats about the car to come in from controls
-  cloudlog.info("paramsd is waiting for CarParams")
-  with car.CarParams.from_bytes(params_reader.get("CarParams", block=True)) as msg:
-    CP = msg
-  cloudlog.info("paramsd got CarParams")
 
+class RateLimitedParams:
+  """The angle offsets and roll of the estimate, rate limited and checked with hysteresis as they are published"""
+  def __init__(self, angle_offset_average: float):
+    self.angle_offset_average = angle_offset_average
+    self.angle_offset = angle_offset_average
+    self.roll = 0.0
+    self.avg_offset_valid = True
+    self.total_offset_valid = True
+    self.roll_valid = True
+
+  def update(self, x: np.ndarray) -> None:
+    self.angle_offset_average = clip(math.degrees(x[States.ANGLE_OFFSET].item()),
+                                     self.angle_offset_average - MAX_ANGLE_OFFSET_DELTA, self.angle_offset_average + MAX_ANGLE_OFFSET_DELTA)
+    self.angle_offset = clip(math.degrees(x[States.ANGLE_OFFSET].item() + x[States.ANGLE_OFFSET_FAST].item()),
+                             self.angle_offset - MAX_ANGLE_OFFSET_DELTA, self.angle_offset + MAX_ANGLE_OFFSET_DELTA)
+    self.roll = clip(float(x[States.ROAD_ROLL].item()), self.roll - ROLL_MAX_DELTA, self.roll + ROLL_MAX_DELTA)
+    self.avg_offset_valid = check_valid_with_hysteresis(self.avg_offset_valid, self.angle_offset_average, OFFSET_MAX, OFFSET_LOWERED_MAX)
+    self.total_offset_valid = check_valid_with_hysteresis(self.total_offset_valid, self.angle_offset, OFFSET_MAX, OFFSET_LOWERED_MAX)
+    self.roll_valid = check_valid_with_hysteresis(self.roll_valid, self.roll, ROLL_MAX, ROLL_LOWERED_MAX)
+
+
+def retrieve_initial_params(CP, params_reader: Params, replay: bool):
+  """Parameters learned in the last drive if they're for this car and sane, the defaults otherwise"""
   min_sr, max_sr = 0.5 * CP.steerRatio, 2.0 * CP.steerRatio
-
   params = params_reader.get("LiveParameters")
 
   # Check if car model matches
@@ -165,50 +172,63 @@ def main(sm=None, pm=None):
     }
     cloudlog.info("Parameter learner resetting to default values")
 
-  if not REPLAY:
+  if not replay:
     # When driving in wet conditions the stiffness can go down, and then be too low on the next drive
     # Without a way to detect this we have to reset the stiffness every drive
     params['stiffnessFactor'] = 1.0
+  return params
+
+
+def main(sm=None, pm=None):
+  config_realtime_process([0, 1, 2, 3], 5)
+
+  DEBUG = bool(int(os.getenv("DEBUG", "0")))
+  REPLAY = bool(int(os.getenv("REPLAY", "0")))
+
+  if sm is None:
+    sm = messaging.SubMaster(['liveLocationKalman', 'carState'], poll=['liveLocationKalman'])
+  if pm is None:
+    pm = messaging.PubMaster(['liveParameters'])
+
+  params_reader = Params()
+  # wait for stats about the car to come in from controls
+  cloudlog.info("paramsd is waiting for CarParams")
+  with car.CarParams.from_bytes(params_reader.get("CarParams", block=True)) as msg:
+    CP = msg
+  cloudlog.info("paramsd got CarParams")
+
+  min_sr, max_sr = 0.5 * CP.steerRatio, 2.0 * CP.steerRatio
+
+  params = retrieve_initial_params(CP, params_reader, REPLAY)
 
   pInitial = None
   if DEBUG:
     pInitial = np.array(params['filterState']['std']) if 'filterState' in params else None
 
   learner = ParamsLearner(CP, params['steerRatio'], params['stiffnessFactor'], math.radians(params['angleOffsetAverageDeg']), pInitial)
-  angle_offset_average = params['angleOffsetAverageDeg']
-  angle_offset = angle_offset_average
-  roll = 0.0
-  avg_offset_valid = True
-  total_offset_valid = True
-  roll_valid = True
+  outputs = RateLimitedParams(params['angleOffsetAverageDeg'])
+
+  loop_timer = LoopTimer('paramsd')
 
   while True:
     sm.update()
+    loop_timer.start()
     if sm.all_checks():
       for which in sorted(sm.updated.keys(), key=lambda x: sm.logMonoTime[x]):
         if sm.updated[which]:
           t = sm.logMonoTime[which] * 1e-9
           learner.handle_log(t, which, sm[which])
+    loop_timer.checkpoint("handle_log")
 
     if sm.updated['liveLocationKalman']:
-      x = learner.kf.x
       P = np.sqrt(learner.kf.P.diagonal())
-      if not all(map(math.isfinite, x)):
-        cloudlog.error("NaN in liveParameters estimate. Resetting to default values")
-        learner = ParamsLearner(CP, CP.steerRatio, 1.0, 0.0)
-        x = learner.kf.x
-
-      angle_offset_average = clip(math.degrees(x[States.ANGLE_OFFSET].item()),
-                                  angle_offset_average - MAX_ANGLE_OFFSET_DELTA, angle_offset_average + MAX_ANGLE_OFFSET_DELTA)
-      angle_offset = clip(math.degrees(x[States.ANGLE_OFFSET].item() + x[States.ANGLE_OFFSET_FAST].item()),
-                          angle_offset - MAX_ANGLE_OFFSET_DELTA, angle_offset + MAX_ANGLE_OFFSET_DELTA)
-      roll = clip(float(x[States.ROAD_ROLL].item()), roll - ROLL_MAX_DELTA, roll + ROLL_MAX_DELTA)
+      learner = reset_if_not_finite(learner, CP)
+      x = learner.kf.x
+
+      outputs.update(x)
       roll_std = float(P[States.ROAD_ROLL].item())
       # Account for the opposite signs of the yaw rates
       sensors_valid = bool(abs(learner.speed * (x[States.YAW_RATE].item() + learner.yaw_rate)) < LATERAL_ACC_SENSOR_THRESHOLD)
-      avg_offset_valid = check_valid_with_hysteresis(avg_offset_valid, angle_offset_average, OFFSET_MAX, OFFSET_LOWERED_MAX)
-      total_offset_valid = check_valid_with_hysteresis(total_offset_valid, angle_offset, OFFSET_MAX, OFFSET_LOWERED_MAX)
-      roll_valid = check_valid_with_hysteresis(roll_valid, roll, ROLL_MAX, ROLL_LOWERED_MAX)
 
       msg = messaging.new_message('liveParameters')
 
@@ -217,13 +237,13 @@ def main(sm=None, pm=None):
       liveParameters.sensorValid = sensors_valid
       liveParameters.steerRatio = float(x[States.STEER_RATIO].item())
       liveParameters.stiffnessFactor = float(x[States.STIFFNESS].item())
-      liveParameters.roll = roll
-      liveParameters.angleOffsetAverageDeg = angle_offset_average
-      liveParameters.angleOffsetDeg = angle_offset
+      liveParameters.roll = outputs.roll
+      liveParameters.angleOffsetAverageDeg = outputs.angle_offset_average
+      liveParameters.angleOffsetDeg = outputs.angle_offset
       liveParameters.valid = all((
-        avg_offset_valid,
-        total_offset_valid,
-        roll_valid,
+        outputs.avg_offset_valid,
+        outputs.total_offset_valid,
+        outputs.roll_valid,
         roll_std < ROLL_STD_MAX,
         0.2 <= liveParameters.stiffnessFactor <= 5.0,
         min_sr <= liveParameters.steerRatio <= max_sr,
@@ -250,6 +270,9 @@ def main(sm=None, pm=None):
         put_nonblocking("LiveParameters", json.dumps(params))
 
       pm.send('liveParameters', msg)
+      loop_timer.checkpoint("publish")
+
+    loop_timer.end()
 
 
 if __name__ == "__main__":
@@ -7,8 +7,25 @@ import numpy as np
 import cereal.messaging as messaging
 from cereal import log
 from openpilot.common.params import Params
-from openpilot.selfdrive.locationd.calibrationd import Calibrator, INPUTS_NEEDED, INPUTS_WANTED, BLOCK_SIZE, MIN_SPEED_FILTER, \
-                                                         MAX_YAW_RATE_FILTER, SMOOTH_CYCLES, HEIGHT_INIT
+from openpilot.selfdrive.locationd.calibrationd import Calibrator, CalibrationTrajectory, INPUTS_NEEDED, INPUTS_WANTED, BLOCK_SIZE, \
+                                                         MIN_SPEED_FILTER, MAX_YAW_RATE_FILTER, SMOOTH_CYCLES, HEIGHT_INIT
+
+
+def synthetic_drive(n, seed=0):
+  rng = np.random.default_rng(seed)
+  t = np.arange(n) * 0.05
+  v_ego = np.clip(20 + 10 * np.sin(t / 60) + rng.normal(size=n), 0, None)
+  v_ego[(t % 300) < 20] = 3.
+  trans = np.stack([v_ego, v_ego * 0.02 + rng.normal(scale=0.05, size=n), v_ego * -0.03 + rng.normal(scale=0.05, size=n)], axis=1)
+  # the device is mounted differently halfway through
+  trans[n // 2:, 1] += v_ego[n // 2:] * 0.08
+  rot = np.stack([np.zeros(n), np.zeros(n), rng.normal(scale=0.02, size=n)], axis=1)
+  wide_from_device_euler = rng.normal(scale=0.01, size=(n, 3))
+  trans_std = np.abs(rng.normal(scale=0.05, size=(n, 3)))
+  trans_std[rng.random(n) < 0.1, 1] = 1.
+  road_transform_trans = np.stack([np.zeros(n), np.zeros(n), 1.3 + rng.normal(scale=0.05, size=n)], axis=1)
+  road_transform_trans_std = np.abs(rng.normal(scale=0.02, size=(n, 3)))
+  return v_ego, trans, rot, wide_from_device_euler, trans_std, road_transform_trans, road_transform_trans_std
 
 
 class TestCalibrationd(unittest.TestCase):
@@ -135,5 +152,29 @@ class TestCalibrationd(unittest.TestCase):
     self.assertEqual(c.cal_status, log.LiveCalibrationData.Status.recalibrating)
     np.testing.assert_allclose(c.rpy, [0.0, 0.0, -0.05], atol=1e-2)
 
+  def test_batch_matches_sequential(self):
+    inputs = synthetic_drive(2 * BLOCK_SIZE * INPUTS_WANTED * 2)
+
+    c = Calibrator(param_put=False)
+    ref = []
+    for v_ego, trans, rot, wide_from_device_euler, trans_std, road_transform_trans, road_transform_trans_std in zip(*inputs, strict=True):
+      c.handle_v_ego(v_ego)
+      new_rpy = c.handle_cam_odom(list(trans), list(rot), list(wide_from_device_euler), list(trans_std),
+                                  list(road_transform_trans), list(road_transform_trans_std))
+      ref.append(CalibrationTrajectory(np.full(3, np.nan) if new_rpy is None else new_rpy, c.get_smooth_rpy(), c.wide_from_device_euler,
+                                       c.height, c.valid_blocks, c.cal_status, c.get_cal_perc()))
+    self.assertIn(log.LiveCalibrationData.Status.recalibrating, [r.cal_status for r in ref])
+
+    # in pieces, like one segment at a time
+    c_batch = Calibrator(param_put=False)
+    pieces = [c_batch.handle_cam_odom_batch(*(x[idxs] for x in inputs)) for idxs in np.array_split(np.arange(len(inputs[0])), 7)]
+    for field in CalibrationTrajectory._fields:
+      expected = np.array([getattr(r, field) for r in ref])
+      batch = np.concatenate([getattr(p, field) for p in pieces])
+      np.testing.assert_allclose(batch, expected.reshape(batch.shape), rtol=1e-9, atol=1e-12, err_msg=field)
+
+    np.testing.assert_allclose(c_batch.rpys, c.rpys, rtol=1e-9, atol=1e-12)
+    self.assertEqual((c_batch.idx, c_batch.block_idx, c_batch.valid_blocks), (c.idx, c.block_idx, c.valid_blocks))
+
 if __name__ == "__main__":
   unittest.main()
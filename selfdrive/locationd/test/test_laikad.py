@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import random
 import time
 import unittest
 from cereal import log
@@ -7,13 +8,13 @@ from datetime import datetime
 from unittest import mock
 
 
-from laika.constants import SECS_IN_DAY
+from laika.constants import SECS_IN_DAY, SECS_IN_HR
 from laika.downloader import DownloadFailed
 from laika.ephemeris import EphemerisType
 from laika.gps_time import GPSTime
 from laika.helpers import ConstellationId
 from laika.raw_gnss import GNSSMeasurement, read_raw_ublox, read_raw_qcom
-from openpilot.selfdrive.locationd.laikad import EPHEMERIS_CACHE, Laikad
+from openpilot.selfdrive.locationd.laikad import EPHEMERIS_CACHE, EphemerisStore, Laikad, OrbitFetcher
 from openpilot.selfdrive.test.openpilotci import get_url
 from openpilot.tools.lib.logreader import LogReader
 
@@ -92,6 +93,66 @@ def get_measurement_mock(gpstime, sat_ephemeris):
   return meas
 
 
+class FakeEphemeris:
+  eph_type = EphemerisType.NAV
+  file_name = 'ublox'
+
+  def __init__(self, prn, epoch, max_time_diff):
+    self.prn = prn
+    self.epoch = epoch
+    self.max_time_diff = max_time_diff
+
+  def valid(self, time):
+    return abs(time - self.epoch) <= self.max_time_diff
+
+
+class TestEphemerisStore(unittest.TestCase):
+  def test_valid_matches_scan(self):
+    rng = random.Random(0)
+    t0 = GPSTime(2200, 0)
+    navs = {}
+    for prn in [f"G{i:02d}" for i in range(1, 33)] + [f"R{i:02d}" for i in range(1, 25)]:
+      max_time_diff = 2 * SECS_IN_HR if prn[0] == 'G' else 25 * 60
+      navs[prn] = [FakeEphemeris(prn, t0 + rng.uniform(0, SECS_IN_DAY), max_time_diff) for _ in range(rng.randint(0, 30))]
+
+    store = EphemerisStore()
+    self.assertTrue(store.sync(navs))
+    self.assertFalse(store.sync(navs))
+    self.assertEqual(len(store.statuses), sum(len(v) for v in navs.values()))
+    for _ in range(100):
+      t = t0 + rng.uniform(-SECS_IN_HR, SECS_IN_DAY + SECS_IN_HR)
+      expected = [e for ephems in navs.values() for e in ephems if e.valid(t)]
+      self.assertCountEqual(store.valid(t), expected)
+
+    # like AstroDog, adding ephemerides replaces the list of the prn
+    navs['G01'] = [FakeEphemeris('G01', t0, 2 * SECS_IN_HR)]
+    self.assertTrue(store.sync(navs))
+    self.assertEqual(len(store.statuses), sum(len(v) for v in navs.values()))
+    self.assertIn(navs['G01'][0], store.valid(t0))
+
+
+class TestOrbitFetcher(unittest.TestCase):
+  def test_returns_changed_prns(self):
+    t0 = GPSTime(2200, 0)
+    fetcher = OrbitFetcher((ConstellationId.GPS, ConstellationId.GLONASS), False, (EphemerisType.NAV,), "/tmp/comma_download_cache/")
+    navs = {prn: [FakeEphemeris(prn, t0, 2 * SECS_IN_HR)] for prn in ('G01', 'G02', 'R01')}
+
+    def get_navs(t):
+      fetcher.astro_dog.navs.update(navs)
+    with mock.patch.object(fetcher.astro_dog, 'get_navs', side_effect=get_navs):
+      new_navs, _, t = fetcher.fetch(t0)
+      self.assertEqual(new_navs, navs)
+      self.assertEqual(t, t0)
+
+      new_navs, _, _ = fetcher.fetch(t0)
+      self.assertEqual(new_navs, {})
+
+      navs['G02'] = [FakeEphemeris('G02', t0 + SECS_IN_HR, 2 * SECS_IN_HR)]
+      navs['R01'].append(FakeEphemeris('R01', t0 + SECS_IN_HR, 25 * 60))
+      new_navs, _, _ = fetcher.fetch(t0)
+      self.assertEqual(new_navs, {'G02': navs['G02'], 'R01': navs['R01']})
+
+
 class TestLaikad(unittest.TestCase):
 
   @classmethod
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+import math
+import unittest
+
+import numpy as np
+
+import cereal.messaging as messaging
+from cereal import car
+from openpilot.selfdrive.locationd.models.car_kf import ObservationKind, States
+from openpilot.selfdrive.locationd.paramsd import MAX_ANGLE_OFFSET_DELTA, ParamsLearner, RateLimitedParams, reset_if_not_finite
+from openpilot.selfdrive.test.process_replay.helpers import replay_segment_test
+from openpilot.selfdrive.test.process_replay.replay_cache import load_cached_segment
+from openpilot.selfdrive.test.process_replay.test_processes import segments
+
+
+def observe_sequential(kf, t, observations):
+  # one predict_and_observe per observation kind, as paramsd did before predict_and_observe_multi
+  for kind, value, variance in observations:
+    if value is None:
+      value = float(kf.x[kf.observed_states[kind]].item())
+    R = None if variance is None else np.array([np.atleast_2d(variance)])
+    kf.predict_and_observe(t, kind, np.array([[value]]), R)
+
+
+def assert_close_to_sequential(kf, ref):
+  # stacked observations of the current estimate read it before the update, not after the preceding observations
+  np.testing.assert_allclose(kf.x, ref.x, rtol=1e-4, atol=1e-6)
+  np.testing.assert_allclose(kf.P, ref.P, rtol=1e-4, atol=1e-9)
+
+
+def get_learners(CP):
+  learner, ref = ParamsLearner(CP, CP.steerRatio, 1.0, 0.0), ParamsLearner(CP, CP.steerRatio, 1.0, 0.0)
+  ref.kf.predict_and_observe_multi = lambda t, observations: observe_sequential(ref.kf, t, observations)
+  return learner, ref
+
+
+def synthetic_drive(n=3000, seed=0):
+  rng = np.random.default_rng(seed)
+  msgs = []
+  for i in range(n):
+    t = i * 0.05
+    steer = 20 * math.sin(0.1 * t) + rng.normal(scale=0.5)
+    speed = max(0., 15 + 10 * math.sin(0.02 * t))
+
+    cs = messaging.new_message('carState')
+    cs.logMonoTime = int(t * 1e9)
+    cs.carState.steeringAngleDeg = steer
+    cs.carState.vEgo = speed
+    msgs.append(cs)
+
+    llk = messaging.new_message('liveLocationKalman')
+    llk.logMonoTime = int((t + 0.025) * 1e9)
+    yaw_rate = speed * math.radians(steer) / (15 * 2.7)
+    llk.liveLocationKalman.angularVelocityCalibrated.value = [0., 0., yaw_rate + rng.normal(scale=0.01)]
+    llk.liveLocationKalman.angularVelocityCalibrated.std = [0.01, 0.01, 0.01]
+    llk.liveLocationKalman.angularVelocityCalibrated.valid = bool(rng.random() > 0.05)
+    llk.liveLocationKalman.orientationNED.value = [math.radians(2) * math.sin(0.05 * t), 0., 0.]
+    llk.liveLocationKalman.orientationNED.std = [math.radians(0.5), 0., 0.]
+    llk.liveLocationKalman.posenetOK = bool(rng.random() > 0.05)
+    llk.liveLocationKalman.sensorsOK = True
+    msgs.append(llk)
+  return msgs
+
+
+class TestParamsd(unittest.TestCase):
+  def replay(self, CP, msgs):
+    learner, ref = get_learners(CP)
+    for msg in sorted(msgs, key=lambda m: m.logMonoTime):
+      which = msg.which()
+      if which not in ('liveLocationKalman', 'carState'):
+        continue
+      t = msg.logMonoTime * 1e-9
+      learner.handle_log(t, which, getattr(msg, which))
+      ref.handle_log(t, which, getattr(msg, which))
+      assert_close_to_sequential(learner.kf, ref.kf)
+
+  def test_synthetic_drive(self):
+    CP = car.CarParams.new_message(mass=1300., rotationalInertia=2500., centerToFront=1.2, wheelbase=2.7,
+                                   tireStiffnessFront=200000., tireStiffnessRear=250000., steerRatio=15.)
+    self.replay(CP, synthetic_drive())
+
+  @replay_segment_test
+  def test_replay_segment(self):
+    # paramsd inputs of a process replay segment give the estimates of separate updates
+    msgs = load_cached_segment(dict(segments)['TOYOTA'])
+    CP = next(m.carParams for m in msgs if m.which() == 'carParams')
+    self.replay(CP, msgs)
+
+  def test_observe_current_estimate(self):
+    CP = car.CarParams.new_message(mass=1300., rotationalInertia=2500., centerToFront=1.2, wheelbase=2.7,
+                                   tireStiffnessFront=200000., tireStiffnessRear=250000., steerRatio=15.)
+    learner = ParamsLearner(CP, CP.steerRatio, 1.0, 0.0)
+    learner.kf.predict_and_observe_multi(0., [(ObservationKind.ROAD_FRAME_X_SPEED, 20., None)])
+    x, P = learner.kf.x, learner.kf.P
+    learner.kf.predict_and_observe_multi(0., [(ObservationKind.STIFFNESS, None, None), (ObservationKind.STEER_RATIO, None, None)])
+    np.testing.assert_array_equal(learner.kf.x, x)
+    self.assertTrue(np.all(learner.kf.P.diagonal() <= P.diagonal()))
+
+  def test_same_kind_batched(self):
+    # consecutive observations of a kind are one batch, with the same result as separate updates
+    CP = car.CarParams.new_message(mass=1300., rotationalInertia=2500., centerToFront=1.2, wheelbase=2.7,
+                                   tireStiffnessFront=200000., tireStiffnessRear=250000., steerRatio=15.)
+    learner, ref = get_learners(CP)
+    observations = [
+      (ObservationKind.STEER_ANGLE, 0.1, None),
+      (ObservationKind.STEER_ANGLE, 0.12, 1e-4),
+      (ObservationKind.ROAD_FRAME_X_SPEED, 20., None),
+      (ObservationKind.STIFFNESS, None, None),
+      (ObservationKind.STIFFNESS, None, None),
+      (ObservationKind.STEER_ANGLE, 0.11, None),
+    ]
+    for t in (0., 0.05, 0.1):
+      learner.kf.predict_and_observe_multi(t, observations)
+      ref.kf.predict_and_observe_multi(t, observations)
+      np.testing.assert_array_equal(learner.kf.x, ref.kf.x)
+      np.testing.assert_array_equal(learner.kf.P, ref.kf.P)
+
+    self.assertEqual(set(learner.kf.obs_buffers), {(ObservationKind.STEER_ANGLE, 2), (ObservationKind.ROAD_FRAME_X_SPEED, 1),
+                                                   (ObservationKind.STIFFNESS, 1), (ObservationKind.STEER_ANGLE, 1)})
+
+  def test_stacked(self):
+    # the observations of a message are one update of a stacked kind, close to separate updates
+    CP = car.CarParams.new_message(mass=1300., rotationalInertia=2500., centerToFront=1.2, wheelbase=2.7,
+                                   tireStiffnessFront=200000., tireStiffnessRear=250000., steerRatio=15.)
+    learner, ref = get_learners(CP)
+    car_state = [(ObservationKind.STEER_ANGLE, 0.1, None), (ObservationKind.ROAD_FRAME_X_SPEED, 20., None)]
+    location = [
+      (ObservationKind.ROAD_FRAME_YAW_RATE, 0.05, 1e-4),
+      (ObservationKind.ROAD_ROLL, 0.02, 1e-4),
+      (ObservationKind.ANGLE_OFFSET_FAST, 0., None),
+      (ObservationKind.STIFFNESS, None, None),
+      (ObservationKind.STEER_RATIO, None, None),
+    ]
+    for t in np.arange(0., 5., 0.05):
+      for observations in (car_state, location, location[1:], location[2:]):
+        learner.kf.predict_and_observe_multi(t, observations)
+        ref.kf.predict_and_observe_multi(t, observations)
+        assert_close_to_sequential(learner.kf, ref.kf)
+
+    self.assertEqual(set(learner.kf.obs_buffers), {(ObservationKind.STEER_ANGLE_X_SPEED, 1), (ObservationKind.YAW_RATE_ROLL_OFFSET_PARAMS, 1),
+                                                   (ObservationKind.ROLL_OFFSET_PARAMS, 1), (ObservationKind.OFFSET_PARAMS, 1)})
+
+  def test_rate_limited_params(self):
+    outputs = RateLimitedParams(1.0)
+    x = np.zeros(States.ROAD_ROLL.stop)
+    x[States.ANGLE_OFFSET] = math.radians(15.)
+    for i in range(1, 100):
+      outputs.update(x)
+      self.assertAlmostEqual(outputs.angle_offset_average, min(1.0 + i * MAX_ANGLE_OFFSET_DELTA, 15.))
+    self.assertFalse(outputs.avg_offset_valid)
+
+  def test_reset_if_not_finite(self):
+    CP = car.CarParams.new_message(mass=1300., rotationalInertia=2500., centerToFront=1.2, wheelbase=2.7,
+                                   tireStiffnessFront=200000., tireStiffnessRear=250000., steerRatio=15.)
+    learner = ParamsLearner(CP, 17., 1.2, 0.0)
+    self.assertIs(reset_if_not_finite(learner, CP), learner)
+
+    learner.kf.init_state(np.full_like(learner.kf.x, np.nan), covs=learner.kf.P)
+    learner = reset_if_not_finite(learner, CP)
+    self.assertTrue(np.all(np.isfinite(learner.kf.x)))
+    self.assertEqual(learner.kf.x[States.STEER_RATIO].item(), CP.steerRatio)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import unittest
+from collections import deque
+
+import numpy as np
+
+from cereal import car
+from openpilot.selfdrive.locationd.torqued import NPQueue, TorqueEstimator, POINTS_PER_BUCKET, FRICTION_FACTOR, slope2rot
+from openpilot.selfdrive.test.process_replay.helpers import replay_segment_test
+from openpilot.selfdrive.test.process_replay.replay_cache import load_cached_segment
+from openpilot.selfdrive.test.process_replay.test_processes import segments
+
+# the fit used to be on a random sample of this many points
+OLD_FIT_POINTS = 2000
+# relative tolerance of the fit from the running moments to the SVD fit
+FIT_RTOL = 1e-6
+
+
+def svd_fit(points):
+  # fit on all the points, as estimate_params did before keeping running moments
+  _, _, v = np.linalg.svd(points, full_matrices=False)
+  slope, offset = -v.T[0:2, 2] / v.T[2, 2]
+  _, spread = np.matmul(points[:, [0, 2]], slope2rot(slope)).T
+  return slope, offset, np.std(spread) * FRICTION_FACTOR
+
+
+def get_estimator():
+  CP = car.CarParams.new_message()
+  CP.carFingerprint = "TOYOTA COROLLA TSS2 2019"
+  CP.carName = "toyota"
+  CP.lateralTuning.init('torque')
+  CP.lateralTuning.torque.friction = 0.1
+  CP.lateralTuning.torque.latAccelFactor = 2.5
+  return TorqueEstimator(CP.as_reader())
+
+
+class TestTorqued(unittest.TestCase):
+  def test_npqueue(self):
+    rng = np.random.default_rng(0)
+    q, ref = NPQueue(maxlen=10, rowsize=3), deque(maxlen=10)
+    for _ in range(25):
+      pt = rng.normal(size=3)
+      old = q.append(pt)
+      if len(ref) == ref.maxlen:
+        np.testing.assert_array_equal(old, ref[0])
+      else:
+        self.assertIsNone(old)
+      ref.append(pt)
+
+      self.assertEqual(len(q), len(ref))
+      np.testing.assert_array_equal(q.arr, np.array(ref))
+
+  def test_fit_matches_svd(self):
+    rng = np.random.default_rng(0)
+    estimator = get_estimator()
+    # more points than fit in the buckets, so old points get dropped
+    for _ in range(5 * POINTS_PER_BUCKET * len(estimator.filtered_points.buckets)):
+      steer = rng.uniform(-0.5, 0.5)
+      estimator.filtered_points.add_point(steer, 2.0 * steer + 0.1 + rng.normal(scale=0.2))
+      if rng.random() < 0.001:
+        points = estimator.filtered_points.get_points()
+        np.testing.assert_allclose(estimator.filtered_points.get_moments(), points.T @ points, rtol=1e-9)
+
+    slope, offset, friction = estimator.estimate_params()
+    np.testing.assert_allclose((slope, offset, friction), svd_fit(estimator.filtered_points.get_points()), rtol=FIT_RTOL)
+
+  @replay_segment_test
+  def test_fit_matches_svd_segments(self):
+    # The process replay segments stay under OLD_FIT_POINTS, so the old fit on a random sample was the SVD fit on all
+    # points, in a random order. They don't reach min_points_total either, so torqued never publishes a fit in
+    # process replay and its refs don't depend on it.
+    for _, segment in segments:
+      with self.subTest(segment=segment):
+        msgs = load_cached_segment(segment)
+        CP = next(m.carParams for m in msgs if m.which() == 'carParams')
+        estimator = TorqueEstimator(CP)
+        for msg in msgs:
+          which = msg.which()
+          if which not in ('carControl', 'carState', 'liveLocationKalman'):
+            continue
+          estimator.handle_log(msg.logMonoTime * 1e-9, which, getattr(msg, which))
+
+          if which == 'liveLocationKalman' and len(estimator.filtered_points) >= 3:
+            points = estimator.filtered_points.get_points()
+            self.assertLessEqual(len(points), OLD_FIT_POINTS)
+            self.assertFalse(estimator.filtered_points.is_valid())
+            np.testing.assert_allclose(estimator.estimate_params(), svd_fit(points), rtol=FIT_RTOL, atol=1e-9)
+
+
+if __name__ == "__main__":
+  unittest.main()
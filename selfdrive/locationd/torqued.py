@@ -8,6 +8,7 @@ from collections import deque, defaultdict
 import cereal.messaging as messaging
 from cereal import car, log
 from openpilot.common.params import Params
+from openpilot.common.profiler import LoopTimer
 from openpilot.common.realtime import config_realtime_process, DT_MDL
 from openpilot.common.filter_simple import FirstOrderFilter
 from openpilot.system.swaglog import cloudlog
@@ -17,8 +18,6 @@ HISTORY = 5  # secs
 POINTS_PER_BUCKET = 1500
 MIN_POINTS_TOTAL = 4000
 MIN_POINTS_TOTAL_QLOG = 600
-FIT_POINTS_TOTAL = 2000
-FIT_POINTS_TOTAL_QLOG = 600
 MIN_VEL = 15  # m/s
 FRICTION_FACTOR = 1.5  # ~85% of data coverage
 FACTOR_SANITY = 0.3
@@ -44,27 +43,48 @@ def slope2rot(slope):
 
 
 class NPQueue:
+  """Fixed size circular buffer of rows, once full the oldest row is overwritten"""
   def __init__(self, maxlen, rowsize):
     self.maxlen = maxlen
-    self.arr = np.empty((0, rowsize))
+    self.buf = np.empty((maxlen, rowsize))
+    self.start = 0
+    self.len = 0
 
   def __len__(self):
-    return len(self.arr)
+    return self.len
+
+  @property
+  def arr(self):
+    # rows from oldest to newest
+    if self.len < self.maxlen:
+      return self.buf[:self.len]
+    return np.concatenate((self.buf[self.start:], self.buf[:self.start]))
 
   def append(self, pt):
-    if len(self.arr) < self.maxlen:
-      self.arr = np.append(self.arr, [pt], axis=0)
-    else:
-      self.arr[:-1] = self.arr[1:]
-      self.arr[-1] = pt
+    """Returns the row that was overwritten, None if the buffer wasn't full"""
+    if self.len < self.maxlen:
+      self.buf[self.len] = pt
+      self.len += 1
+      return None
+
+    old = self.buf[self.start].copy()
+    self.buf[self.start] = pt
+    self.start = (self.start + 1) % self.maxlen
+    return old
 
 
 class PointBuckets:
+  """
+  Points in buckets of x, with the second moment matrix sum(p p^T) of the points [x, 1, y] of each
+  bucket kept up to date, which is all the torque fit needs
+  """
   def __init__(self, x_bounds, min_points, min_points_total):
     self.x_bounds = x_bounds
     self.buckets = {bounds: NPQueue(maxlen=POINTS_PER_BUCKET, rowsize=3) for bounds in x_bounds}
     self.buckets_min_points = dict(zip(x_bounds, min_points, strict=True))
     self.min_points_total = min_points_total
+    self.moments = {bounds: np.zeros((3, 3)) for bounds in x_bounds}
+    self.evictions = dict.fromkeys(x_bounds, 0)
 
   def bucket_lengths(self):
     return [len(v) for v in self.buckets.values()]
@@ -77,11 +97,23 @@ class PointBuckets:
                                                                                 and (self.__len__() >= self.min_points_total)
 
   def add_point(self, x, y):
-    for bound_min, bound_max in self.x_bounds:
-      if (x >= bound_min) and (x < bound_max):
-        self.buckets[(bound_min, bound_max)].append([x, 1.0, y])
+    for bounds in self.x_bounds:
+      if (x >= bounds[0]) and (x < bounds[1]):
+        pt = np.array([x, 1.0, y])
+        old = self.buckets[bounds].append(pt)
+        self.moments[bounds] += np.outer(pt, pt)
+        if old is not None:
+          self.moments[bounds] -= np.outer(old, old)
+          # recompute once in a while so rounding errors don't accumulate
+          self.evictions[bounds] += 1
+          if self.evictions[bounds] >= POINTS_PER_BUCKET:
+            self.evictions[bounds] = 0
+            self.moments[bounds] = self.buckets[bounds].buf.T @ self.buckets[bounds].buf
         break
 
+  def get_moments(self):
+    return sum(self.moments.values())
+
   def get_points(self, num_points=None):
     points = np.vstack([x.arr for x in self.buckets.values()])
     if num_points is None:
@@ -100,14 +132,12 @@ class TorqueEstimator:
     if decimated:
       self.min_bucket_points = MIN_BUCKET_POINTS / 10
       self.min_points_total = MIN_POINTS_TOTAL_QLOG
-      self.fit_points = FIT_POINTS_TOTAL_QLOG
       self.factor_sanity = FACTOR_SANITY_QLOG
       self.friction_sanity = FRICTION_SANITY_QLOG
 
     else:
       self.min_bucket_points = MIN_BUCKET_POINTS
       self.min_points_total = MIN_POINTS_TOTAL
-      self.fit_points = FIT_POINTS_TOTAL
       self.factor_sanity = FACTOR_SANITY
       self.friction_sanity = FRICTION_SANITY
 
@@ -178,14 +208,20 @@ class TorqueEstimator:
     self.filtered_points = PointBuckets(x_bounds=STEER_BUCKET_BOUNDS, min_points=self.min_bucket_points, min_points_total=self.min_points_total)
 
   def estimate_params(self):
-    points = self.filtered_points.get_points(self.fit_points)
+    # sums of x^2, x, xy, 1, y, y^2 over all points
+    moments = self.filtered_points.get_moments()
+    n = moments[1, 1]
     # total least square solution as both x and y are noisy observations
     # this is empirically the slope of the hysteresis parallelogram as opposed to the line through the diagonals
+    # the right singular vector of the points with the smallest singular value is the eigenvector of sum(p p^T) with the smallest eigenvalue
     try:
-      _, _, v = np.linalg.svd(points, full_matrices=False)
-      slope, offset = -v.T[0:2, 2] / v.T[2, 2]
-      _, spread = np.matmul(points[:, [0, 2]], slope2rot(slope)).T
-      friction_coeff = np.std(spread) * FRICTION_FACTOR
+      _, v = np.linalg.eigh(moments)
+      slope, offset = -v[0:2, 0] / v[2, 0]
+      # std of the points rotated by the slope, perpendicular to the fit
+      a, b = slope2rot(slope)[:, 1]
+      spread_mean = (a * moments[0, 1] + b * moments[1, 2]) / n
+      spread_sq_mean = (a**2 * moments[0, 0] + 2 * a * b * moments[0, 2] + b**2 * moments[2, 2]) / n
+      friction_coeff = np.sqrt(max(spread_sq_mean - spread_mean**2, 0.)) * FRICTION_FACTOR
     except np.linalg.LinAlgError as e:
       cloudlog.exception(f"Error computing live torque params: {e}")
       slope = offset = friction_coeff = np.nan
@@ -282,17 +318,24 @@ def main(sm=None, pm=None):
   if "REPLAY" not in os.environ:
     signal.signal(signal.SIGINT, cache_params)
 
+  loop_timer = LoopTimer('torqued')
+
   while True:
     sm.update()
+    loop_timer.start()
     if sm.all_checks():
       for which in sm.updated.keys():
         if sm.updated[which]:
           t = sm.logMonoTime[which] * 1e-9
           estimator.handle_log(t, which, sm[which])
+    loop_timer.checkpoint("handle_log")
 
     # 4Hz driven by liveLocationKalman
     if sm.frame % 5 == 0:
       pm.send('liveTorqueParameters', estimator.get_msg(valid=sm.all_checks()))
+      loop_timer.checkpoint("publish")
+
+    loop_timer.end()
 
 
 if __name__ == "__main__":
@@ -12,6 +12,7 @@ from openpilot.system.hardware import PC, TICI
 from openpilot.system.swaglog import cloudlog
 from openpilot.common.params import Params
 from openpilot.common.filter_simple import FirstOrderFilter
+from openpilot.common.history_buffer import HistoryBuffer
 from openpilot.common.realtime import config_realtime_process
 from openpilot.selfdrive.modeld.models.commonmodel_pyx import ModelFrame, CLContext, Runtime
 from openpilot.selfdrive.modeld.models.driving_pyx import (
@@ -20,8 +21,11 @@ from openpilot.selfdrive.modeld.models.driving_pyx import (
   OUTPUT_SIZE, NET_OUTPUT_SIZE, MODEL_FREQ)
 
 USE_THNEED = int(os.getenv('USE_THNEED', str(int(TICI))))
+ONNX_INPROCESS = int(os.getenv('ONNX_INPROCESS', '0'))
 if USE_THNEED:
   from selfdrive.modeld.runners.thneedmodel_pyx import ThneedModel as ModelRunner
+elif ONNX_INPROCESS:
+  from selfdrive.modeld.runners.onnx_runner import ONNXModel as ModelRunner
 else:
   from selfdrive.modeld.runners.onnxmodel_pyx import ONNXModel as ModelRunner
 
@@ -57,6 +61,8 @@ class ModelState:
   inputs: Dict[str, np.ndarray]
   output: np.ndarray
   prev_desire: np.ndarray  # for tracking the rising edge of the pulse
+  desire_history: HistoryBuffer
+  feature_history: HistoryBuffer
   model: ModelRunner
 
   def __init__(self, context: CLContext):
@@ -64,12 +70,14 @@ class ModelState:
     self.wide_frame = ModelFrame(context)
     self.prev_desire = np.zeros(DESIRE_LEN, dtype=np.float32)
     self.output = np.zeros(NET_OUTPUT_SIZE, dtype=np.float32)
+    self.desire_history = HistoryBuffer(HISTORY_BUFFER_LEN+1, DESIRE_LEN)
+    self.feature_history = HistoryBuffer(HISTORY_BUFFER_LEN, FEATURE_LEN)
     self.inputs = {
-      'desire_pulse': np.zeros(DESIRE_LEN * (HISTORY_BUFFER_LEN+1), dtype=np.float32),
+      'desire_pulse': self.desire_history.flat,
       'traffic_convention': np.zeros(TRAFFIC_CONVENTION_LEN, dtype=np.float32),
       'nav_features': np.zeros(NAV_FEATURE_LEN, dtype=np.float32),
       'nav_instructions': np.zeros(NAV_INSTRUCTION_LEN, dtype=np.float32),
-      'feature_buffer': np.zeros(HISTORY_BUFFER_LEN * FEATURE_LEN, dtype=np.float32),
+      'feature_buffer': self.feature_history.flat,
     }
 
     self.model = ModelRunner(MODEL_PATH, self.output, Runtime.GPU, False, context)
@@ -82,9 +90,11 @@ class ModelState:
                 inputs: Dict[str, np.ndarray], prepare_only: bool) -> Optional[np.ndarray]:
     # Model decides when action is completed, so desire input is just a pulse triggered on rising edge
     inputs['desire_pulse'][0] = 0
-    self.inputs['desire_pulse'][:-DESIRE_LEN] = self.inputs['desire_pulse'][DESIRE_LEN:]
-    self.inputs['desire_pulse'][-DESIRE_LEN:] = np.where(inputs['desire_pulse'] - self.prev_desire > .99, inputs['desire_pulse'], 0)
+    self.desire_history.push(np.where(inputs['desire_pulse'] - self.prev_desire > .99, inputs['desire_pulse'], 0))
     self.prev_desire[:] = inputs['desire_pulse']
+    # history buffers only move their window, so the runner has to be pointed at the new view
+    self.inputs['desire_pulse'] = self.desire_history.flat
+    self.model.setInputBuffer("desire_pulse", self.inputs['desire_pulse'])
 
     self.inputs['traffic_convention'][:] = inputs['traffic_convention']
     self.inputs['nav_features'][:] = inputs['nav_features']
@@ -100,8 +110,9 @@ class ModelState:
       return None
 
     self.model.execute()
-    self.inputs['feature_buffer'][:-FEATURE_LEN] = self.inputs['feature_buffer'][FEATURE_LEN:]
-    self.inputs['feature_buffer'][-FEATURE_LEN:] = self.output[OUTPUT_SIZE:OUTPUT_SIZE+FEATURE_LEN]
+    self.feature_history.push(self.output[OUTPUT_SIZE:OUTPUT_SIZE+FEATURE_LEN])
+    self.inputs['feature_buffer'] = self.feature_history.flat
+    self.model.setInputBuffer("feature_buffer", self.inputs['feature_buffer'])
     return self.output
 
 
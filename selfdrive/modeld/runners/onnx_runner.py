@@ -3,7 +3,8 @@
 import os
 import sys
 import numpy as np
-from typing import Tuple, Dict, Union, Any
+from multiprocessing import shared_memory
+from typing import Tuple, Dict, List, Optional, Union, Any
 
 os.environ["OMP_NUM_THREADS"] = "4"
 os.environ["OMP_WAIT_POLICY"] = "PASSIVE"
@@ -12,47 +13,8 @@ import onnxruntime as ort
 
 ORT_TYPES_TO_NP_TYPES = {'tensor(float16)': np.float16, 'tensor(float)': np.float32, 'tensor(uint8)': np.uint8}
 
-def read(sz, tf8=False):
-  dd = []
-  gt = 0
-  szof = 1 if tf8 else 4
-  while gt < sz * szof:
-    st = os.read(0, sz * szof - gt)
-    assert(len(st) > 0)
-    dd.append(st)
-    gt += len(st)
-  r = np.frombuffer(b''.join(dd), dtype=np.uint8 if tf8 else np.float32)
-  if tf8:
-    r = r / 255.
-  return r
-
-def write(d):
-  os.write(1, d.tobytes())
-
-def run_loop(m, tf8_input=False):
-  ishapes = [[1]+ii.shape[1:] for ii in m.get_inputs()]
-  keys = [x.name for x in m.get_inputs()]
-  itypes = [ORT_TYPES_TO_NP_TYPES[x.type] for x in m.get_inputs()]
-
-  # run once to initialize CUDA provider
-  if "CUDAExecutionProvider" in m.get_providers():
-    m.run(None, dict(zip(keys, [np.zeros(shp, dtype=itp) for shp, itp in zip(ishapes, itypes, strict=True)], strict=True)))
-
-  print("ready to run onnx model", keys, ishapes, file=sys.stderr)
-  while 1:
-    inputs = []
-    for k, shp, itp in zip(keys, ishapes, itypes, strict=True):
-      ts = np.product(shp)
-      #print("reshaping %s with offset %d" % (str(shp), offset), file=sys.stderr)
-      inputs.append(read(ts, (k=='input_img' and tf8_input)).reshape(shp).astype(itp))
-    ret = m.run(None, dict(zip(keys, inputs, strict=True)))
-    #print(ret, file=sys.stderr)
-    for r in ret:
-      write(r.astype(np.float32))
 
-
-if __name__ == "__main__":
-  print(sys.argv, file=sys.stderr)
+def create_ort_session(path: str) -> ort.InferenceSession:
   print("Onnx available providers: ", ort.get_available_providers(), file=sys.stderr)
   options = ort.SessionOptions()
   options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
@@ -69,10 +31,148 @@ if __name__ == "__main__":
     options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
     provider = 'CPUExecutionProvider'
 
+  print("Onnx selected provider: ", [provider], file=sys.stderr)
+  session = ort.InferenceSession(path, options, providers=[provider])
+  print("Onnx using ", session.get_providers(), file=sys.stderr)
+  return session
+
+
+class BoundSession:
+  """
+  Binds preallocated numpy buffers to an onnxruntime session with IOBinding, so
+  inputs are read and outputs are written in place. Inputs that are not already
+  in the model's dtype get converted into a preallocated staging buffer.
+  """
+  def __init__(self, session: ort.InferenceSession, tf8_input: bool = False):
+    self.session = session
+    self.binding = session.io_binding()
+    self.keys = [x.name for x in session.get_inputs()]
+    self.ishapes = [[1]+ii.shape[1:] for ii in session.get_inputs()]
+    self.itypes = [ORT_TYPES_TO_NP_TYPES[x.type] for x in session.get_inputs()]
+    self.tf8 = [k == 'input_img' and tf8_input for k in self.keys]
+    self.onames = [x.name for x in session.get_outputs()]
+    self.oshapes = [[1]+oo.shape[1:] for oo in session.get_outputs()]
+    self.otypes = [ORT_TYPES_TO_NP_TYPES[x.type] for x in session.get_outputs()]
+
+    self.sources: List[Optional[np.ndarray]] = [None] * len(self.keys)
+    self.staging: List[Optional[np.ndarray]] = [None] * len(self.keys)
+    self.outputs: List[Optional[np.ndarray]] = [None] * len(self.onames)
+    self.output_staging: List[Optional[np.ndarray]] = [None] * len(self.onames)
+
+  def input_nbytes(self, idx: int) -> int:
+    return int(np.prod(self.ishapes[idx])) * (1 if self.tf8[idx] else 4)
+
+  def output_nbytes(self, idx: int) -> int:
+    return int(np.prod(self.oshapes[idx])) * 4
+
+  def bind_input(self, idx: int, buf: np.ndarray) -> None:
+    # the runner protocol carries float32 for every input, or raw uint8 for tf8 images
+    src = buf.view(np.uint8 if self.tf8[idx] else np.float32).reshape(self.ishapes[idx])
+    self.sources[idx] = src
+    if src.dtype == self.itypes[idx]:
+      dst = src
+    else:
+      if self.staging[idx] is None:
+        self.staging[idx] = np.empty(self.ishapes[idx], dtype=self.itypes[idx])
+      dst = self.staging[idx]
+    self.binding.bind_input(self.keys[idx], 'cpu', 0, self.itypes[idx], self.ishapes[idx], dst.ctypes.data)
+
+  def bind_output(self, idx: int, buf: np.ndarray) -> None:
+    dst = buf.view(np.float32).reshape(self.oshapes[idx])
+    self.outputs[idx] = dst
+    if self.otypes[idx] != np.float32:
+      self.output_staging[idx] = np.empty(self.oshapes[idx], dtype=self.otypes[idx])
+      dst = self.output_staging[idx]
+    self.binding.bind_output(self.onames[idx], 'cpu', 0, self.otypes[idx], self.oshapes[idx], dst.ctypes.data)
+
+  def warmup(self) -> None:
+    # run once to initialize CUDA provider
+    if "CUDAExecutionProvider" in self.session.get_providers():
+      self.session.run(None, {k: np.zeros(shp, dtype=itp) for k, shp, itp in zip(self.keys, self.ishapes, self.itypes, strict=True)})
+
+  def run(self) -> None:
+    for src, staging, tf8 in zip(self.sources, self.staging, self.tf8, strict=True):
+      if staging is None:
+        continue
+      if tf8:
+        np.divide(src, 255., out=staging, dtype=np.float64, casting='unsafe')
+      else:
+        np.copyto(staging, src, casting='unsafe')
+    self.session.run_with_iobinding(self.binding)
+    for out, staging in zip(self.outputs, self.output_staging, strict=True):
+      if staging is not None:
+        np.copyto(out, staging, casting='unsafe')
+
+
+class ONNXModel:
+  """
+  In-process runner with the same interface as the cython RunModel wrappers,
+  skips the runner subprocess and binds the caller's buffers directly.
+  Inputs are matched to the model inputs in the order they are added.
+  """
+  def __init__(self, path: str, output: np.ndarray, runtime: int, use_tf8: bool, context: Any = None):
+    self.model = BoundSession(create_ort_session(path), use_tf8)
+    self.names: List[str] = []
+
+    offset = 0
+    for idx in range(len(self.model.onames)):
+      sz = self.model.output_nbytes(idx) // 4
+      self.model.bind_output(idx, output[offset:offset+sz])
+      offset += sz
+    assert offset == len(output), f"model output size {offset} doesn't match buffer size {len(output)}"
+    self.model.warmup()
+
+  def addInput(self, name: str, buffer: Optional[np.ndarray]) -> None:
+    self.names.append(name)
+    if buffer is not None:
+      self.setInputBuffer(name, buffer)
+
+  def setInputBuffer(self, name: str, buffer: Optional[np.ndarray]) -> None:
+    if buffer is not None:
+      self.model.bind_input(self.names.index(name), buffer)
+
+  def getCLBuffer(self, name: str) -> None:
+    return None
+
+  def execute(self) -> None:
+    self.model.run()
+
+
+def run_loop(m: ort.InferenceSession, shm_name: str, tf8_input: bool = False) -> None:
+  model = BoundSession(m, tf8_input)
+
+  # shared memory layout is all inputs in order, followed by all outputs as float32
+  isizes = [model.input_nbytes(i) for i in range(len(model.keys))]
+  osizes = [model.output_nbytes(i) for i in range(len(model.onames))]
+  shm = shared_memory.SharedMemory(name=shm_name, create=True, size=sum(isizes) + sum(osizes))
+  buf = np.ndarray(sum(isizes) + sum(osizes), dtype=np.uint8, buffer=shm.buf)
+
+  offset = 0
+  for i, sz in enumerate(isizes):
+    model.bind_input(i, buf[offset:offset+sz])
+    offset += sz
+  for i, sz in enumerate(osizes):
+    model.bind_output(i, buf[offset:offset+sz])
+    offset += sz
+
+  model.warmup()
+  print("ready to run onnx model", model.keys, model.ishapes, file=sys.stderr)
+
+  # signal the host that the shared memory exists, it's unlinked once the host has mapped it
+  os.write(1, b'\x01')
+  attached = False
+  while os.read(0, 1):
+    if not attached:
+      shm.unlink()
+      attached = True
+    model.run()
+    os.write(1, b'\x01')
+
+
+if __name__ == "__main__":
+  print(sys.argv, file=sys.stderr)
   try:
-    print("Onnx selected provider: ", [provider], file=sys.stderr)
-    ort_session = ort.InferenceSession(sys.argv[1], options, providers=[provider])
-    print("Onnx using ", ort_session.get_providers(), file=sys.stderr)
-    run_loop(ort_session, tf8_input=("--use_tf8" in sys.argv))
+    ort_session = create_ort_session(sys.argv[1])
+    run_loop(ort_session, sys.argv[sys.argv.index("--shm") + 1], tf8_input=("--use_tf8" in sys.argv))
   except KeyboardInterrupt:
     pass
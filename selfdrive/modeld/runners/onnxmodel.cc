@@ -3,7 +3,11 @@
 #include <csignal>
 #include <cstdio>
 #include <cstdlib>
+#include <cstring>
+#include <fcntl.h>
 #include <poll.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 #include <unistd.h>
 
 #include "common/util.h"
@@ -15,6 +19,9 @@ ONNXModel::ONNXModel(const std::string path, float *_output, size_t _output_size
   output_size = _output_size;
   use_tf8 = _use_tf8;
 
+  static int instance_count = 0;
+  shm_name = util::string_format("onnxmodel_%d_%d", getpid(), instance_count++);
+
   int err = pipe(pipein);
   assert(err == 0);
   err = pipe(pipeout);
@@ -22,11 +29,12 @@ ONNXModel::ONNXModel(const std::string path, float *_output, size_t _output_size
 
   std::string onnx_runner = ONNXRUNNER_PATH;
   std::string tf8_arg = use_tf8 ? "--use_tf8" : "";
+  std::string shm_arg = "--shm";
 
   proc_pid = fork();
   if (proc_pid == 0) {
     LOGD("spawning onnx process %s", onnx_runner.c_str());
-    char *argv[] = {(char*)onnx_runner.c_str(), (char*)path.c_str(), (char*)tf8_arg.c_str(), nullptr};
+    char *argv[] = {(char*)onnx_runner.c_str(), (char*)path.c_str(), (char*)shm_arg.c_str(), (char*)shm_name.c_str(), (char*)tf8_arg.c_str(), nullptr};
     dup2(pipein[0], 0);
     dup2(pipeout[1], 1);
     close(pipein[0]);
@@ -43,46 +51,77 @@ ONNXModel::ONNXModel(const std::string path, float *_output, size_t _output_size
 }
 
 ONNXModel::~ONNXModel() {
+  if (shm != nullptr) {
+    munmap(shm, shm_size);
+  }
   close(pipein[1]);
   close(pipeout[0]);
   kill(proc_pid, SIGTERM);
 }
 
-void ONNXModel::pwrite(float *buf, int size) {
-  char *cbuf = (char *)buf;
-  int tw = size*sizeof(float);
-  while (tw > 0) {
-    int err = write(pipein[1], cbuf, tw);
-    //printf("host write %d\n", err);
-    assert(err >= 0);
-    cbuf += err;
-    tw -= err;
+void ONNXModel::attach() {
+  // the runner creates the shared memory once the model is loaded, then rings the doorbell
+  wait(-1);
+
+  int fd = shm_open(("/" + shm_name).c_str(), O_RDWR, 0);
+  assert(fd >= 0);
+  struct stat st;
+  int err = fstat(fd, &st);
+  assert(err == 0);
+  shm_size = st.st_size;
+
+  // layout is all inputs in order, followed by the outputs
+  size_t expected_size = output_size * sizeof(float);
+  for (auto &input : inputs) {
+    expected_size += input->size * sizeof(float);
   }
-  LOGD("host write of size %d done", size);
+  assert(shm_size >= expected_size);
+
+  shm = (char *)mmap(NULL, shm_size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+  assert(shm != MAP_FAILED);
+  close(fd);
+  LOGD("attached to shared memory %s of size %lu", shm_name.c_str(), shm_size);
+}
+
+void ONNXModel::notify() {
+  char c = 1;
+  int err;
+  do {
+    err = write(pipein[1], &c, 1);
+  } while (err == -1 && errno == EINTR);
+  assert(err == 1);
 }
 
-void ONNXModel::pread(float *buf, int size) {
-  char *cbuf = (char *)buf;
-  int tr = size*sizeof(float);
+void ONNXModel::wait(int timeout_ms) {
   struct pollfd fds[1];
   fds[0].fd = pipeout[0];
   fds[0].events = POLLIN;
-  while (tr > 0) {
-    int err;
-    err = poll(fds, 1, 10000);  // 10 second timeout
-    assert(err == 1 || (err == -1 && errno == EINTR));
-    LOGD("host read remaining %d/%lu poll %d", tr, size*sizeof(float), err);
-    err = read(pipeout[0], cbuf, tr);
-    assert(err > 0 || (err == 0 && errno == EINTR));
-    cbuf += err;
-    tr -= err;
+  while (true) {
+    int err = poll(fds, 1, timeout_ms);
+    if (err == -1 && errno == EINTR) continue;
+    assert(err == 1);
+
+    char c;
+    err = read(pipeout[0], &c, 1);
+    if (err == -1 && errno == EINTR) continue;
+    assert(err == 1);
+    break;
   }
-  LOGD("host read done");
+  LOGD("host wait done");
 }
 
 void ONNXModel::execute() {
+  if (shm == nullptr) {
+    attach();
+  }
+
+  char *ptr = shm;
   for (auto &input : inputs) {
-    pwrite(input->buffer, input->size);
+    size_t sz = input->size * sizeof(float);
+    memcpy(ptr, input->buffer, sz);
+    ptr += sz;
   }
-  pread(output, output_size);
+  notify();
+  wait(10000);  // 10 second timeout
+  memcpy(output, ptr, output_size * sizeof(float));
 }
@@ -15,9 +15,14 @@ private:
   size_t output_size;
   bool use_tf8;
 
-  // pipe to communicate to onnx_runner subprocess
-  void pread(float *buf, int size);
-  void pwrite(float *buf, int size);
+  // tensors are exchanged with the onnx_runner subprocess through shared memory,
+  // the pipes only carry a one byte doorbell per execution
+  void attach();
+  void notify();
+  void wait(int timeout_ms);
+  std::string shm_name;
+  char *shm = nullptr;
+  size_t shm_size = 0;
   int pipein[2];
   int pipeout[2];
 };
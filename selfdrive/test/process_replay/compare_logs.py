@@ -1,15 +1,53 @@
 #!/usr/bin/env python3
+import bz2
 import sys
 import math
 import capnp
+import struct
 import numbers
+import argparse
 import dictdiffer
-from collections import Counter
+import concurrent.futures
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
 
-from openpilot.tools.lib.logreader import LogReader
+from cereal import log as capnp_log
+from cereal.messaging import log_from_bytes
+from openpilot.tools.lib.filereader import FileReader
+from openpilot.tools.lib.logreader import split_events
 
 EPSILON = sys.float_info.epsilon
 
+# size in bits of the scalar fields that can be masked in the serialized message
+FIELD_BITS = {
+  'bool': 1, 'int8': 8, 'uint8': 8, 'int16': 16, 'uint16': 16, 'enum': 16,
+  'int32': 32, 'uint32': 32, 'float32': 32, 'int64': 64, 'uint64': 64, 'float64': 64,
+}
+
+# discriminantValue of fields that aren't union members
+NO_DISCRIMINANT = 0xffff
+
+# (pointer indices of the structs to follow from the Event root, bit offset in the data section, bits)
+FieldMask = Tuple[Tuple[int, ...], int, int]
+
+
+class SerializedLog(list):
+  """
+  Events of a log, along with the serialized bytes of each event in raw. compare_logs compares
+  these bytes as they are, instead of serializing every event again.
+  """
+  def __init__(self, dat: bytes):
+    self.raw = [dat[start:end] for _, start, end in split_events(dat)]
+    super().__init__(log_from_bytes(r) for r in self.raw)
+
+  @classmethod
+  def from_file(cls, fn: str) -> "SerializedLog":
+    with FileReader(fn) as f:
+      dat = f.read()
+    if dat.startswith(b'BZh9'):
+      dat = bz2.decompress(dat)
+    return cls(dat)
+
 
 def remove_ignored_fields(msg, ignore):
   msg = msg.as_builder()
@@ -29,7 +67,7 @@ def remove_ignored_fields(msg, ignore):
     v = getattr(attr, keys[-1])
     if isinstance(v, bool):
       val = False
-    elif isinstance(v, numbers.Number):
+    elif isinstance(v, (numbers.Number, capnp.lib.capnp._DynamicEnum)):
       val = 0
     elif isinstance(v, (list, capnp.lib.capnp._DynamicListBuilder)):
       val = []
@@ -39,57 +77,251 @@ def remove_ignored_fields(msg, ignore):
   return msg
 
 
-def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None,):
+def field_mask(key: str) -> Optional[FieldMask]:
+  """Location of an ignored field in a serialized Event, None if it isn't a scalar reached through struct fields"""
+  keys = key.split(".")
+  builder = capnp_log.Event.new_message()
+  pointers = []
+  try:
+    for i, k in enumerate(keys):
+      field = next(f for f in builder.schema.node.struct.fields if f.name == k)
+      # nested union members share their slot with the other members, Event's union is checked by the caller
+      if field.which() != 'slot' or (i > 0 and field.discriminantValue != NO_DISCRIMINANT):
+        return None
+      field_type = field.slot.type.which()
+      if i == len(keys) - 1:
+        bits = FIELD_BITS.get(field_type)
+        return None if bits is None else (tuple(pointers), field.slot.offset * bits, bits)
+      if field_type != 'struct':
+        return None
+      pointers.append(field.slot.offset)
+      builder = builder.init(k)
+  except (StopIteration, AttributeError, capnp.KjException):
+    pass
+  return None
+
+
+def message_masks(which: str, ignore: List[str]) -> Optional[List[FieldMask]]:
+  """Masks for all ignored fields of a message type, None if one of them can't be masked in the serialized message"""
+  masks = []
+  for key in ignore:
+    keys = key.split(".")
+    if which != keys[0] and len(keys) > 1:
+      continue
+    mask = field_mask(key)
+    if mask is None:
+      return None
+    masks.append(mask)
+  return masks
+
+
+def _struct_at(dat: bytearray, ptr_pos: int) -> Optional[Tuple[int, int, int]]:
+  """Follows the struct pointer at ptr_pos, returns (data start, data words, pointer words) or None for a null pointer"""
+  lo, hi = struct.unpack_from("<iI", dat, ptr_pos)
+  if lo == 0 and hi == 0:
+    return None
+  if lo & 3 != 0:
+    raise ValueError("not a struct pointer")
+  start = ptr_pos + 8 + (lo >> 2) * 8
+  data_words, ptr_words = hi & 0xffff, hi >> 16
+  if start < 8 or start + (data_words + ptr_words) * 8 > len(dat):
+    raise ValueError("struct out of bounds")
+  return start, data_words, ptr_words
+
+
+def mask_fields(dat: bytes, masks: List[FieldMask]) -> Optional[bytearray]:
+  """Serialized message with the masked fields zeroed, None if the message layout isn't supported"""
+  # only single segment messages, the root pointer follows the segment table
+  if len(dat) < 16 or struct.unpack_from("<I", dat, 0)[0] != 0:
+    return None
+
+  ret = bytearray(dat)
+  try:
+    for pointers, bit_offset, bits in masks:
+      s = _struct_at(ret, 8)
+      for p in pointers:
+        if s is None or p >= s[2]:
+          break
+        s = _struct_at(ret, s[0] + (s[1] + p) * 8)
+      else:
+        if s is None or bit_offset + bits > s[1] * 64:
+          continue
+        pos = s[0] + bit_offset // 8
+        if bits == 1:
+          ret[pos] &= ~(1 << (bit_offset % 8)) & 0xff
+        else:
+          ret[pos:pos + bits // 8] = bytes(bits // 8)
+  except (ValueError, struct.error):
+    return None
+  return ret
+
+
+def diff_msgs(msg1, msg2, ignore_fields, tolerance) -> list:
+  msg1 = remove_ignored_fields(msg1, ignore_fields)
+  msg2 = remove_ignored_fields(msg2, ignore_fields)
+  if msg1.to_bytes() == msg2.to_bytes():
+    return []
+
+  msg1_dict = msg1.as_reader().to_dict(verbose=True)
+  msg2_dict = msg2.as_reader().to_dict(verbose=True)
+
+  dd = dictdiffer.diff(msg1_dict, msg2_dict, ignore=ignore_fields)
+
+  # Dictdiffer only supports relative tolerance, we also want to check for absolute
+  # TODO: add this to dictdiffer
+  def outside_tolerance(diff):
+    try:
+      if diff[0] == "change":
+        a, b = diff[2]
+        finite = math.isfinite(a) and math.isfinite(b)
+        if finite and isinstance(a, numbers.Number) and isinstance(b, numbers.Number):
+          return abs(a - b) > max(tolerance, tolerance * max(abs(a), abs(b)))
+    except TypeError:
+      pass
+    return True
+
+  return list(filter(outside_tolerance, dd))
+
+
+def compare_chunk(pairs, ignore_fields, tolerance, max_diffs_per_msg):
+  """
+  Compares (index, which, msg1 bytes, msg2 bytes) pairs. Returns the diffs of each
+  differing message as (index, which, diffs), and the number of differing messages
+  per type that weren't diffed after max_diffs_per_msg were found.
+  """
+  masks: Dict[str, Optional[List[FieldMask]]] = {}
+  diffs = []
+  diff_cnt: Counter = Counter()
+  truncated: Counter = Counter()
+  for idx, which, dat1, dat2 in pairs:
+    if which not in masks:
+      masks[which] = message_masks(which, ignore_fields)
+
+    # fast path, most messages are equal up to the ignored fields
+    if masks[which] is not None:
+      masked1, masked2 = mask_fields(dat1, masks[which]), mask_fields(dat2, masks[which])
+      if masked1 is not None and masked1 == masked2:
+        continue
+
+    if max_diffs_per_msg is not None and diff_cnt[which] >= max_diffs_per_msg:
+      # the log already differs for this type, only check if this message does
+      if remove_ignored_fields(log_from_bytes(dat1), ignore_fields).to_bytes() != \
+         remove_ignored_fields(log_from_bytes(dat2), ignore_fields).to_bytes():
+        truncated[which] += 1
+      continue
+
+    dd = diff_msgs(log_from_bytes(dat1), log_from_bytes(dat2), ignore_fields, tolerance)
+    if len(dd):
+      diffs.append((idx, which, dd))
+      diff_cnt[which] += 1
+  return diffs, truncated
+
+
+def serialized_events(log, ignore_msgs) -> List[Tuple[str, bytes]]:
+  """(which, serialized bytes) of the events that aren't ignored, the bytes of a SerializedLog are used as they are"""
+  raw = getattr(log, "raw", None)
+  ret = []
+  for i, msg in enumerate(log):
+    which = msg.which()
+    if which not in ignore_msgs:
+      ret.append((which, raw[i] if raw is not None else msg.as_builder().to_bytes()))
+  return ret
+
+
+class LogDiff(list):
+  """List of dictdiffer diffs, truncated counts the differing messages per type that weren't diffed"""
+  def __init__(self, diffs=(), truncated=None):
+    super().__init__(diffs)
+    self.truncated: Counter = Counter() if truncated is None else truncated
+
+
+def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None, max_diffs_per_msg=None, jobs=1, chunk_size=10000):
+  """
+  Returns the diffs between two logs, outside of the ignored fields and messages.
+
+  Messages are first compared serialized, with the ignored scalar fields masked. Only
+  the ones that differ are converted to dicts and diffed. With max_diffs_per_msg, only
+  that many differing messages per type are diffed, the others are counted in the
+  truncated field of the result. A log with truncated messages is never within tolerance.
+  """
   if ignore_fields is None:
     ignore_fields = []
   if ignore_msgs is None:
     ignore_msgs = []
   tolerance = EPSILON if tolerance is None else tolerance
 
-  log1, log2 = (
-    [m for m in log if m.which() not in ignore_msgs]
-    for log in (log1, log2)
-  )
+  events1, events2 = (serialized_events(log, ignore_msgs) for log in (log1, log2))
 
-  if len(log1) != len(log2):
-    cnt1 = Counter(m.which() for m in log1)
-    cnt2 = Counter(m.which() for m in log2)
-    raise Exception(f"logs are not same length: {len(log1)} VS {len(log2)}\n\t\t{cnt1}\n\t\t{cnt2}")
+  if len(events1) != len(events2):
+    cnt1 = Counter(which for which, _ in events1)
+    cnt2 = Counter(which for which, _ in events2)
+    raise Exception(f"logs are not same length: {len(events1)} VS {len(events2)}\n\t\t{cnt1}\n\t\t{cnt2}")
 
-  diff = []
-  for msg1, msg2 in zip(log1, log2, strict=True):
-    if msg1.which() != msg2.which():
+  pairs = []
+  for idx, ((which1, dat1), (which2, dat2)) in enumerate(zip(events1, events2, strict=True)):
+    if which1 != which2:
       raise Exception("msgs not aligned between logs")
+    pairs.append((idx, which1, dat1, dat2))
 
-    msg1 = remove_ignored_fields(msg1, ignore_fields)
-    msg2 = remove_ignored_fields(msg2, ignore_fields)
+  chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+  if jobs > 1 and len(chunks) > 1:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+      results = list(pool.map(compare_chunk, chunks, *([c] * len(chunks) for c in (ignore_fields, tolerance, max_diffs_per_msg))))
+  else:
+    results = [compare_chunk(c, ignore_fields, tolerance, max_diffs_per_msg) for c in chunks]
 
-    if msg1.to_bytes() != msg2.to_bytes():
-      msg1_dict = msg1.as_reader().to_dict(verbose=True)
-      msg2_dict = msg2.as_reader().to_dict(verbose=True)
+  # chunks are in log order, keep the first max_diffs_per_msg differing messages of each type
+  diff = LogDiff()
+  diff_cnt: Counter = Counter()
+  for chunk_diffs, truncated in results:
+    diff.truncated.update(truncated)
+    for _, which, dd in chunk_diffs:
+      if max_diffs_per_msg is not None and diff_cnt[which] >= max_diffs_per_msg:
+        diff.truncated[which] += 1
+        continue
+      diff_cnt[which] += 1
+      diff.extend(dd)
+  return diff
 
-      dd = dictdiffer.diff(msg1_dict, msg2_dict, ignore=ignore_fields)
 
-      # Dictdiffer only supports relative tolerance, we also want to check for absolute
-      # TODO: add this to dictdiffer
-      def outside_tolerance(diff):
-        try:
-          if diff[0] == "change":
-            a, b = diff[2]
-            finite = math.isfinite(a) and math.isfinite(b)
-            if finite and isinstance(a, numbers.Number) and isinstance(b, numbers.Number):
-              return abs(a - b) > max(tolerance, tolerance * max(abs(a), abs(b)))
-        except TypeError:
-          pass
-        return True
+def summarize_diff(diff, max_examples=3) -> List[str]:
+  """Per-field report of a compare_logs result: count, largest numeric change and a few examples"""
+  fields: Dict[Tuple[str, str], List] = defaultdict(list)
+  for d in diff:
+    fields[(d[0], str(d[1]))].append(d)
 
-      dd = list(filter(outside_tolerance, dd))
+  lines = []
+  for (kind, field), dd in sorted(fields.items(), key=lambda x: x[0][1]):
+    line = f"{kind} {field}: {len(dd)}"
+    deltas = []
+    for d in dd:
+      try:
+        if kind == "change" and all(isinstance(v, numbers.Number) for v in d[2]):
+          deltas.append(abs(d[2][1] - d[2][0]))
+      except TypeError:
+        pass
+    if len(deltas):
+      line += f", max abs change {max(deltas):.6g}"
+    lines.append(line)
+    lines.extend(f"\t{d}" for d in dd[:max_examples])
+    if len(dd) > max_examples:
+      lines.append(f"\t... {len(dd) - max_examples} more")
 
-      diff.extend(dd)
-  return diff
+  for which, cnt in sorted(getattr(diff, "truncated", {}).items()):
+    lines.append(f"{which}: {cnt} more differing msgs not diffed")
+  return lines
 
 
 if __name__ == "__main__":
-  log1 = list(LogReader(sys.argv[1]))
-  log2 = list(LogReader(sys.argv[2]))
-  print(compare_logs(log1, log2, sys.argv[3:]))
+  parser = argparse.ArgumentParser(description="Compare two logs")
+  parser.add_argument("log1")
+  parser.add_argument("log2")
+  parser.add_argument("ignore_fields", nargs="*")
+  parser.add_argument("--max-diffs-per-msg", type=int, default=None)
+  parser.add_argument("-j", "--jobs", type=int, default=1)
+  args = parser.parse_args()
+
+  log1 = SerializedLog.from_file(args.log1)
+  log2 = SerializedLog.from_file(args.log2)
+  diff = compare_logs(log1, log2, args.ignore_fields, max_diffs_per_msg=args.max_diffs_per_msg, jobs=args.jobs)
+  print("\n".join(summarize_diff(diff)))
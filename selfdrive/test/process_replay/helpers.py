@@ -1,11 +1,20 @@
 import os
 import shutil
+import unittest
 import uuid
 
 from typing import List, Optional
 
 from openpilot.common.params import Params
 
+# tests that download and replay the process replay segments run in the process replay CI job, which caches them
+REPLAY_ENV_VAR = "REPLAY_SEGMENT_TESTS"
+
+
+def replay_segment_test(func):
+  return unittest.skipUnless(REPLAY_ENV_VAR in os.environ, f"Downloads the process replay segments. Set {REPLAY_ENV_VAR} to run")(func)
+
+
 class OpenpilotPrefix(object):
   def __init__(self, prefix: Optional[str] = None, clean_dirs_on_exit: bool = True):
     self.prefix = prefix if prefix else str(uuid.uuid4())
@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
 import os
+import gc
 import time
 import copy
 import json
 import heapq
+import queue
 import signal
 import platform
-from collections import OrderedDict
+import importlib
+import threading
+from collections import OrderedDict, defaultdict, deque
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Callable, Union, Any, Iterable, Tuple
+from typing import DefaultDict, Deque, Dict, List, Optional, Callable, Union, Any, Iterable, Tuple
 from tqdm import tqdm
 import capnp
 
@@ -17,7 +21,7 @@ from cereal import car
 from cereal.services import service_list
 from cereal.visionipc import VisionIpcServer, get_endpoint_name as vipc_get_endpoint_name
 from openpilot.common.params import Params
-from openpilot.common.timeout import Timeout
+from openpilot.common.timeout import Timeout, TimeoutException
 from openpilot.common.realtime import DT_CTRL
 from panda.python import ALTERNATIVE_EXPERIENCE
 from openpilot.selfdrive.car.car_helpers import get_car, interfaces
@@ -25,13 +29,17 @@ from openpilot.selfdrive.manager.process_config import managed_processes
 from openpilot.selfdrive.test.process_replay.helpers import OpenpilotPrefix, DummySocket
 from openpilot.selfdrive.test.process_replay.vision_meta import meta_from_camera_state, available_streams
 from openpilot.selfdrive.test.process_replay.migration import migrate_all
+from openpilot.selfdrive.test.process_replay.replay_cache import CachedLog
 from openpilot.selfdrive.test.process_replay.capture import ProcessOutputCapture
+from openpilot.selfdrive.test.profiling.lib import SubMaster, PubMaster, ReplayDone
 from openpilot.tools.lib.logreader import LogReader
 
 # Numpy gives different results based on CPU features after version 19
 NUMPY_TOLERANCE = 1e-7
 PROC_REPLAY_DIR = os.path.dirname(os.path.abspath(__file__))
 FAKEDATA = os.path.join(PROC_REPLAY_DIR, "fakedata/")
+# python daemons with main(sm, pm[, main_pub socket]) that can be replayed in-process
+IN_PROCESS_PROCS = {"radard", "calibrationd", "paramsd", "torqued"}
 
 
 class LauncherWithCapture:
@@ -302,6 +310,176 @@ class ProcessContainer:
     return output_msgs
 
 
+class InProcessSubMaster(SubMaster):
+  def __init__(self, container: "InProcessContainer", services: List[str]):
+    super().__init__([], None, services)
+    # same as messaging.SubMaster, some daemons depend on the first frame
+    self.frame = -1
+    self.container = container
+
+  def update(self, timeout=None):
+    # with a main_pub, the daemon waits on that socket and the other services are only read
+    if self.container.main_sock is None:
+      self.container.wait_for_cycle()
+    self.update_msgs(self.container.cur_time, self.container.pop_latest())
+    if self.container.cfg.simulation:
+      for s in self.alive:
+        self.alive[s] = self.freq_ok[s] = True
+
+
+class InProcessPubMaster(PubMaster):
+  def __init__(self, container: "InProcessContainer"):
+    super().__init__()
+    self.container = container
+
+  def send(self, s: str, dat: Union[bytes, capnp._DynamicStructBuilder]) -> None:
+    if not isinstance(dat, bytes):
+      dat = dat.to_bytes()
+    self.container.published[s].append(dat)
+
+
+class InProcessSubSocket:
+  def __init__(self, container: "InProcessContainer"):
+    self.container = container
+
+  def receive(self, non_blocking: bool = False) -> Optional[bytes]:
+    if not non_blocking:
+      while len(self.container.main_msgs) == 0:
+        self.container.wait_for_cycle()
+    return self.container.main_msgs.popleft() if len(self.container.main_msgs) else None
+
+
+class InProcessContainer(ProcessContainer):
+  """
+  Runs a python daemon's main() in a thread of the replay process, with a fake SubMaster and
+  PubMaster instead of msgq sockets and a ReplayContext. The daemon blocks where it would wait
+  on its sockets until run_step hands over the next cycle of messages. The SubMaster only gets
+  the latest message of each service per cycle, like the conflated sockets of messaging.SubMaster.
+  """
+  def __init__(self, cfg: ProcessConfig):
+    super().__init__(cfg)
+    self.thread: Optional[threading.Thread] = None
+    self.main_sock: Optional[InProcessSubSocket] = None
+    self.gc_enabled = True
+
+    # replay -> daemon: messages of the next cycle, None to stop
+    self.cycle_msgs: queue.Queue = queue.Queue()
+    # daemon -> replay: None when the daemon waits for the next cycle, or the exception it raised
+    self.cycle_done: queue.Queue = queue.Queue()
+
+    self.cur_time = 0.
+    self.latest: Dict[str, capnp._DynamicStructReader] = {}
+    self.main_msgs: Deque[bytes] = deque()
+    self.published: DefaultDict[str, List[bytes]] = defaultdict(list)
+
+  def wait_for_cycle(self):
+    # called from the daemon thread
+    self.cycle_done.put(None)
+    msgs = self.cycle_msgs.get()
+    if msgs is None:
+      raise ReplayDone
+
+    for m in msgs:
+      if m.which() == self.cfg.main_pub:
+        self.main_msgs.append(m.as_builder().to_bytes())
+      else:
+        self.latest[m.which()] = m
+    self.cur_time = msgs[-1].logMonoTime / 1e9
+
+  def pop_latest(self) -> List[capnp._DynamicStructReader]:
+    msgs = list(self.latest.values())
+    self.latest = {}
+    return msgs
+
+  def _wait_for_daemon(self, timeout: int, error_msg: str):
+    try:
+      error = self.cycle_done.get(timeout=timeout)
+    except queue.Empty:
+      raise TimeoutException(error_msg) from None
+    if error is not None:
+      raise error
+
+  def _run(self, main: Callable):
+    sm = InProcessSubMaster(self, [s for s in self.cfg.pubs if s != self.cfg.main_pub])
+    args: List[Any] = [sm, InProcessPubMaster(self)]
+    if self.main_sock is not None:
+      args.append(self.main_sock)
+
+    try:
+      main(*args)
+      error: Exception = Exception(f"process exited: {repr(self.cfg.proc_name)}")
+    except ReplayDone:
+      return
+    except Exception as e:
+      error = e
+    self.cycle_done.put(error)
+
+  def start(
+    self, params_config: Dict[str, Any], environ_config: Dict[str, Any],
+    all_msgs: Union[LogReader, List[capnp._DynamicStructReader]],
+    fingerprint: Optional[str], capture_output: bool
+  ):
+    assert not capture_output, "output capture is not supported for in-process replay"
+    assert len(self.cfg.vision_pubs) == 0, "vision streams are not supported for in-process replay"
+
+    with self.prefix:
+      self._setup_env(params_config, environ_config)
+
+      if self.cfg.config_callback is not None:
+        params = Params()
+        self.cfg.config_callback(params, self.cfg, all_msgs)
+
+      if self.cfg.main_pub is not None:
+        self.main_sock = InProcessSubSocket(self)
+
+      # daemons disable gc in config_realtime_process
+      self.gc_enabled = gc.isenabled()
+      main = importlib.import_module(self.process.module).main
+      self.thread = threading.Thread(target=self._run, args=(main,), name=self.cfg.proc_name, daemon=True)
+      self.thread.start()
+
+      if self.cfg.init_callback is not None:
+        self.cfg.init_callback(None, None, all_msgs, fingerprint)
+
+      self._wait_for_daemon(10, f"timed out waiting for process to start: {repr(self.cfg.proc_name)}")
+
+  def stop(self):
+    with self.prefix:
+      if self.thread is not None and self.thread.is_alive():
+        self.cycle_msgs.put(None)
+        self.thread.join(timeout=1)
+      if self.gc_enabled:
+        gc.enable()
+      self.prefix.clean_dirs()
+      self._clean_env()
+
+  def run_step(self, msg: capnp._DynamicStructReader, frs: Optional[Dict[str, Any]]) -> List[capnp._DynamicStructReader]:
+    assert self.thread is not None
+
+    output_msgs = []
+    with self.prefix:
+      end_of_cycle = True
+      if self.cfg.should_recv_callback is not None:
+        end_of_cycle = self.cfg.should_recv_callback(msg, self.cfg, self.cnt)
+
+      self.msg_queue.append(msg)
+      if end_of_cycle:
+        self.cycle_msgs.put(self.msg_queue)
+        self.msg_queue = []
+        self._wait_for_daemon(self.cfg.timeout, f"timed out testing process {repr(self.cfg.proc_name)}")
+
+        # same order as draining the subscribed sockets one after another
+        for s in self.cfg.subs:
+          for dat in self.published.pop(s, []):
+            m = messaging.log_from_bytes(dat).as_builder()
+            m.logMonoTime = msg.logMonoTime + int(self.cfg.processing_time * 1e9)
+            output_msgs.append(m.as_reader())
+        self.published.clear()
+        self.cnt += 1
+
+    return output_msgs
+
+
 def controlsd_fingerprint_callback(rc, pm, msgs, fingerprint):
   print("start fingerprinting")
   params = Params()
@@ -634,15 +812,24 @@ def replay_process_with_name(name: Union[str, Iterable[str]], lr: Union[LogReade
 def replay_process(
   cfg: Union[ProcessConfig, Iterable[ProcessConfig]], lr: Union[LogReader, List[capnp._DynamicStructReader]], frs: Optional[Dict[str, Any]] = None,
   fingerprint: Optional[str] = None, return_all_logs: bool = False, custom_params: Optional[Dict[str, Any]] = None,
-  captured_output_store: Optional[Dict[str, Dict[str, str]]] = None, disable_progress: bool = False
+  captured_output_store: Optional[Dict[str, Dict[str, str]]] = None, disable_progress: bool = False, in_process: bool = False
 ) -> List[capnp._DynamicStructReader]:
+  """
+  in_process runs the IN_PROCESS_PROCS as threads of this process instead of separate processes,
+  which avoids the messaging overhead of each step. Not used when capturing the processes' output.
+  """
   if isinstance(cfg, Iterable):
     cfgs = list(cfg)
   else:
     cfgs = [cfg]
 
-  all_msgs = migrate_all(lr, old_logtime=True, camera_states=any(len(cfg.vision_pubs) != 0 for cfg in cfgs))
-  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress)
+  camera_states = any(len(cfg.vision_pubs) != 0 for cfg in cfgs)
+  if isinstance(lr, CachedLog) and lr.camera_states == camera_states:
+    # already migrated and sorted
+    all_msgs = lr
+  else:
+    all_msgs = migrate_all(lr, old_logtime=True, camera_states=camera_states)
+  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress, in_process)
 
   if return_all_logs:
     keys = {m.which() for m in process_logs}
@@ -658,7 +845,8 @@ def replay_process(
 
 def _replay_multi_process(
   cfgs: List[ProcessConfig], lr: Union[LogReader, List[capnp._DynamicStructReader]], frs: Optional[Dict[str, Any]], fingerprint: Optional[str],
-  custom_params: Optional[Dict[str, Any]], captured_output_store: Optional[Dict[str, Dict[str, str]]], disable_progress: bool
+  custom_params: Optional[Dict[str, Any]], captured_output_store: Optional[Dict[str, Dict[str, str]]], disable_progress: bool,
+  in_process: bool = False
 ) -> List[capnp._DynamicStructReader]:
   if fingerprint is not None:
     params_config = generate_params_config(lr=lr, fingerprint=fingerprint, custom_params=custom_params)
@@ -678,12 +866,15 @@ def _replay_multi_process(
                                                      f"undefined vision stream spotted, probably misconfigured process: {cfg.vision_pubs}"
     assert all(st in frs for st in cfg.vision_pubs), f"frs for this process must contain following vision streams: {cfg.vision_pubs}"
 
-  all_msgs = sorted(lr, key=lambda msg: msg.logMonoTime)
+  all_msgs = list(lr) if isinstance(lr, CachedLog) else sorted(lr, key=lambda msg: msg.logMonoTime)
   log_msgs = []
   try:
     containers = []
     for cfg in cfgs:
-      container = ProcessContainer(cfg)
+      if in_process and captured_output_store is None and cfg.proc_name in IN_PROCESS_PROCS:
+        container = InProcessContainer(cfg)
+      else:
+        container = ProcessContainer(cfg)
       containers.append(container)
       container.start(params_config, env_config, all_msgs, fingerprint, captured_output_store is not None)
 
@@ -692,30 +883,36 @@ def _replay_multi_process(
     lr_pubs = all_pubs - all_subs
     pubs_to_containers = {pub: [container for container in containers if pub in container.pubs] for pub in all_pubs}
 
-    pub_msgs = [msg for msg in all_msgs if msg.which() in lr_pubs]
-    # external queue for messages taken from logs; internal queue for messages generated by processes, which will be republished
-    external_pub_queue: List[capnp._DynamicStructReader] = pub_msgs.copy()
-    internal_pub_queue: List[capnp._DynamicStructReader] = []
-    # heap for maintaining the order of messages generated by processes, where each element: (logMonoTime, index in internal_pub_queue)
-    internal_pub_index_heap: List[Tuple[int, int]] = []
-
-    pbar = tqdm(total=len(external_pub_queue), disable=disable_progress)
-    while len(external_pub_queue) != 0 or (len(internal_pub_index_heap) != 0 and not all(c.has_empty_queue for c in containers)):
-      if len(internal_pub_index_heap) == 0 or (len(external_pub_queue) != 0 and external_pub_queue[0].logMonoTime < internal_pub_index_heap[0][0]):
-        msg = external_pub_queue.pop(0)
+    # messages taken from logs, already sorted by logMonoTime
+    external_msgs = [msg for msg in all_msgs if msg.which() in lr_pubs]
+    external_idx = 0
+    # messages generated by processes, which will be republished: (logMonoTime, sequence number, msg)
+    internal_heap: List[Tuple[int, int, capnp._DynamicStructReader]] = []
+    internal_cnt = 0
+    # containers holding messages for a cycle that hasn't run yet
+    pending_containers = 0
+
+    pbar = tqdm(total=len(external_msgs), disable=disable_progress)
+    while external_idx < len(external_msgs) or (len(internal_heap) != 0 and pending_containers != 0):
+      if len(internal_heap) == 0 or (external_idx < len(external_msgs) and external_msgs[external_idx].logMonoTime < internal_heap[0][0]):
+        msg = external_msgs[external_idx]
+        external_idx += 1
         pbar.update(1)
+        if external_idx % 1000 == 0:
+          pbar.set_postfix(republished=internal_cnt, queued=len(internal_heap), refresh=False)
       else:
-        _, index = heapq.heappop(internal_pub_index_heap)
-        msg = internal_pub_queue[index]
+        msg = heapq.heappop(internal_heap)[2]
 
-      target_containers = pubs_to_containers[msg.which()]
-      for container in target_containers:
+      for container in pubs_to_containers[msg.which()]:
+        was_empty = container.has_empty_queue
         output_msgs = container.run_step(msg, frs)
+        pending_containers += was_empty - container.has_empty_queue
         for m in output_msgs:
           if m.which() in all_pubs:
-            internal_pub_queue.append(m)
-            heapq.heappush(internal_pub_index_heap, (m.logMonoTime, len(internal_pub_queue) - 1))
+            heapq.heappush(internal_heap, (m.logMonoTime, internal_cnt, m))
+            internal_cnt += 1
         log_msgs.extend(output_msgs)
+    pbar.close()
   finally:
     for container in containers:
       container.stop()
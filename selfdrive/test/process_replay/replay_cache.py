@@ -0,0 +1,62 @@
+import hashlib
+import mmap
+import os
+
+from cereal import log as capnp_log
+from openpilot.common.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
+from openpilot.selfdrive.test.openpilotci import get_url
+from openpilot.selfdrive.test.process_replay import migration
+from openpilot.selfdrive.test.process_replay.migration import migrate_all
+from openpilot.tools.lib.logreader import LogReader
+from openpilot.tools.lib.url_file import CACHE_DIR
+
+REPLAY_CACHE_DIR = os.path.join(CACHE_DIR, "process_replay")
+
+
+def _migration_version() -> str:
+  # cached segments are invalidated when the migrations change
+  with open(migration.__file__, "rb") as f:
+    return hashlib.sha256(f.read()).hexdigest()[:8]
+
+
+class CachedLog(list):
+  """
+  Migrated and logMonoTime sorted messages of a segment, read from the replay cache.
+  The messages point into a read-only mmap of the cache file, which is shared
+  between all processes replaying the same segment.
+  """
+  def __init__(self, path: str, camera_states: bool):
+    with open(path, "rb") as f:
+      self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    super().__init__(capnp_log.Event.read_multiple_bytes(self.mm))
+    self.path = path
+    self.camera_states = camera_states
+
+
+def cache_path(segment: str, camera_states: bool = False) -> str:
+  name = segment.replace("|", "_")
+  return os.path.join(REPLAY_CACHE_DIR, f"{name}_{_migration_version()}{'_camera' if camera_states else ''}.raw")
+
+
+def cache_segment(segment: str, camera_states: bool = False) -> str:
+  """
+  Downloads, parses and migrates a segment (e.g. "<route>--<n>") once, and stores it
+  as uncompressed capnp events. Returns the path of the cache file.
+  """
+  path = cache_path(segment, camera_states)
+  if os.path.exists(path):
+    return path
+
+  r, n = segment.rsplit("--", 1)
+  msgs = migrate_all(LogReader(get_url(r, n)), old_logtime=True, camera_states=camera_states)
+  msgs.sort(key=lambda m: m.logMonoTime)
+
+  mkdirs_exists_ok(REPLAY_CACHE_DIR)
+  with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+    for msg in msgs:
+      f.write(msg.as_builder().to_bytes())
+  return path
+
+
+def load_cached_segment(segment: str, camera_states: bool = False) -> CachedLog:
+  return CachedLog(cache_segment(segment, camera_states), camera_states)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+import random
+import struct
+import unittest
+
+from cereal import log as capnp_log
+import cereal.messaging as messaging
+from openpilot.selfdrive.test.process_replay.compare_logs import SerializedLog, _struct_at, compare_logs, diff_msgs, field_mask, \
+                                                                 mask_fields, message_masks, remove_ignored_fields
+
+# bool, enum, float and nested struct fields, and fields of every Event
+IGNORE = ['logMonoTime', 'valid', 'carState.vEgo', 'carState.standstill', 'carState.gearShifter', 'carState.cruiseState.speed']
+
+# carState fields set by the tests, ignored or not
+CAR_STATE_FIELDS = {
+  'vEgo': [0., 1.5, -2.25],
+  'aEgo': [0., 1.5, -2.25],
+  'standstill': [False, True],
+  'leftBlinker': [False, True],
+  'rightBlinker': [False, True],
+  'steeringPressed': [False, True],
+  'gearShifter': ['unknown', 'park', 'drive', 'reverse'],
+  'cruiseState.speed': [0., 1.5, -2.25],
+  'cruiseState.enabled': [False, True],
+  'cruiseState.available': [False, True],
+}
+
+
+def car_state(values, **kwargs):
+  # always sets the fields in the same order, so equal messages are serialized the same
+  msg = capnp_log.Event.new_message(**kwargs)
+  msg.logMonoTime = values.get('logMonoTime', 0)
+  msg.valid = values.get('valid', True)
+  cs = msg.init('carState')
+  for key in CAR_STATE_FIELDS:
+    if key in values:
+      attr = cs
+      keys = key.split('.')
+      for k in keys[:-1]:
+        attr = getattr(attr, k)
+      setattr(attr, keys[-1], values[key])
+  return msg.to_bytes()
+
+
+def random_values(rng):
+  values = {k: rng.choice(v) for k, v in CAR_STATE_FIELDS.items()}
+  values['logMonoTime'] = rng.randrange(2**64)
+  values['valid'] = rng.random() < 0.5
+  return values
+
+
+def random_pair(rng):
+  values = random_values(rng)
+  other = dict(values)
+  for key in rng.sample(sorted(values), rng.randint(1, 3)):
+    other[key] = random_values(rng)[key]
+  return values, other
+
+
+def car_state_pointer(dat):
+  start, data_words, _ = _struct_at(dat, 8)
+  field = next(f for f in capnp_log.Event.schema.node.struct.fields if f.name == 'carState')
+  return start + (data_words + field.slot.offset) * 8
+
+
+def shrink(dat, data_words):
+  # carState struct of an older writer, with a shorter data section directly followed by the pointers
+  dat = bytearray(dat)
+  ptr = car_state_pointer(dat)
+  start, old_data_words, ptr_words = _struct_at(dat, ptr)
+  for i in range(ptr_words):
+    lo, hi = struct.unpack_from("<iI", dat, start + (old_data_words + i) * 8)
+    # struct and list pointers are relative to their own position
+    if (lo != 0 or hi != 0) and lo & 3 in (0, 1):
+      lo += (old_data_words - data_words) << 2
+    struct.pack_into("<iI", dat, start + (data_words + i) * 8, lo, hi)
+  struct.pack_into("<I", dat, ptr + 4, data_words | ptr_words << 16)
+  return bytes(dat)
+
+
+def masked_equal(dat1, dat2, masks):
+  masked1, masked2 = mask_fields(dat1, masks), mask_fields(dat2, masks)
+  return masked1 is not None and masked1 == masked2
+
+
+def builder_equal(dat1, dat2, ignore):
+  return remove_ignored_fields(messaging.log_from_bytes(dat1), ignore).to_bytes() == \
+         remove_ignored_fields(messaging.log_from_bytes(dat2), ignore).to_bytes()
+
+
+class TestCompareLogs(unittest.TestCase):
+  def test_mask_matches_builder(self):
+    rng = random.Random(0)
+    masks = message_masks('carState', IGNORE)
+    self.assertEqual(len(masks), len(IGNORE))
+
+    equal = 0
+    for _ in range(1000):
+      values, other = random_pair(rng)
+      dat1, dat2 = car_state(values), car_state(other)
+      self.assertEqual(masked_equal(dat1, dat2, masks), builder_equal(dat1, dat2, IGNORE), (values, other))
+      equal += builder_equal(dat1, dat2, IGNORE)
+    # both outcomes are covered
+    self.assertGreater(equal, 100)
+    self.assertLess(equal, 900)
+
+  def test_bool_neighbours(self):
+    # only the bit of an ignored bool is masked, not the others in its byte
+    masks = message_masks('carState', ['carState.standstill'])
+    values = {k: v[0] for k, v in CAR_STATE_FIELDS.items()}
+    for key in ('standstill', 'leftBlinker', 'rightBlinker', 'steeringPressed', 'cruiseState.enabled', 'cruiseState.available'):
+      dat1, dat2 = car_state(values), car_state({**values, key: True})
+      self.assertEqual(masked_equal(dat1, dat2, masks), key == 'standstill', key)
+
+  def test_union_members(self):
+    # masks of other Event union members aren't applied
+    self.assertEqual(message_masks('controlsState', IGNORE), [field_mask('logMonoTime'), field_mask('valid')])
+
+    # nested union members share their slot, these messages always go through the builder path
+    key = 'controlsState.lateralControlState.pidState.p'
+    self.assertIsNone(field_mask(key))
+    self.assertIsNone(message_masks('controlsState', [key]))
+    self.assertEqual(message_masks('carState', [key]), [])
+
+    msgs = []
+    for p in (1., 2.):
+      msg = messaging.new_message('controlsState')
+      msg.controlsState.lateralControlState.init('pidState').p = p
+      msgs.append(msg.as_reader())
+    self.assertEqual(compare_logs(msgs[:1], msgs[1:], ['logMonoTime', key]), [])
+    self.assertEqual(len(compare_logs(msgs[:1], msgs[1:], ['logMonoTime'])), 1)
+
+  def test_short_data_section(self):
+    rng = random.Random(1)
+    masks = message_masks('carState', IGNORE)
+    dat = car_state({})
+    _, full_data_words, _ = _struct_at(dat, car_state_pointer(dat))
+    for _ in range(1000):
+      values, other = random_pair(rng)
+      data_words = rng.randint(0, full_data_words)
+      dat1, dat2 = shrink(car_state(values), data_words), shrink(car_state(other), data_words)
+      # the masked bytes can differ for equal messages, the fields past the data section are left in the bytes
+      if masked_equal(dat1, dat2, masks):
+        self.assertTrue(builder_equal(dat1, dat2, IGNORE), (values, other, data_words))
+
+    # an ignored field in the shortened data section is still masked
+    _, bit_offset, _ = field_mask('carState.vEgo')
+    values = {k: v[0] for k, v in CAR_STATE_FIELDS.items()}
+    dat1, dat2 = (shrink(car_state({**values, 'vEgo': v}), bit_offset // 64 + 1) for v in (1., 2.))
+    self.assertTrue(masked_equal(dat1, dat2, masks))
+    self.assertTrue(builder_equal(dat1, dat2, IGNORE))
+
+  def test_multi_segment(self):
+    masks = message_masks('carState', IGNORE)
+    values = {k: v[0] for k, v in CAR_STATE_FIELDS.items()}
+    dat1, dat2 = (car_state({**values, 'aEgo': a}, num_first_segment_words=2) for a in (0., 1.))
+    self.assertGreater(struct.unpack_from("<I", dat1, 0)[0], 0)
+    self.assertIsNone(mask_fields(dat1, masks))
+
+    # still diffed through the builder path
+    log1, log2 = [messaging.log_from_bytes(dat1)], [messaging.log_from_bytes(dat2)]
+    self.assertEqual(len(compare_logs(log1, log2, IGNORE)), 1)
+    self.assertEqual(compare_logs(log1, log1, IGNORE), [])
+
+  def test_compare_logs(self):
+    rng = random.Random(2)
+    pairs = [random_pair(rng) for _ in range(300)]
+    dat1 = [car_state(values) for values, _ in pairs]
+    dat2 = [car_state(other) for _, other in pairs]
+    log1, log2 = [messaging.log_from_bytes(d) for d in dat1], [messaging.log_from_bytes(d) for d in dat2]
+
+    expected = [d for m1, m2 in zip(log1, log2, strict=True) for d in diff_msgs(m1, m2, IGNORE, 0.)]
+    self.assertGreater(len(expected), 0)
+    self.assertEqual(compare_logs(log1, log2, IGNORE, tolerance=0.), expected)
+    self.assertEqual(compare_logs(log1, log2, IGNORE, tolerance=0., chunk_size=7), expected)
+
+    # serialized logs are compared as they are
+    serialized1, serialized2 = SerializedLog(b"".join(dat1)), SerializedLog(b"".join(dat2))
+    self.assertEqual(serialized1.raw, dat1)
+    self.assertEqual(compare_logs(serialized1, serialized2, IGNORE, tolerance=0.), expected)
+    self.assertEqual(compare_logs(serialized1, log2, IGNORE, tolerance=0.), expected)
+
+
+if __name__ == "__main__":
+  unittest.main()
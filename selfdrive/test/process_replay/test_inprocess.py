@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import unittest
+
+from openpilot.selfdrive.test.process_replay.compare_logs import remove_ignored_fields
+from openpilot.selfdrive.test.process_replay.helpers import replay_segment_test
+from openpilot.selfdrive.test.process_replay.process_replay import IN_PROCESS_PROCS, get_process_config, replay_process
+from openpilot.selfdrive.test.process_replay.replay_cache import load_cached_segment
+from openpilot.selfdrive.test.process_replay.test_processes import segments
+
+
+class TestInProcess(unittest.TestCase):
+  @replay_segment_test
+  def test_matches_subprocess(self):
+    for car, segment in segments:
+      lr = load_cached_segment(segment)
+      for proc in sorted(IN_PROCESS_PROCS):
+        with self.subTest(car=car, proc=proc):
+          cfg = get_process_config(proc)
+          expected = replay_process(cfg, lr, disable_progress=True)
+          msgs = replay_process(cfg, lr, disable_progress=True, in_process=True)
+
+          self.assertGreater(len(expected), 0)
+          self.assertEqual([m.which() for m in msgs], [m.which() for m in expected])
+          # only the fields that depend on wall time are ignored
+          ignore = [f for f in cfg.ignore if f not in ("logMonoTime", "valid")]
+          for m1, m2 in zip(msgs, expected, strict=True):
+            self.assertEqual(remove_ignored_fields(m1, ignore).to_bytes(), remove_ignored_fields(m2, ignore).to_bytes())
+
+
+if __name__ == "__main__":
+  unittest.main()
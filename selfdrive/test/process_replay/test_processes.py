@@ -9,11 +9,10 @@ from typing import Any, DefaultDict, Dict
 
 from openpilot.selfdrive.car.car_helpers import interface_names
 from openpilot.selfdrive.test.openpilotci import get_url, upload_file
-from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs
+from openpilot.selfdrive.test.process_replay.compare_logs import SerializedLog, compare_logs, summarize_diff
 from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS, PROC_REPLAY_DIR, FAKEDATA, check_openpilot_enabled, replay_process
+from openpilot.selfdrive.test.process_replay.replay_cache import cache_segment, load_cached_segment
 from openpilot.system.version import get_commit
-from openpilot.tools.lib.filereader import FileReader
-from openpilot.tools.lib.logreader import LogReader
 from openpilot.tools.lib.helpers import save_log
 
 source_segments = [
@@ -66,14 +65,16 @@ excluded_interfaces = ["mock", "mazda", "tesla"]
 BASE_URL = "https://commadataci.blob.core.windows.net/openpilotci/"
 REF_COMMIT_FN = os.path.join(PROC_REPLAY_DIR, "ref_commit")
 EXCLUDED_PROCS = {"modeld", "dmonitoringmodeld"}
+# differing msgs of a type that are diffed, the rest are only counted
+MAX_DIFFS_PER_MSG = 100
 
 
 def run_test_process(data):
-  segment, cfg, args, cur_log_fn, ref_log_path, lr_dat = data
+  segment, cfg, args, cur_log_fn, ref_log_path = data
   res = None
   if not args.upload_only:
-    lr = LogReader.from_bytes(lr_dat)
-    res, log_msgs = test_process(cfg, lr, segment, ref_log_path, cur_log_fn, args.ignore_fields, args.ignore_msgs)
+    lr = load_cached_segment(segment)
+    res, log_msgs = test_process(cfg, lr, segment, ref_log_path, cur_log_fn, args.ignore_fields, args.ignore_msgs, args.in_process)
     # save logs so we can upload when updating refs
     save_log(cur_log_fn, log_msgs)
 
@@ -85,22 +86,16 @@ def run_test_process(data):
   return (segment, cfg.proc_name, res)
 
 
-def get_log_data(segment):
-  r, n = segment.rsplit("--", 1)
-  with FileReader(get_url(r, n)) as f:
-    return (segment, f.read())
-
-
-def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=None, ignore_msgs=None):
+def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=None, ignore_msgs=None, in_process=False):
   if ignore_fields is None:
     ignore_fields = []
   if ignore_msgs is None:
     ignore_msgs = []
 
-  ref_log_msgs = list(LogReader(ref_log_path))
+  ref_log_msgs = SerializedLog.from_file(ref_log_path)
 
   try:
-    log_msgs = replay_process(cfg, lr, disable_progress=True)
+    log_msgs = replay_process(cfg, lr, disable_progress=True, in_process=in_process)
   except Exception as e:
     raise Exception("failed on segment: " + segment) from e
 
@@ -110,7 +105,8 @@ def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=Non
       return f"Route did not enable at all or for long enough: {new_log_path}", log_msgs
 
   try:
-    return compare_logs(ref_log_msgs, log_msgs, ignore_fields + cfg.ignore, ignore_msgs, cfg.tolerance), log_msgs
+    return compare_logs(ref_log_msgs, log_msgs, ignore_fields + cfg.ignore, ignore_msgs, cfg.tolerance,
+                        max_diffs_per_msg=MAX_DIFFS_PER_MSG), log_msgs
   except Exception as e:
     return str(e), log_msgs
 
@@ -143,13 +139,14 @@ def format_diff(results, log_paths, ref_commit):
 
         cnt: Dict[str, int] = {}
         for d in diff:
-          diff2 += f"\t{str(d)}\n"
-
           k = str(d[1])
           cnt[k] = 1 if k not in cnt else cnt[k] + 1
+        diff2 += "".join(f"\t{line}\n" for line in summarize_diff(diff))
 
         for k, v in sorted(cnt.items()):
           diff1 += f"        {k}: {v}\n"
+        for which, v in sorted(getattr(diff, "truncated", {}).items()):
+          diff1 += f"        {which}: {v} more msgs differ\n"
         failed = True
   return diff1, diff2, failed
 
@@ -177,6 +174,8 @@ if __name__ == "__main__":
                       help="Updates reference logs using current commit")
   parser.add_argument("--upload-only", action="store_true",
                       help="Skips testing processes and uploads logs from previous test run")
+  parser.add_argument("--in-process", action="store_true",
+                      help="Replay the pure python processes in-process instead of through msgq")
   parser.add_argument("-j", "--jobs", type=int, default=max(cpu_count - 2, 1),
                       help="Max amount of parallel jobs")
   args = parser.parse_args()
@@ -212,11 +211,11 @@ if __name__ == "__main__":
   log_paths: DefaultDict[str, Dict[str, Dict[str, str]]] = defaultdict(lambda: defaultdict(dict))
   with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
     if not args.upload_only:
+      # parse and migrate each segment once, workers share the cached segments through mmap
       download_segments = [seg for car, seg in segments if car in tested_cars]
-      log_data: Dict[str, LogReader] = {}
-      p1 = pool.map(get_log_data, download_segments)
-      for segment, lr in tqdm(p1, desc="Getting Logs", total=len(download_segments)):
-        log_data[segment] = lr
+      p1 = pool.map(cache_segment, download_segments)
+      for _ in tqdm(p1, desc="Getting Logs", total=len(download_segments)):
+        pass
 
     pool_args: Any = []
     for car_brand, segment in segments:
@@ -234,8 +233,7 @@ if __name__ == "__main__":
           ref_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{ref_commit}.bz2")
           ref_log_path = ref_log_fn if os.path.exists(ref_log_fn) else BASE_URL + os.path.basename(ref_log_fn)
 
-        dat = None if args.upload_only else log_data[segment]
-        pool_args.append((segment, cfg, args, cur_log_fn, ref_log_path, dat))
+        pool_args.append((segment, cfg, args, cur_log_fn, ref_log_path))
 
         log_paths[segment][cfg.proc_name]['ref'] = ref_log_path
         log_paths[segment][cfg.proc_name]['new'] = cur_log_fn
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from openpilot.common.params import Params
+from openpilot.selfdrive.test.process_replay.helpers import OpenpilotPrefix
+from openpilot.selfdrive.test.process_replay.migration import migrate_all
+from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS
+from openpilot.selfdrive.test.process_replay.replay_cache import load_cached_segment
+from openpilot.selfdrive.test.process_replay.test_processes import segments
+from openpilot.selfdrive.test.profiling.lib import SubMaster, PubMaster, SubSocket, ReplayDone
+from openpilot.system.version import get_commit
+from openpilot.tools.lib.logreader import LogReader
+
+PROFILING_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FN = os.path.join(PROFILING_DIR, "benchmark_baseline.json")
+
+# module with main(sm, pm[, can_sock]), and the service the process polls on
+PROCS = {
+  'controlsd': ('openpilot.selfdrive.controls.controlsd', 'can'),
+  'radard': ('openpilot.selfdrive.controls.radard', 'can'),
+  'plannerd': ('openpilot.selfdrive.controls.plannerd', 'modelV2'),
+  'calibrationd': ('openpilot.selfdrive.locationd.calibrationd', 'cameraOdometry'),
+  'paramsd': ('openpilot.selfdrive.locationd.paramsd', 'liveLocationKalman'),
+  'torqued': ('openpilot.selfdrive.locationd.torqued', 'liveLocationKalman'),
+  'dmonitoringd': ('openpilot.selfdrive.monitoring.dmonitoringd', 'driverStateV2'),
+}
+CAN_PROCS = {'controlsd', 'radard'}
+
+PERCENTILES = (50, 90, 99)
+# metrics compared against the baseline, lower is better
+COMPARED_METRICS = ('latency_us.p50', 'latency_us.p99', 'alloc_peak_kb.p50')
+
+
+class BenchmarkSubMaster(SubMaster):
+  """Replay SubMaster that records what the process does between two update() calls, which is one loop iteration"""
+  def __init__(self, msgs, trigger, services, trace_memory=False):
+    super().__init__(msgs, trigger, services)
+    self.trace_memory = trace_memory
+    self.step_start: Optional[float] = None
+    self.step_mem = 0
+    self.step_blocks = 0
+    self.latencies: List[float] = []
+    self.blocks: List[int] = []
+    self.alloc_peaks: List[int] = []
+
+  def update(self, timeout=None):
+    if self.step_start is not None:
+      if self.trace_memory:
+        self.alloc_peaks.append(tracemalloc.get_traced_memory()[1] - self.step_mem)
+      else:
+        self.latencies.append(time.perf_counter() - self.step_start)
+        self.blocks.append(sys.getallocatedblocks() - self.step_blocks)
+
+    super().update(timeout)
+
+    if self.trace_memory:
+      tracemalloc.reset_peak()
+      self.step_mem = tracemalloc.get_traced_memory()[0]
+    else:
+      self.step_blocks = sys.getallocatedblocks()
+    self.step_start = time.perf_counter()
+
+
+def load_segment(segment: str) -> List[Any]:
+  """Segment is a process replay car name (e.g. TOYOTA) or a local rlog path"""
+  if os.path.exists(segment):
+    return migrate_all(LogReader(segment), old_logtime=True)
+  return load_cached_segment(dict(segments)[segment])
+
+
+def run_process(proc: str, msgs: List[Any], trace_memory: bool = False) -> BenchmarkSubMaster:
+  module, trigger = PROCS[proc]
+  cfg = next(c for c in CONFIGS if c.proc_name == proc)
+  main = importlib.import_module(module).main
+
+  sm = BenchmarkSubMaster(msgs, trigger, list(cfg.pubs), trace_memory=trace_memory)
+  args = [sm, PubMaster()]
+  if proc in CAN_PROCS:
+    args.append(SubSocket(msgs, 'can'))
+
+  if trace_memory:
+    tracemalloc.start()
+  try:
+    main(*args)
+  except ReplayDone:
+    pass
+  finally:
+    if trace_memory:
+      tracemalloc.stop()
+  return sm
+
+
+def summarize(values, scale: float = 1.) -> Dict[str, float]:
+  values = np.asarray(values, dtype=np.float64) * scale
+  if not len(values):
+    return {}
+  ret = {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+  ret.update(mean=float(np.mean(values)), max=float(np.max(values)))
+  return ret
+
+
+def benchmark(proc: str, msgs: List[Any], fingerprint: str, warmup: int) -> Dict[str, Any]:
+  os.environ['FINGERPRINT'] = fingerprint
+  os.environ['SKIP_FW_QUERY'] = "1"
+  os.environ['REPLAY'] = "1"
+
+  results = []
+  for trace_memory in (False, True):
+    with OpenpilotPrefix():
+      # some procs block on CarParams
+      for msg in msgs:
+        if msg.which() == 'carParams':
+          Params().put("CarParams", msg.carParams.as_builder().to_bytes())
+          break
+      results.append(run_process(proc, msgs, trace_memory=trace_memory))
+  timed, traced = results
+
+  return {
+    'steps': len(timed.latencies[warmup:]),
+    'latency_us': summarize(timed.latencies[warmup:], 1e6),
+    'alloc_blocks': summarize(timed.blocks[warmup:]),
+    'alloc_peak_kb': summarize(traced.alloc_peaks[warmup:], 1 / 1024),
+  }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+  """Returns a description of each metric that is worse than the baseline by more than threshold (relative)"""
+  regressions = []
+  for proc, res in results['procs'].items():
+    base = baseline['procs'].get(proc)
+    if base is None:
+      continue
+    for metric in COMPARED_METRICS:
+      group, stat = metric.split('.')
+      new, old = res[group].get(stat), base[group].get(stat)
+      if new is None or old is None:
+        continue
+      if new > old * (1 + threshold):
+        regressions.append(f"{proc} {metric}: {old:.1f} -> {new:.1f} ({(new / max(old, 1e-9) - 1) * 100:+.0f}%)")
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Replays a segment through processes and reports per loop iteration latency and allocations",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--procs", nargs="*", default=list(PROCS), choices=list(PROCS))
+  parser.add_argument("--segment", default="TOYOTA", help="process replay car name or local rlog path")
+  parser.add_argument("--warmup", type=int, default=100, help="loop iterations excluded from the statistics")
+  parser.add_argument("--output", help="write results JSON to this path")
+  parser.add_argument("--baseline", default=BASELINE_FN, help="results JSON to compare against")
+  parser.add_argument("--threshold", type=float, default=0.2, help="relative increase of a metric that counts as a regression")
+  parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+  args = parser.parse_args()
+
+  msgs = load_segment(args.segment)
+  fingerprint = next(m.carParams.carFingerprint for m in msgs if m.which() == 'carParams')
+
+  results: Dict[str, Any] = {
+    'commit': get_commit(default=""),
+    'segment': args.segment,
+    'fingerprint': fingerprint,
+    'procs': {},
+  }
+  for proc in args.procs:
+    results['procs'][proc] = res = benchmark(proc, msgs, fingerprint, args.warmup)
+    lat = res['latency_us']
+    print(f"{proc:>13s}: {res['steps']:5d} steps, latency p50 {lat.get('p50', 0):8.1f} us, p99 {lat.get('p99', 0):8.1f} us, " +
+          f"alloc peak p50 {res['alloc_peak_kb'].get('p50', 0):7.1f} kB")
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(results, f, indent=2)
+
+  if args.update_baseline:
+    with open(args.baseline, "w") as f:
+      json.dump(results, f, indent=2)
+    print(f"Updated baseline {args.baseline}")
+    return
+
+  if not os.path.exists(args.baseline):
+    print(f"No baseline at {args.baseline}, run with --update-baseline to create one")
+    return
+
+  with open(args.baseline) as f:
+    baseline = json.load(f)
+  if baseline.get('segment') != args.segment:
+    print(f"WARNING: baseline was recorded on segment {baseline.get('segment')}")
+
+  regressions = compare(results, baseline, args.threshold)
+  for r in regressions:
+    print(f"REGRESSION {r}")
+  if regressions:
+    sys.exit(1)
+  print(f"No regressions against baseline from commit {baseline.get('commit')}")
+
+
+if __name__ == "__main__":
+  main()
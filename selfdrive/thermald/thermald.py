@@ -17,9 +17,11 @@ from openpilot.common.dict_helpers import strip_deprecated_keys
 from openpilot.common.time import MIN_DATE
 from openpilot.common.filter_simple import FirstOrderFilter
 from openpilot.common.params import Params
+from openpilot.common.params_watcher import ParamsWatcher
 from openpilot.common.realtime import DT_TRML
 from openpilot.selfdrive.controls.lib.alertmanager import set_offroad_alert
 from openpilot.system.hardware import HARDWARE, TICI, AGNOS
+from openpilot.system.hardware.sysfs import SYSFS
 from openpilot.system.loggerd.config import get_available_percent
 from openpilot.selfdrive.statsd import statlog
 from openpilot.system.swaglog import cloudlog
@@ -63,29 +65,31 @@ def populate_tz_by_type():
     with open(os.path.join("/sys/devices/virtual/thermal", n, "type")) as f:
       tz_by_type[f.read().strip()] = int(n.removeprefix("thermal_zone"))
 
-def read_tz(x):
+def tz_path(x) -> Optional[str]:
   if x is None:
-    return 0
+    return None
 
   if isinstance(x, str):
     if tz_by_type is None:
       populate_tz_by_type()
     x = tz_by_type[x]
 
-  try:
-    with open(f"/sys/devices/virtual/thermal/thermal_zone{x}/temp") as f:
-      return int(f.read())
-  except FileNotFoundError:
-    return 0
+  return f"/sys/devices/virtual/thermal/thermal_zone{x}/temp"
 
 
 def read_thermal(thermal_config):
+  # read every zone in one snapshot through the cached sysfs fds
+  zones = {*thermal_config.cpu[0], *thermal_config.gpu[0], thermal_config.mem[0], thermal_config.ambient[0], *thermal_config.pmic[0]}
+  paths = {z: tz_path(z) for z in zones if z is not None}
+  temps = {z: int(t) if t else 0 for z, t in zip(paths.keys(), SYSFS.snapshot(paths.values()), strict=True)}
+  temps[None] = 0
+
   dat = messaging.new_message('deviceState')
-  dat.deviceState.cpuTempC = [read_tz(z) / thermal_config.cpu[1] for z in thermal_config.cpu[0]]
-  dat.deviceState.gpuTempC = [read_tz(z) / thermal_config.gpu[1] for z in thermal_config.gpu[0]]
-  dat.deviceState.memoryTempC = read_tz(thermal_config.mem[0]) / thermal_config.mem[1]
-  dat.deviceState.ambientTempC = read_tz(thermal_config.ambient[0]) / thermal_config.ambient[1]
-  dat.deviceState.pmicTempC = [read_tz(z) / thermal_config.pmic[1] for z in thermal_config.pmic[0]]
+  dat.deviceState.cpuTempC = [temps[z] / thermal_config.cpu[1] for z in thermal_config.cpu[0]]
+  dat.deviceState.gpuTempC = [temps[z] / thermal_config.gpu[1] for z in thermal_config.gpu[0]]
+  dat.deviceState.memoryTempC = temps[thermal_config.mem[0]] / thermal_config.mem[1]
+  dat.deviceState.ambientTempC = temps[thermal_config.ambient[0]] / thermal_config.ambient[1]
+  dat.deviceState.pmicTempC = [temps[z] / thermal_config.pmic[1] for z in thermal_config.pmic[0]]
   return dat
 
 
@@ -200,6 +204,8 @@ def thermald_thread(end_event, hw_queue) -> None:
   engaged_prev = False
 
   params = Params()
+  params_watcher = ParamsWatcher(["Offroad_ConnectivityNeeded", "DisableUpdates", "SnoozeUpdate", "DoUninstall", "HasAcceptedTerms",
+                                  "CompletedTrainingVersion", "Passive", "IsDriverViewEnabled", "IsTakingSnapshot", "LastAthenaPingTime"])
   power_monitor = PowerMonitoring()
 
   HARDWARE.initialize_hardware()
@@ -293,16 +299,18 @@ def thermald_thread(end_event, hw_queue) -> None:
     startup_conditions["time_valid"] = now > MIN_DATE
     set_offroad_alert_if_changed("Offroad_InvalidTime", (not startup_conditions["time_valid"]) and peripheral_panda_present)
 
-    startup_conditions["up_to_date"] = params.get("Offroad_ConnectivityNeeded") is None or params.get_bool("DisableUpdates") or params.get_bool("SnoozeUpdate")
-    startup_conditions["not_uninstalling"] = not params.get_bool("DoUninstall")
-    startup_conditions["accepted_terms"] = params.get("HasAcceptedTerms") == terms_version
+    params_watcher.update()
+    startup_conditions["up_to_date"] = params_watcher.get("Offroad_ConnectivityNeeded") is None or params_watcher.get_bool("DisableUpdates") or \
+                                       params_watcher.get_bool("SnoozeUpdate")
+    startup_conditions["not_uninstalling"] = not params_watcher.get_bool("DoUninstall")
+    startup_conditions["accepted_terms"] = params_watcher.get("HasAcceptedTerms") == terms_version
 
     # with 2% left, we killall, otherwise the phone will take a long time to boot
     startup_conditions["free_space"] = msg.deviceState.freeSpacePercent > 2
-    startup_conditions["completed_training"] = params.get("CompletedTrainingVersion") == training_version or \
-                                               params.get_bool("Passive")
-    startup_conditions["not_driver_view"] = not params.get_bool("IsDriverViewEnabled")
-    startup_conditions["not_taking_snapshot"] = not params.get_bool("IsTakingSnapshot")
+    startup_conditions["completed_training"] = params_watcher.get("CompletedTrainingVersion") == training_version or \
+                                               params_watcher.get_bool("Passive")
+    startup_conditions["not_driver_view"] = not params_watcher.get_bool("IsDriverViewEnabled")
+    startup_conditions["not_taking_snapshot"] = not params_watcher.get_bool("IsTakingSnapshot")
 
     # must be at an engageable thermal band to go onroad
     startup_conditions["device_temp_engageable"] = thermal_status < ThermalStatus.red
@@ -392,7 +400,7 @@ def thermald_thread(end_event, hw_queue) -> None:
     msg.deviceState.started = started_ts is not None
     msg.deviceState.startedMonoTime = int(1e9*(started_ts or 0))
 
-    last_ping = params.get("LastAthenaPingTime")
+    last_ping = params_watcher.get("LastAthenaPingTime")
     if last_ping is not None:
       msg.deviceState.lastAthenaPingTime = int(last_ping)
 
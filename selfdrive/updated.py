@@ -210,7 +210,8 @@ def handle_agnos_update() -> None:
 
   manifest_path = os.path.join(OVERLAY_MERGED, "system/hardware/tici/agnos.json")
   target_slot_number = get_target_slot_number()
-  flash_agnos_update(manifest_path, target_slot_number, cloudlog)
+  # updated checks again on every update, reuse the partition hashes of earlier checks in this boot
+  flash_agnos_update(manifest_path, target_slot_number, cloudlog, use_cache=True)
   set_offroad_alert("Offroad_NeosUpdate", False)
 
 
@@ -0,0 +1,65 @@
+import os
+import threading
+from typing import Dict, Iterable, List, Optional
+
+
+class SysfsReader:
+  """
+  Reads sysfs and procfs attributes through file descriptors that are kept open.
+  These files are regenerated on every read at offset 0, so a pread on the cached
+  fd replaces the open/read/close of each poll. Safe to share between threads.
+  """
+  def __init__(self, size: int = 4096):
+    self.size = size
+    self.fds: Dict[str, int] = {}
+    self.lock = threading.Lock()
+
+  def _fd(self, path: str) -> int:
+    fd = self.fds.get(path)
+    if fd is None:
+      with self.lock:
+        fd = self.fds.get(path)
+        if fd is None:
+          fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+          self.fds[path] = fd
+    return fd
+
+  def read(self, path: str) -> str:
+    """Raises OSError like open() if the file can't be read"""
+    fd = self._fd(path)
+    try:
+      return os.pread(fd, self.size, 0).decode()
+    except OSError:
+      self.invalidate(path)
+      raise
+
+  def read_int(self, path: str, default: int = 0) -> int:
+    try:
+      return int(self.read(path))
+    except (OSError, ValueError):
+      return default
+
+  def snapshot(self, paths: Iterable[str]) -> List[Optional[str]]:
+    """Reads all paths in one pass, None for the ones that can't be read"""
+    ret: List[Optional[str]] = []
+    for path in paths:
+      try:
+        ret.append(self.read(path))
+      except OSError:
+        ret.append(None)
+    return ret
+
+  def invalidate(self, path: str) -> None:
+    with self.lock:
+      fd = self.fds.pop(path, None)
+    if fd is not None:
+      os.close(fd)
+
+  def close(self) -> None:
+    with self.lock:
+      fds, self.fds = self.fds, {}
+    for fd in fds.values():
+      os.close(fd)
+
+
+SYSFS = SysfsReader()
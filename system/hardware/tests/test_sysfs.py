@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+
+from openpilot.system.hardware.sysfs import SysfsReader
+
+
+class TestSysfsReader(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.reader = SysfsReader()
+
+  def tearDown(self):
+    self.reader.close()
+    self.tmpdir.cleanup()
+
+  def _write(self, name, val):
+    path = os.path.join(self.tmpdir.name, name)
+    with open(path, 'w') as f:
+      f.write(val)
+    return path
+
+  def test_reread_cached_fd(self):
+    path = self._write("temp", "42000\n")
+    self.assertEqual(self.reader.read_int(path), 42000)
+    fd = self.reader.fds[path]
+
+    self._write("temp", "43000\n")
+    self.assertEqual(self.reader.read_int(path), 43000)
+    self.assertEqual(self.reader.fds[path], fd)
+
+  def test_snapshot(self):
+    paths = [self._write(f"zone{i}", str(i)) for i in range(3)]
+    missing = os.path.join(self.tmpdir.name, "missing")
+    self.assertEqual(self.reader.snapshot([*paths, missing]), ["0", "1", "2", None])
+    self.assertEqual(self.reader.read_int(missing, default=-1), -1)
+    self.assertNotIn(missing, self.reader.fds)
+
+
+if __name__ == "__main__":
+  unittest.main()
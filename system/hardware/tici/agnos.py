@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import contextlib
+import fcntl
 import hashlib
 import json
 import lzma
@@ -6,7 +8,8 @@ import os
 import struct
 import subprocess
 import time
-from typing import Dict, Generator, List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Generator, Iterator, List, Optional, Tuple, Union
 
 import requests
 
@@ -15,10 +18,26 @@ import openpilot.system.hardware.tici.casync as casync
 SPARSE_CHUNK_FMT = struct.Struct('H2xI4x')
 CAIBX_URL = "https://commadist.azureedge.net/agnosupdate/"
 
+# chunk index of the partitions written by earlier updates, and chunks downloaded by them
+CASYNC_DIR = os.getenv("CASYNC_DIR", "/data/casync")
+CASYNC_INDEX_PATH = os.path.join(CASYNC_DIR, "index")
+CASYNC_CACHE_PATH = os.path.join(CASYNC_DIR, "cache")
+CASYNC_CACHE_MAX_SIZE = 512 * 1024 * 1024
+
+# raw hashes of the partitions computed during this boot, used by the update checks that opt in
+HASH_CACHE_PATH = os.getenv("AGNOS_HASH_CACHE_PATH", "/data/agnos_hash_cache.json")
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+VERIFY_WORKERS = 4
+
+
+# size of the pieces the images are streamed to the partitions in
+WRITE_CHUNK_SIZE = 1024 * 1024
+
 
 class StreamingDecompressor:
   def __init__(self, url: str) -> None:
-    self.buf = b""
+    # decompressed data not read yet, consumed from the front without copying the rest
+    self.buf = bytearray()
 
     self.req = requests.get(url, stream=True, headers={'Accept-Encoding': None}, timeout=60)  # type: ignore
     self.it = self.req.iter_content(chunk_size=1024 * 1024)
@@ -26,7 +45,7 @@ class StreamingDecompressor:
     self.eof = False
     self.sha256 = hashlib.sha256()
 
-  def read(self, length: int) -> bytes:
+  def fill(self, length: int) -> None:
     while len(self.buf) < length:
       self.req.raise_for_status()
 
@@ -35,17 +54,48 @@ class StreamingDecompressor:
       except StopIteration:
         self.eof = True
         break
-      out = self.decompressor.decompress(compressed)
-      self.buf += out
+      self.buf += self.decompressor.decompress(compressed)
 
-    result = self.buf[:length]
-    self.buf = self.buf[length:]
+  def read(self, length: int) -> bytes:
+    self.fill(length)
+
+    with memoryview(self.buf) as buf:
+      result = buf[:length].tobytes()
+    del self.buf[:len(result)]
 
     self.sha256.update(result)
     return result
 
+  def readinto(self, b) -> int:
+    """Reads up to len(b) bytes into b, less only at the end of the stream"""
+    with memoryview(b) as view, view.cast('B') as out:
+      self.fill(out.nbytes)
+
+      n = min(out.nbytes, len(self.buf))
+      with memoryview(self.buf) as buf:
+        out[:n] = buf[:n]
+      del self.buf[:n]
+
+      self.sha256.update(out[:n])
+    return n
+
+
+def read_chunks(f: StreamingDecompressor, length: Optional[int] = None) -> Generator[memoryview, None, None]:
+  """
+  Yields length bytes of f, or all of it, in pieces of up to WRITE_CHUNK_SIZE. The pieces share
+  one buffer, each is only valid until the next one is requested.
+  """
+  buf = memoryview(bytearray(WRITE_CHUNK_SIZE if length is None else min(length, WRITE_CHUNK_SIZE)))
+  while length is None or length > 0:
+    n = f.readinto(buf if length is None else buf[:length])
+    if n == 0:
+      break
+    yield buf[:n]
+    if length is not None:
+      length -= n
+
 
-def unsparsify(f: StreamingDecompressor) -> Generator[bytes, None, None]:
+def unsparsify(f: StreamingDecompressor) -> Generator[Union[bytes, memoryview], None, None]:
   # https://source.android.com/devices/bootloader/images#sparse-format
   magic = struct.unpack("I", f.read(4))[0]
   assert(magic == 0xed26ff3a)
@@ -67,12 +117,14 @@ def unsparsify(f: StreamingDecompressor) -> Generator[bytes, None, None]:
     chunk_type, out_blocks = SPARSE_CHUNK_FMT.unpack(f.read(12))
 
     if chunk_type == 0xcac1:  # Raw
-      # TODO: yield in smaller chunks. Yielding only block_sz is too slow. Largest observed data chunk is 252 MB.
-      yield f.read(out_blocks * block_sz)
+      yield from read_chunks(f, out_blocks * block_sz)
     elif chunk_type == 0xcac2:  # Fill
       filler = f.read(4) * (block_sz // 4)
-      for _ in range(out_blocks):
-        yield filler
+      blocks_per_write = max(1, WRITE_CHUNK_SIZE // block_sz)
+      fill = filler * blocks_per_write
+      for i in range(0, out_blocks, blocks_per_write):
+        n = min(blocks_per_write, out_blocks - i)
+        yield fill if n == blocks_per_write else filler * n
     elif chunk_type == 0xcac3:  # Don't care
       yield b""
     else:
@@ -80,9 +132,8 @@ def unsparsify(f: StreamingDecompressor) -> Generator[bytes, None, None]:
 
 
 # noop wrapper with same API as unsparsify() for non sparse images
-def noop(f: StreamingDecompressor) -> Generator[bytes, None, None]:
-  while not f.eof:
-    yield f.read(1024 * 1024)
+def noop(f: StreamingDecompressor) -> Generator[memoryview, None, None]:
+  yield from read_chunks(f)
 
 
 def get_target_slot_number() -> int:
@@ -104,20 +155,99 @@ def get_partition_path(target_slot_number: int, partition: dict) -> str:
   return path
 
 
-def get_raw_hash(path: str, partition_size: int) -> str:
+def get_boot_id() -> str:
+  with open("/proc/sys/kernel/random/boot_id") as f:
+    return f.read().strip()
+
+
+class HashCache:
+  """
+  Raw hashes of partitions, so repeated update checks don't read them again. The entries are only used
+  in the boot they were computed in, since partitions can be flashed without the updater in between,
+  and are invalidated before the updater writes to a partition. The file is shared by all processes
+  running the updater, updates of it hold an exclusive lock on a lock file next to it.
+  """
+  def __init__(self, path: str) -> None:
+    self.path = path
+
+  @contextlib.contextmanager
+  def locked(self) -> Iterator[None]:
+    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+      fcntl.flock(fd, fcntl.LOCK_EX)
+      yield
+    finally:
+      os.close(fd)
+
+  def load(self) -> Dict[str, Dict[str, Union[str, int]]]:
+    try:
+      with open(self.path) as f:
+        entries = json.load(f)
+      boot_id = get_boot_id()
+      return {k: v for k, v in entries.items() if v.get('boot_id') == boot_id}
+    except (OSError, ValueError, AttributeError):
+      return {}
+
+  def get(self, path: str, size: int) -> Optional[str]:
+    try:
+      with self.locked():
+        entry = self.load().get(path)
+    except OSError:
+      return None
+    if entry is None or entry['size'] != size:
+      return None
+    return str(entry['hash'])
+
+  def put(self, path: str, size: int, raw_hash: str) -> None:
+    try:
+      with self.locked():
+        entries = self.load()
+        entries[path] = {'boot_id': get_boot_id(), 'size': size, 'hash': raw_hash}
+        casync.atomic_write(self.path, json.dumps(entries).encode())
+    except OSError:
+      pass
+
+  def invalidate(self, path: str) -> None:
+    try:
+      with self.locked():
+        entries = self.load()
+        if entries.pop(path, None) is not None:
+          casync.atomic_write(self.path, json.dumps(entries).encode())
+    except OSError:
+      pass
+
+
+hash_cache = HashCache(HASH_CACHE_PATH)
+
+
+def get_raw_hash(path: str, partition_size: int, use_cache: bool = False) -> str:
+  if use_cache:
+    cached = hash_cache.get(path, partition_size)
+    if cached is not None:
+      return cached
+
   raw_hash = hashlib.sha256()
-  pos, chunk_size = 0, 1024 * 1024
+  pos = 0
+  buf = memoryview(bytearray(HASH_CHUNK_SIZE))
 
-  with open(path, 'rb+') as out:
+  # unbuffered, each read goes straight into buf and hashing it releases the GIL
+  with open(path, 'rb', buffering=0) as out:
     while pos < partition_size:
-      n = min(chunk_size, partition_size - pos)
-      raw_hash.update(out.read(n))
+      n = out.readinto(buf[:min(HASH_CHUNK_SIZE, partition_size - pos)])
+      if not n:
+        break
+      raw_hash.update(buf[:n])
       pos += n
 
-  return raw_hash.hexdigest().lower()
+  ret = raw_hash.hexdigest().lower()
+  if use_cache:
+    hash_cache.put(path, partition_size, ret)
+  return ret
 
 
-def verify_partition(target_slot_number: int, partition: Dict[str, Union[str, int]], force_full_check: bool = False) -> bool:
+def verify_partition(target_slot_number: int, partition: Dict[str, Union[str, int]], force_full_check: bool = False,
+                     use_cache: bool = False) -> bool:
   full_check = partition['full_check'] or force_full_check
   path = get_partition_path(target_slot_number, partition)
 
@@ -132,7 +262,7 @@ def verify_partition(target_slot_number: int, partition: Dict[str, Union[str, in
   partition_hash: str = partition['hash_raw']
 
   if full_check:
-    return get_raw_hash(path, partition_size) == partition_hash.lower()
+    return get_raw_hash(path, partition_size, use_cache=use_cache and not force_full_check) == partition_hash.lower()
   else:
     with open(path, 'rb+') as out:
       out.seek(partition_size)
@@ -141,6 +271,7 @@ def verify_partition(target_slot_number: int, partition: Dict[str, Union[str, in
 
 def clear_partition_hash(target_slot_number: int, partition: dict) -> None:
   path = get_partition_path(target_slot_number, partition)
+  hash_cache.invalidate(path)
   with open(path, 'wb+') as out:
     partition_size = partition['size']
 
@@ -149,10 +280,10 @@ def clear_partition_hash(target_slot_number: int, partition: dict) -> None:
     os.sync()
 
 
-def extract_compressed_image(target_slot_number: int, partition: dict, cloudlog):
-  path = get_partition_path(target_slot_number, partition)
+def write_compressed_image(path: str, partition: dict) -> None:
   downloader = StreamingDecompressor(partition['url'])
 
+  hash_cache.invalidate(path)
   with open(path, 'wb+') as out:
     # Flash partition
     last_p = 0
@@ -178,22 +309,29 @@ def extract_compressed_image(target_slot_number: int, partition: dict, cloudlog)
     os.sync()
 
 
-def extract_casync_image(target_slot_number: int, partition: dict, cloudlog):
+def extract_compressed_image(target_slot_number: int, partition: dict, cloudlog):
+  write_compressed_image(get_partition_path(target_slot_number, partition), partition)
+
+
+def extract_casync_image(target_slot_number: int, partition: dict, cloudlog, use_cache: bool = False):
   path = get_partition_path(target_slot_number, partition)
   seed_path = path[:-1] + ('b' if path[-1] == 'a' else 'a')
 
   target = casync.parse_caibx(partition['casync_caibx'])
+  index = casync.ChunkIndex(CASYNC_INDEX_PATH)
 
   sources: List[Tuple[str, casync.ChunkReader, casync.ChunkDict]] = []
 
   # First source is the current partition.
   try:
-    raw_hash = get_raw_hash(seed_path, partition['size'])
+    raw_hash = get_raw_hash(seed_path, partition['size'], use_cache)
     caibx_url = f"{CAIBX_URL}{partition['name']}-{raw_hash}.caibx"
 
     try:
       cloudlog.info(f"casync fetching {caibx_url}")
-      sources += [('seed', casync.FileChunkReader(seed_path), casync.build_chunk_dict(casync.parse_caibx(caibx_url)))]
+      seed = casync.parse_caibx(caibx_url)
+      index.update(seed_path, seed)
+      sources += [('seed', casync.FileChunkReader(seed_path), casync.build_chunk_dict(seed))]
     except requests.RequestException:
       cloudlog.error(f"casync failed to load {caibx_url}")
   except Exception:
@@ -202,8 +340,18 @@ def extract_casync_image(target_slot_number: int, partition: dict, cloudlog):
   # Second source is the target partition, this allows for resuming
   sources += [('target', casync.FileChunkReader(path), casync.build_chunk_dict(target))]
 
+  # Then all other partitions written by earlier updates, with their chunks at any offset,
+  # including what the target partition had before this update
+  exclude = (seed_path,) if sources[0][0] == 'seed' else ()
+  sources += index.sources(exclude=exclude)
+
+  # And chunks downloaded before, e.g. by an interrupted update
+  sources += [('cache', casync.RemoteChunkReader(CASYNC_CACHE_PATH), casync.store_chunk_dict(CASYNC_CACHE_PATH, target))]
+
   # Finally we add the remote source to download any missing chunks
-  sources += [('remote', casync.RemoteChunkReader(partition['casync_store']), casync.build_chunk_dict(target))]
+  # and keep them in the cache, up to its maximum size
+  remote = casync.RemoteChunkReader(partition['casync_store'], cache_path=CASYNC_CACHE_PATH, cache_max_size=CASYNC_CACHE_MAX_SIZE)
+  sources += [('remote', remote, casync.build_chunk_dict(target))]
 
   last_p = 0
 
@@ -214,18 +362,32 @@ def extract_casync_image(target_slot_number: int, partition: dict, cloudlog):
       last_p = p
       print(f"Installing {partition['name']}: {p}", flush=True)
 
+  hash_cache.invalidate(path)
   stats = casync.extract(target, sources, path, progress)
   cloudlog.error(f'casync done {json.dumps(stats)}')
+  cloudlog.info(f"casync reused {casync.get_reuse_ratio(stats) * 100:.1f}% of {partition['name']}, " +
+                json.dumps({name: round(r, 4) for name, r in casync.get_ratios(stats).items()}))
 
   os.sync()
   if not verify_partition(target_slot_number, partition, force_full_check=True):
+    try:
+      index.remove(path)
+    except OSError:
+      cloudlog.exception("casync failed to update chunk index")
     raise Exception(f"Raw hash mismatch '{partition['hash_raw'].lower()}'")
 
+  # the index and cache only speed up later updates, the partition is already verified
+  try:
+    index.update(path, target)
+  except OSError:
+    cloudlog.exception("casync failed to update chunk index")
+  casync.prune_store(CASYNC_CACHE_PATH, CASYNC_CACHE_MAX_SIZE)
+
 
-def flash_partition(target_slot_number: int, partition: dict, cloudlog, standalone=False):
+def flash_partition(target_slot_number: int, partition: dict, cloudlog, standalone=False, use_cache=False):
   cloudlog.info(f"Downloading and writing {partition['name']}")
 
-  if verify_partition(target_slot_number, partition):
+  if verify_partition(target_slot_number, partition, use_cache=use_cache):
     cloudlog.info(f"Already flashed {partition['name']}")
     return
 
@@ -237,7 +399,7 @@ def flash_partition(target_slot_number: int, partition: dict, cloudlog, standalo
   path = get_partition_path(target_slot_number, partition)
 
   if ('casync_caibx' in partition) and not standalone:
-    extract_casync_image(target_slot_number, partition, cloudlog)
+    extract_casync_image(target_slot_number, partition, cloudlog, use_cache)
   else:
     extract_compressed_image(target_slot_number, partition, cloudlog)
 
@@ -263,7 +425,11 @@ def swap(manifest_path: str, target_slot_number: int, cloudlog) -> None:
       cloudlog.error(f"Swap failed {out}")
 
 
-def flash_agnos_update(manifest_path: str, target_slot_number: int, cloudlog, standalone=False) -> None:
+def flash_agnos_update(manifest_path: str, target_slot_number: int, cloudlog, standalone=False, use_cache=False) -> None:
+  """
+  Flashes the partitions of the manifest that don't verify. use_cache reuses the hashes of partitions
+  computed earlier in this boot, for update checks that run repeatedly.
+  """
   update = json.load(open(manifest_path))
 
   cloudlog.info(f"Target slot {target_slot_number}")
@@ -276,7 +442,7 @@ def flash_agnos_update(manifest_path: str, target_slot_number: int, cloudlog, st
 
     for retries in range(10):
       try:
-        flash_partition(target_slot_number, partition, cloudlog, standalone)
+        flash_partition(target_slot_number, partition, cloudlog, standalone, use_cache)
         success = True
         break
 
@@ -292,9 +458,15 @@ def flash_agnos_update(manifest_path: str, target_slot_number: int, cloudlog, st
   cloudlog.info(f"AGNOS ready on slot {target_slot_number}")
 
 
-def verify_agnos_update(manifest_path: str, target_slot_number: int) -> bool:
+def verify_partitions(target_slot_number: int, partitions: List[dict], use_cache: bool = False) -> List[bool]:
+  """verify_partition for each partition, hashing them in parallel"""
+  with ThreadPoolExecutor(max_workers=VERIFY_WORKERS) as pool:
+    return list(pool.map(lambda partition: verify_partition(target_slot_number, partition, use_cache=use_cache), partitions))
+
+
+def verify_agnos_update(manifest_path: str, target_slot_number: int, use_cache: bool = False) -> bool:
   update = json.load(open(manifest_path))
-  return all(verify_partition(target_slot_number, partition) for partition in update)
+  return all(verify_partitions(target_slot_number, update, use_cache))
 
 
 if __name__ == "__main__":
@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
+import hashlib
 import io
+import json
 import lzma
 import os
 import struct
 import sys
+import threading
 import time
 from abc import ABC, abstractmethod
-from collections import defaultdict, namedtuple
-from typing import Callable, Dict, List, Optional, Tuple
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 import requests
 from Crypto.Hash import SHA512
@@ -21,12 +25,18 @@ CA_HEADER_LEN = 48
 CA_TABLE_HEADER_LEN = 16
 CA_TABLE_ENTRY_LEN = 40
 CA_TABLE_MIN_LEN = CA_TABLE_HEADER_LEN + CA_TABLE_ENTRY_LEN
+CA_CHUNK_SIZE_MIN, CA_CHUNK_SIZE_AVG, CA_CHUNK_SIZE_MAX = 16 * 1024, 64 * 1024, 256 * 1024
 
 CHUNK_DOWNLOAD_TIMEOUT = 60
 CHUNK_DOWNLOAD_RETRIES = 3
 
 CAIBX_DOWNLOAD_TIMEOUT = 120
 
+# threads checking local chunks and fetching, decompressing and hashing the others
+EXTRACT_WORKERS = 8
+# fetched chunks kept ahead of the writer
+EXTRACT_MAX_PENDING = 64
+
 Chunk = namedtuple('Chunk', ['sha', 'offset', 'length'])
 ChunkDict = Dict[bytes, Chunk]
 
@@ -41,27 +51,38 @@ class FileChunkReader(ChunkReader):
   """Reads chunks from a local file"""
   def __init__(self, fn: str) -> None:
     super().__init__()
+    self.fn = fn
     self.f = open(fn, 'rb')
 
   def __del__(self):
     self.f.close()
 
   def read(self, chunk: Chunk) -> bytes:
-    self.f.seek(chunk.offset)
-    return self.f.read(chunk.length)
+    # pread doesn't move the file position, so chunks can be read from several threads
+    return os.pread(self.f.fileno(), chunk.length, chunk.offset)
 
 
 class RemoteChunkReader(ChunkReader):
   """Reads lzma compressed chunks from a remote store"""
 
-  def __init__(self, url: str) -> None:
+  def __init__(self, url: str, cache_path: Optional[str] = None, cache_max_size: Optional[int] = None) -> None:
     super().__init__()
     self.url = url
-    self.session = requests.Session()
+    self.cache_path = cache_path
+    self.cache_max_size = cache_max_size
+    self.cache_size = store_size(cache_path) if cache_path is not None and cache_max_size is not None else 0
+    self.cache_lock = threading.Lock()
+    self.local = threading.local()
+
+  @property
+  def session(self) -> requests.Session:
+    # one session per thread
+    if not hasattr(self.local, 'session'):
+      self.local.session = requests.Session()
+    return self.local.session
 
   def read(self, chunk: Chunk) -> bytes:
-    sha_hex = chunk.sha.hex()
-    url = os.path.join(self.url, sha_hex[:4], sha_hex + ".cacnk")
+    url = get_chunk_path(self.url, chunk.sha)
 
     if os.path.isfile(url):
       with open(url, 'rb') as f:
@@ -79,9 +100,84 @@ class RemoteChunkReader(ChunkReader):
       resp.raise_for_status()
       contents = resp.content
 
+      # downloaded chunks are kept in a local store, so they don't have to be downloaded again
+      if self.cache_path is not None and self.reserve_cache(len(contents)):
+        write_chunk(self.cache_path, chunk.sha, contents)
+
     decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_AUTO)
     return decompressor.decompress(contents)
 
+  def reserve_cache(self, size: int) -> bool:
+    """Claims space for a chunk in the cache, chunks that don't fit are not cached.
+    Nothing is pruned here, the cache may be a source of the running extract"""
+    with self.cache_lock:
+      if self.cache_max_size is not None and self.cache_size + size > self.cache_max_size:
+        return False
+      self.cache_size += size
+      return True
+
+
+def get_chunk_path(store_path: str, sha: bytes) -> str:
+  sha_hex = sha.hex()
+  return os.path.join(store_path, sha_hex[:4], sha_hex + ".cacnk")
+
+
+def atomic_write(path: str, data: bytes) -> None:
+  tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+  with open(tmp_path, 'wb') as f:
+    f.write(data)
+  os.replace(tmp_path, path)
+
+
+def write_chunk(store_path: str, sha: bytes, contents: bytes) -> None:
+  """Adds a compressed chunk to a local store"""
+  path = get_chunk_path(store_path, sha)
+  try:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write(path, contents)
+  except OSError:
+    pass
+
+
+def store_chunk_dict(store_path: str, chunks: List[Chunk]) -> ChunkDict:
+  """The chunks that are in a local store"""
+  return {sha: c for sha, c in build_chunk_dict(chunks).items() if os.path.isfile(get_chunk_path(store_path, sha))}
+
+
+def store_size(store_path: str) -> int:
+  """Total size in bytes of the chunks in a local store"""
+  size = 0
+  for root, _, fns in os.walk(store_path):
+    for fn in fns:
+      try:
+        size += os.stat(os.path.join(root, fn)).st_size
+      except FileNotFoundError:
+        pass
+  return size
+
+
+def prune_store(store_path: str, max_size: int) -> None:
+  """Removes the least recently written chunks from a local store until it's at most max_size bytes"""
+  files = []
+  for root, _, fns in os.walk(store_path):
+    for fn in fns:
+      path = os.path.join(root, fn)
+      try:
+        st = os.stat(path)
+      except FileNotFoundError:
+        continue
+      files.append((st.st_mtime, st.st_size, path))
+
+  size = sum(f[1] for f in files)
+  for _, file_size, path in sorted(files):
+    if size <= max_size:
+      break
+    try:
+      os.unlink(path)
+    except FileNotFoundError:
+      pass
+    size -= file_size
+
 
 def parse_caibx(caibx_path: str) -> List[Chunk]:
   """Parses the chunks from a caibx file. Can handle both local and remote files.
@@ -132,6 +228,20 @@ def parse_caibx(caibx_path: str) -> List[Chunk]:
   return chunks
 
 
+def write_caibx(chunks: List[Chunk], caibx_path: str) -> None:
+  """Writes a list of consecutive chunks as a caibx file"""
+  min_size = min((c.length for c in chunks), default=CA_CHUNK_SIZE_MIN)
+  max_size = max((c.length for c in chunks), default=CA_CHUNK_SIZE_MAX)
+
+  dat = struct.pack("<QQQQQQ", CA_HEADER_LEN, CA_FORMAT_INDEX, FLAGS, min_size, CA_CHUNK_SIZE_AVG, max_size)
+  dat += struct.pack("<QQ", 2**64 - 1, CA_FORMAT_TABLE)
+  for c in chunks:
+    dat += struct.pack("<Q", c.offset + c.length) + c.sha
+  table_len = CA_TABLE_MIN_LEN + len(chunks) * CA_TABLE_ENTRY_LEN
+  dat += struct.pack("<QQQQQ", 0, 0, CA_HEADER_LEN, table_len, CA_FORMAT_TABLE_TAIL_MARKER)
+  atomic_write(caibx_path, dat)
+
+
 def build_chunk_dict(chunks: List[Chunk]) -> ChunkDict:
   """Turn a list of chunks into a dict for faster lookups based on hash.
   Keep first chunk since it's more likely to be already downloaded."""
@@ -142,50 +252,192 @@ def build_chunk_dict(chunks: List[Chunk]) -> ChunkDict:
   return r
 
 
+def chunk_valid(bts: bytes, chunk: Chunk) -> bool:
+  return len(bts) == chunk.length and SHA512.new(bts, truncate="256").digest() == chunk.sha
+
+
+# how the writer gets a chunk: read from a checked local source, fetched in the pool, or tried source by source
+LOCAL, FETCH, SERIAL = range(3)
+
+
 def extract(target: List[Chunk],
             sources: List[Tuple[str, ChunkReader, ChunkDict]],
             out_path: str,
-            progress: Optional[Callable[[int], None]] = None):
+            progress: Optional[Callable[[int], None]] = None,
+            workers: int = EXTRACT_WORKERS):
+  """
+  Writes each target chunk from the first source that has it with the right length and hash.
+
+  Chunks in local files are checked first, in parallel. Chunks that need another reader are fetched,
+  decompressed and hashed in a thread pool ahead of the writer, each unique chunk once. The writer
+  writes in target order, so a source reading back from out_path gets the same data as when extracting
+  chunk by chunk, and the stats are the same.
+  """
   stats: Dict[str, int] = defaultdict(int)
 
   mode = 'rb+' if os.path.exists(out_path) else 'wb'
-  with open(out_path, mode) as out:
-    for cur_chunk in target:
-
-      # Find source for desired chunk
-      for name, chunk_reader, store_chunks in sources:
+  with open(out_path, mode) as out, ThreadPoolExecutor(max_workers=workers) as pool:
+    out_sources: Set[int] = {k for k, (_, reader, _) in enumerate(sources)
+                             if isinstance(reader, FileChunkReader) and os.path.samefile(reader.fn, out_path)}
+    target_idx = {c.offset: i for i, c in enumerate(target)}
+
+    def plan(i: int) -> Tuple[int, int]:
+      # runs before anything is written, out_path still has its previous contents
+      cur_chunk = target[i]
+      for k, (_, chunk_reader, store_chunks) in enumerate(sources):
+        if cur_chunk.sha not in store_chunks:
+          continue
+        c = store_chunks[cur_chunk.sha]
+        if not isinstance(chunk_reader, FileChunkReader):
+          return FETCH, k
+
+        if k in out_sources and c.offset < cur_chunk.offset:
+          # written by the time this chunk is, valid if it's the same chunk of the target
+          j = target_idx.get(c.offset)
+          if c.offset + c.length <= cur_chunk.offset and j is not None and target[j].sha == cur_chunk.sha:
+            return (LOCAL, k) if c.length == cur_chunk.length else (SERIAL, k)
+          return SERIAL, k
+
+        if chunk_valid(chunk_reader.read(c), cur_chunk):
+          return LOCAL, k
+      return SERIAL, 0
+
+    def fetch(k: int, cur_chunk: Chunk) -> Optional[bytes]:
+      _, chunk_reader, store_chunks = sources[k]
+      bts = chunk_reader.read(store_chunks[cur_chunk.sha])
+      return bts if chunk_valid(bts, cur_chunk) else None
+
+    def resolve(cur_chunk: Chunk, start: int) -> Tuple[int, bytes]:
+      for k in range(start, len(sources)):
+        _, chunk_reader, store_chunks = sources[k]
         if cur_chunk.sha in store_chunks:
           bts = chunk_reader.read(store_chunks[cur_chunk.sha])
+          if chunk_valid(bts, cur_chunk):
+            return k, bts
+      raise RuntimeError("Desired chunk not found in provided stores")
+
+    plans = list(pool.map(plan, range(len(target))))
+
+    # fetches are keyed by source and hash, and dropped once the last chunk using them is written
+    to_fetch = [(k, target[i]) for i, (how, k) in enumerate(plans) if how == FETCH]
+    uses = Counter((k, c.sha) for k, c in to_fetch)
+    fetches: Dict[Tuple[int, bytes], Future] = {}
+    next_fetch = cur_fetch = 0
+
+    total = 0
+    for i, cur_chunk in enumerate(target):
+      how, k = plans[i]
+      bts: Optional[bytes] = None
+      if how == LOCAL:
+        _, chunk_reader, store_chunks = sources[k]
+        c = store_chunks[cur_chunk.sha]
+        # a chunk that is already in place doesn't need to be written again
+        if not (k in out_sources and c.offset == cur_chunk.offset):
+          bts = chunk_reader.read(c)
+      elif how == FETCH:
+        # the current chunk is always submitted, even if the pending ones are all reused later
+        while next_fetch < len(to_fetch) and (next_fetch <= cur_fetch or len(fetches) < EXTRACT_MAX_PENDING):
+          fk, fc = to_fetch[next_fetch]
+          if (fk, fc.sha) not in fetches:
+            fetches[(fk, fc.sha)] = pool.submit(fetch, fk, fc)
+          next_fetch += 1
+
+        cur_fetch += 1
+        key = (k, cur_chunk.sha)
+        bts = fetches[key].result()
+        uses[key] -= 1
+        if uses[key] == 0:
+          del fetches[key]
+        if bts is None:
+          k, bts = resolve(cur_chunk, k + 1)
+      else:
+        k, bts = resolve(cur_chunk, k)
 
-          # Check length
-          if len(bts) != cur_chunk.length:
-            continue
+      # Write to output
+      if bts is not None:
+        os.pwrite(out.fileno(), bts, cur_chunk.offset)
 
-          # Check hash
-          if SHA512.new(bts, truncate="256").digest() != cur_chunk.sha:
-            continue
+      stats[sources[k][0]] += cur_chunk.length
+      total += cur_chunk.length
 
-          # Write to output
-          out.seek(cur_chunk.offset)
-          out.write(bts)
+      if progress is not None:
+        progress(total)
 
-          stats[name] += cur_chunk.length
+  return stats
 
-          if progress is not None:
-            progress(sum(stats.values()))
 
-          break
-      else:
-        raise RuntimeError("Desired chunk not found in provided stores")
+class ChunkIndex:
+  """
+  Persistent index of the chunks in local files, like partitions written by earlier updates.
+  Stored in a directory, with a caibx for each file and a JSON file mapping the file paths to them.
+  """
+  INDEX_FN = "index.json"
+
+  def __init__(self, path: str) -> None:
+    self.path = path
+    self.files: Dict[str, str] = {}
+    try:
+      with open(os.path.join(path, self.INDEX_FN)) as f:
+        self.files = json.load(f)
+    except (OSError, ValueError):
+      pass
+
+  def get(self, fn: str) -> Optional[List[Chunk]]:
+    """The chunks of a file when it was last indexed, None if it isn't indexed"""
+    if fn not in self.files:
+      return None
+    try:
+      return parse_caibx(os.path.join(self.path, self.files[fn]))
+    except (OSError, AssertionError, struct.error):
+      return None
+
+  def update(self, fn: str, chunks: List[Chunk]) -> None:
+    os.makedirs(self.path, exist_ok=True)
+    caibx_fn = hashlib.sha256(fn.encode()).hexdigest()[:16] + ".caibx"
+    write_caibx(chunks, os.path.join(self.path, caibx_fn))
+    self.files[fn] = caibx_fn
+    self.save()
+
+  def remove(self, fn: str) -> None:
+    caibx_fn = self.files.pop(fn, None)
+    if caibx_fn is not None:
+      self.save()
+      try:
+        os.unlink(os.path.join(self.path, caibx_fn))
+      except FileNotFoundError:
+        pass
+
+  def save(self) -> None:
+    atomic_write(os.path.join(self.path, self.INDEX_FN), json.dumps(self.files).encode())
+
+  def sources(self, exclude: Tuple[str, ...] = ()) -> List[Tuple[str, ChunkReader, ChunkDict]]:
+    """A source for each indexed file that still exists, named after its path"""
+    sources: List[Tuple[str, ChunkReader, ChunkDict]] = []
+    for fn in sorted(self.files):
+      if fn in exclude or not os.path.exists(fn):
+        continue
+      chunks = self.get(fn)
+      if chunks:
+        sources.append((fn, FileChunkReader(fn), build_chunk_dict(chunks)))
+    return sources
+
+
+def get_ratios(stats: Dict[str, int]) -> Dict[str, float]:
+  """Fraction of the extracted bytes that came from each source"""
+  total_bytes = sum(stats.values())
+  return {name: total / total_bytes if total_bytes else 0. for name, total in stats.items()}
 
-  return stats
+
+def get_reuse_ratio(stats: Dict[str, int], downloaded: Tuple[str, ...] = ('remote',)) -> float:
+  """Fraction of the extracted bytes that didn't have to be downloaded"""
+  return 1. - sum(r for name, r in get_ratios(stats).items() if name in downloaded) if stats else 0.
 
 
 def print_stats(stats: Dict[str, int]):
   total_bytes = sum(stats.values())
   print(f"Total size: {total_bytes / 1024 / 1024:.2f} MB")
-  for name, total in stats.items():
-    print(f"  {name}: {total / 1024 / 1024:.2f} MB ({total / total_bytes * 100:.1f}%)")
+  for name, ratio in get_ratios(stats).items():
+    print(f"  {name}: {stats[name] / 1024 / 1024:.2f} MB ({ratio * 100:.1f}%)")
 
 
 def extract_simple(caibx_path, out_path, store_path):
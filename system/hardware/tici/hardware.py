@@ -10,6 +10,7 @@ from pathlib import Path
 from cereal import log
 from openpilot.common.gpio import gpio_set, gpio_init, get_irqs_for_action
 from openpilot.system.hardware.base import HardwareBase, ThermalConfig
+from openpilot.system.hardware.sysfs import SYSFS
 from openpilot.system.hardware.tici import iwlist
 from openpilot.system.hardware.tici.pins import GPIO
 from openpilot.system.hardware.tici.amplifier import Amplifier
@@ -427,11 +428,9 @@ class Tici(HardwareBase):
 
   def get_screen_brightness(self):
     try:
-      with open("/sys/class/backlight/panel0-backlight/max_brightness") as f:
-        max_brightness = float(f.read().strip())
-
-      with open("/sys/class/backlight/panel0-backlight/brightness") as f:
-        return int(float(f.read()) / (max_brightness / 100.))
+      max_brightness, brightness = SYSFS.snapshot(("/sys/class/backlight/panel0-backlight/max_brightness",
+                                                   "/sys/class/backlight/panel0-backlight/brightness"))
+      return int(float(brightness) / (float(max_brightness) / 100.))
     except Exception:
       return 0
 
@@ -470,8 +469,7 @@ class Tici(HardwareBase):
 
   def get_gpu_usage_percent(self):
     try:
-      with open('/sys/class/kgsl/kgsl-3d0/gpubusy') as f:
-        used, total = f.read().strip().split()
+      used, total = SYSFS.read('/sys/class/kgsl/kgsl-3d0/gpubusy').strip().split()
       return 100.0 * int(used) / int(total)
     except Exception:
       return 0
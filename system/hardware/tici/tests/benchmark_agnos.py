@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import hashlib
+import io
+import lzma
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Generator
+
+from openpilot.system.hardware.tici.agnos import write_compressed_image
+
+BLOCK_SIZE = 4096
+
+
+class QuietRequestHandler(SimpleHTTPRequestHandler):
+  def log_message(self, *args):
+    pass
+
+
+@contextlib.contextmanager
+def serve_directory(path: str) -> Generator[str, None, None]:
+  """Serves a directory over HTTP on localhost, yields its url"""
+  server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietRequestHandler, directory=path))
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  try:
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+  finally:
+    server.shutdown()
+    server.server_close()
+
+
+def make_image(size: int, seed: int = 0) -> bytes:
+  """Partition contents, runs of random, zero and filled blocks up to 16 MB long"""
+  rng = random.Random(seed)
+  runs = []
+  total_blocks = size // BLOCK_SIZE
+  while total_blocks > 0:
+    blocks = min(total_blocks, 4096, int(rng.paretovariate(0.5)))
+    r = rng.random()
+    if r < 0.4:
+      runs.append(rng.randbytes(blocks * BLOCK_SIZE))
+    elif r < 0.8:
+      runs.append(bytes(blocks * BLOCK_SIZE))
+    else:
+      runs.append(rng.randbytes(4) * (blocks * BLOCK_SIZE // 4))
+    total_blocks -= blocks
+  return b"".join(runs)
+
+
+def make_sparse_image(raw: bytes) -> bytes:
+  """Android sparse image of raw, blocks repeating a 4 byte pattern become fill chunks"""
+  chunks = []
+  for i in range(0, len(raw), BLOCK_SIZE):
+    block = raw[i:i + BLOCK_SIZE]
+    fill = block[:4] if block == block[:4] * (BLOCK_SIZE // 4) else None
+    # consecutive raw blocks, or blocks with the same fill, go in one chunk
+    if len(chunks) and chunks[-1][0] == fill:
+      chunks[-1][1] += 1
+    else:
+      chunks.append([fill, 1])
+
+  dat = [struct.pack("<IHHHHIIII", 0xed26ff3a, 1, 0, 28, 12, BLOCK_SIZE, len(raw) // BLOCK_SIZE, len(chunks), 0)]
+  pos = 0
+  for fill, blocks in chunks:
+    if fill is not None:
+      dat += [struct.pack("<HHII", 0xcac2, 0, blocks, 12 + 4), fill]
+    else:
+      dat += [struct.pack("<HHII", 0xcac1, 0, blocks, 12 + blocks * BLOCK_SIZE), raw[pos:pos + blocks * BLOCK_SIZE]]
+    pos += blocks * BLOCK_SIZE
+  return b"".join(dat)
+
+
+def make_partition(path: str, url: str, name: str, raw: bytes, sparse: bool) -> Dict:
+  """Writes the xz compressed image of raw to path, returns its manifest entry"""
+  image = make_sparse_image(raw) if sparse else raw
+  with open(path, 'wb') as f:
+    f.write(lzma.compress(image, preset=1))
+
+  return {
+    'name': name,
+    'url': url,
+    'sparse': sparse,
+    'size': len(raw),
+    'hash': hashlib.sha256(image).hexdigest(),
+    'hash_raw': hashlib.sha256(raw).hexdigest(),
+    'full_check': True,
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Flash throughput of xz images served from localhost",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--size", type=int, default=256, help="partition size in MB")
+  parser.add_argument("--runs", type=int, default=3)
+  args = parser.parse_args()
+
+  raw = make_image(args.size * 1024 * 1024)
+  with tempfile.TemporaryDirectory() as tmpdir, serve_directory(tmpdir) as url:
+    out_path = os.path.join(tmpdir, "partition")
+    for sparse in (False, True):
+      fn = f"{'sparse' if sparse else 'raw'}.img.xz"
+      partition = make_partition(os.path.join(tmpdir, fn), f"{url}/{fn}", fn, raw, sparse)
+
+      times = []
+      for _ in range(args.runs):
+        st = time.monotonic()
+        with contextlib.redirect_stdout(io.StringIO()):
+          write_compressed_image(out_path, partition)
+        times.append(time.monotonic() - st)
+
+      print(f"{fn:>14s}: {args.size / min(times):7.1f} MB/s (best of {args.runs}, {min(times):.2f}s)")
+
+
+if __name__ == "__main__":
+  main()
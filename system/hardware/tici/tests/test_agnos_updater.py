@@ -1,9 +1,20 @@
 #!/usr/bin/env python3
+import contextlib
+import hashlib
+import io
 import json
+import lzma
+import multiprocessing
 import os
+import tempfile
 import unittest
+from unittest import mock
 import requests
 
+import openpilot.system.hardware.tici.agnos as agnos
+from openpilot.system.hardware.tici.agnos import StreamingDecompressor, write_compressed_image
+from openpilot.system.hardware.tici.tests.benchmark_agnos import make_image, make_partition, serve_directory
+
 TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)))
 MANIFEST = os.path.join(TEST_DIR, "../agnos.json")
 
@@ -22,5 +33,106 @@ class TestAgnosUpdater(unittest.TestCase):
         assert img['hash'] == img['hash_raw']
 
 
+class TestStreamingDecompressor(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tmpdir.cleanup)
+    self.url = self.enterContext(serve_directory(self.tmpdir.name))
+    self.raw = make_image(4 * 1024 * 1024)
+
+  def test_read(self):
+    with open(os.path.join(self.tmpdir.name, "img.xz"), 'wb') as f:
+      f.write(lzma.compress(self.raw))
+
+    f = StreamingDecompressor(f"{self.url}/img.xz")
+    out = bytearray()
+    buf = bytearray(100 * 1000)
+    # mix reads and readintos of different sizes
+    for i in range(1000):
+      if i % 2:
+        out += f.read(i * 37)
+      else:
+        n = f.readinto(memoryview(buf)[:i * 53])
+        out += buf[:n]
+    out += f.read(len(self.raw))
+
+    self.assertEqual(out, self.raw)
+    self.assertEqual(f.read(10), b"")
+    self.assertEqual(f.readinto(buf), 0)
+    self.assertTrue(f.eof)
+    self.assertEqual(f.sha256.digest(), hashlib.sha256(self.raw).digest())
+
+  def test_write_compressed_image(self):
+    out_path = os.path.join(self.tmpdir.name, "partition")
+    for sparse in (False, True):
+      with self.subTest(sparse=sparse):
+        partition = make_partition(os.path.join(self.tmpdir.name, "img.xz"), f"{self.url}/img.xz", "test", self.raw, sparse)
+        with contextlib.redirect_stdout(io.StringIO()):
+          write_compressed_image(out_path, partition)
+
+        with open(out_path, 'rb') as f:
+          self.assertEqual(f.read(), self.raw)
+
+
+class TestVerifyPartitions(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tmpdir.cleanup)
+    self.enterContext(mock.patch.object(agnos, 'hash_cache', agnos.HashCache(os.path.join(self.tmpdir.name, "hashes.json"))))
+    self.enterContext(mock.patch.object(agnos, 'get_partition_path', lambda slot, p: os.path.join(self.tmpdir.name, p['name'] + str(slot))))
+
+    self.partitions = []
+    for i in range(6):
+      raw = make_image(1024 * 1024 + i * 4096, seed=i)
+      name = f"part{i}"
+      with open(agnos.get_partition_path(0, {'name': name}), 'wb') as f:
+        # the raw hash only covers the partition size
+        f.write(raw + b"\x00" * 64)
+      self.partitions.append({'name': name, 'size': len(raw), 'hash_raw': hashlib.sha256(raw).hexdigest().upper(), 'full_check': True})
+
+  def test_verify_partitions(self):
+    self.partitions[3]['hash_raw'] = "00" * 32
+    self.assertEqual(agnos.verify_partitions(0, self.partitions), [True, True, True, False, True, True])
+
+  def test_hash_cache(self):
+    path = agnos.get_partition_path(0, self.partitions[0])
+    self.assertTrue(agnos.verify_partition(0, self.partitions[0], use_cache=True))
+
+    # changes not made by the updater aren't seen within the same boot by checks using the cache
+    with open(path, 'r+b') as f:
+      f.write(b"\x01")
+    self.assertTrue(agnos.verify_partition(0, self.partitions[0], use_cache=True))
+    self.assertFalse(agnos.verify_partition(0, self.partitions[0]))
+    self.assertFalse(agnos.verify_partition(0, self.partitions[0], force_full_check=True, use_cache=True))
+
+    # but the cache is only valid for one boot
+    with mock.patch.object(agnos, 'get_boot_id', return_value="other"):
+      self.assertIsNone(agnos.hash_cache.get(path, self.partitions[0]['size']))
+
+    agnos.hash_cache.put(path, self.partitions[0]['size'], self.partitions[0]['hash_raw'].lower())
+    self.assertTrue(agnos.verify_partition(0, self.partitions[0], use_cache=True))
+    agnos.clear_partition_hash(0, self.partitions[0])
+    self.assertIsNone(agnos.hash_cache.get(path, self.partitions[0]['size']))
+    self.assertFalse(agnos.verify_partition(0, self.partitions[0], use_cache=True))
+
+  def test_hash_cache_opt_in(self):
+    # checks that don't opt in neither read nor fill the cache
+    self.assertEqual(agnos.verify_partitions(0, self.partitions), [True] * len(self.partitions))
+    self.assertFalse(os.path.exists(agnos.hash_cache.path))
+
+    self.assertEqual(agnos.verify_partitions(0, self.partitions, use_cache=True), [True] * len(self.partitions))
+    for p in self.partitions:
+      self.assertIsNotNone(agnos.hash_cache.get(agnos.get_partition_path(0, p), p['size']))
+
+  def test_hash_cache_processes(self):
+    # puts and invalidations made by concurrent processes are not lost
+    paths = [f"/dev/part{i}" for i in range(200)]
+    with multiprocessing.get_context('fork').Pool(8) as pool:
+      pool.starmap(agnos.hash_cache.put, [(path, 1, "00" * 32) for path in paths], chunksize=1)
+      self.assertEqual(set(agnos.hash_cache.load()), set(paths))
+
+      pool.map(agnos.hash_cache.invalidate, paths[::2], chunksize=1)
+      self.assertEqual(set(agnos.hash_cache.load()), set(paths[1::2]))
+
 if __name__ == "__main__":
   unittest.main()
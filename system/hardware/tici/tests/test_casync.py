@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 import os
+import threading
 import unittest
 import tempfile
 import subprocess
+from collections import defaultdict
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from Crypto.Hash import SHA512
 
 import openpilot.system.hardware.tici.casync as casync
 
@@ -12,6 +18,30 @@ import openpilot.system.hardware.tici.casync as casync
 LOOPBACK = os.environ.get('LOOPBACK', None)
 
 
+class StoreRequestHandler(SimpleHTTPRequestHandler):
+  def log_message(self, *args):
+    pass
+
+
+def extract_serial(target, sources, out_path):
+  # chunk by chunk, as extract did before fetching in parallel
+  stats = defaultdict(int)
+  with open(out_path, 'rb+' if os.path.exists(out_path) else 'wb') as out:
+    for cur_chunk in target:
+      for name, chunk_reader, store_chunks in sources:
+        if cur_chunk.sha in store_chunks:
+          bts = chunk_reader.read(store_chunks[cur_chunk.sha])
+          if len(bts) == cur_chunk.length and SHA512.new(bts, truncate="256").digest() == cur_chunk.sha:
+            out.seek(cur_chunk.offset)
+            out.write(bts)
+            out.flush()
+            stats[name] += cur_chunk.length
+            break
+      else:
+        raise RuntimeError("Desired chunk not found in provided stores")
+  return stats
+
+
 class TestCasync(unittest.TestCase):
   @classmethod
   def setUpClass(cls):
@@ -121,6 +151,125 @@ class TestCasync(unittest.TestCase):
 
     self.assertLess(stats['remote'], len(self.contents))
 
+  def test_matches_serial(self):
+    """Test that the parallel extract writes the same contents and reports the same stats as chunk by chunk"""
+    target = casync.parse_caibx(self.manifest_fn)
+    half = len(self.contents) // 2
+
+    def get_sources(target_fn):
+      sources = [('seed', casync.FileChunkReader(self.seed_fn), casync.build_chunk_dict(target))]
+      sources += [('target', casync.FileChunkReader(target_fn), casync.build_chunk_dict(target))]
+      sources += [('remote', casync.RemoteChunkReader(self.store_fn), casync.build_chunk_dict(target))]
+      return sources
+
+    with open(self.seed_fn, 'wb') as f:
+      f.write(self.contents[half:])
+
+    # the target starts with the second half of the contents, which has chunks in the wrong place
+    ref_fn = self.target_fn + '.ref'
+    for fn in (self.target_fn, ref_fn):
+      with open(fn, 'wb') as f:
+        f.write(self.contents[half:])
+    self.addCleanup(os.unlink, ref_fn)
+
+    ref_stats = extract_serial(target, get_sources(ref_fn), ref_fn)
+    for workers in (1, casync.EXTRACT_WORKERS):
+      with self.subTest(workers=workers):
+        with open(self.target_fn, 'wb') as f:
+          f.write(self.contents[half:])
+
+        progress = []
+        stats = casync.extract(target, get_sources(self.target_fn), self.target_fn, progress.append, workers=workers)
+
+        with open(self.target_fn, 'rb') as f:
+          self.assertEqual(f.read(len(self.contents)), self.contents)
+        self.assertEqual(dict(stats), dict(ref_stats))
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(len(progress), len(target))
+        self.assertEqual(progress[-1], len(self.contents))
+
+  def test_write_caibx(self):
+    target = casync.parse_caibx(self.manifest_fn)
+    caibx_fn = os.path.join(self.tmpdir.name, 'written.caibx')
+    self.addCleanup(os.unlink, caibx_fn)
+
+    casync.write_caibx(target, caibx_fn)
+    self.assertEqual(casync.parse_caibx(caibx_fn), target)
+
+  def test_chunk_index(self):
+    """Test that chunks of indexed files are reused at any offset"""
+    target = casync.parse_caibx(self.manifest_fn)
+
+    # The seed has the contents at a different offset
+    prefix = b"\x01" * 1234
+    with open(self.seed_fn, 'wb') as f:
+      f.write(prefix + self.contents)
+
+    seed = [casync.Chunk(SHA512.new(prefix, truncate="256").digest(), 0, len(prefix))]
+    seed += [c._replace(offset=c.offset + len(prefix)) for c in target]
+
+    with tempfile.TemporaryDirectory() as index_dir:
+      casync.ChunkIndex(index_dir).update(self.seed_fn, seed)
+
+      index = casync.ChunkIndex(index_dir)
+      self.assertEqual(index.get(self.seed_fn), seed)
+      self.assertEqual(len(index.sources(exclude=(self.seed_fn,))), 0)
+
+      sources = index.sources()
+      sources += [('remote', casync.RemoteChunkReader(self.store_fn), casync.build_chunk_dict(target))]
+      stats = casync.extract(target, sources, self.target_fn)
+
+      index.remove(self.seed_fn)
+      self.assertIsNone(casync.ChunkIndex(index_dir).get(self.seed_fn))
+
+    with open(self.target_fn, 'rb') as f:
+      self.assertEqual(f.read(), self.contents)
+
+    self.assertEqual(stats[self.seed_fn], len(self.contents))
+    self.assertEqual(casync.get_reuse_ratio(stats), 1.)
+
+  def test_download_cache(self):
+    """Test that downloaded chunks are reused from the cache"""
+    target = casync.parse_caibx(self.manifest_fn)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(StoreRequestHandler, directory=self.store_fn))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+      def get_sources():
+        sources = [('cache', casync.RemoteChunkReader(cache_dir), casync.store_chunk_dict(cache_dir, target))]
+        sources += [('remote', casync.RemoteChunkReader(url, cache_path=cache_dir), casync.build_chunk_dict(target))]
+        return sources
+
+      stats = casync.extract(target, get_sources(), self.target_fn)
+      self.assertEqual(stats['remote'], len(self.contents))
+      self.assertEqual(casync.get_reuse_ratio(stats), 0.)
+
+      os.unlink(self.target_fn)
+      stats = casync.extract(target, get_sources(), self.target_fn)
+      self.assertEqual(stats['cache'], len(self.contents))
+
+      with open(self.target_fn, 'rb') as f:
+        self.assertEqual(f.read(), self.contents)
+
+      casync.prune_store(cache_dir, 0)
+      self.assertEqual(casync.store_chunk_dict(cache_dir, target), {})
+
+      # the cache doesn't grow past its maximum size while extracting
+      max_size = casync.store_size(self.store_fn) // 2
+      os.unlink(self.target_fn)
+      sources = [('remote', casync.RemoteChunkReader(url, cache_path=cache_dir, cache_max_size=max_size), casync.build_chunk_dict(target))]
+      stats = casync.extract(target, sources, self.target_fn)
+      self.assertEqual(stats['remote'], len(self.contents))
+      self.assertGreater(casync.store_size(cache_dir), 0)
+      self.assertLessEqual(casync.store_size(cache_dir), max_size)
+
+      with open(self.target_fn, 'rb') as f:
+        self.assertEqual(f.read(), self.contents)
+
   @unittest.skipUnless(LOOPBACK, "requires loopback device")
   def test_lo_simple_extract(self):
     target = casync.parse_caibx(self.manifest_fn)
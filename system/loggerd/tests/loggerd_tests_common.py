@@ -56,7 +56,7 @@ class MockApiIgnore():
     return "fake-token"
 
 class MockParams():
-  def __init__(self):
+  def __init__(self, keys=None):
     self.params = {
       "DongleId": b"0000000000000000",
       "IsOffroad": b"1",
@@ -74,6 +74,9 @@ class MockParams():
     val = self.params[k]
     return (val == b'1')
 
+  def update(self):
+    pass
+
 class UploaderTestCase(unittest.TestCase):
   f_type = "UNKNOWN"
 
@@ -91,6 +94,7 @@ class UploaderTestCase(unittest.TestCase):
     uploader.ROOT = str(self.root)  # Monkey patch root dir
     uploader.Api = MockApi
     uploader.Params = MockParams
+    uploader.ParamsWatcher = MockParams
     uploader.fake_upload = True
     uploader.force_wifi = True
     uploader.allow_sleep = False
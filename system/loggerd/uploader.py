@@ -15,6 +15,7 @@ from cereal import log
 import cereal.messaging as messaging
 from openpilot.common.api import Api
 from openpilot.common.params import Params
+from openpilot.common.params_watcher import ParamsWatcher
 from openpilot.common.realtime import set_core_affinity
 from openpilot.system.hardware import TICI
 from openpilot.system.loggerd.xattr_cache import getxattr, setxattr
@@ -247,6 +248,7 @@ def uploader_fn(exit_event: threading.Event) -> None:
   clear_locks(ROOT)
 
   params = Params()
+  params_watcher = ParamsWatcher(["IsOffroad"])
   dongle_id = params.get("DongleId", encoding='utf8')
 
   if dongle_id is None:
@@ -263,7 +265,8 @@ def uploader_fn(exit_event: threading.Event) -> None:
   backoff = 0.1
   while not exit_event.is_set():
     sm.update(0)
-    offroad = params.get_bool("IsOffroad")
+    params_watcher.update()
+    offroad = params_watcher.get_bool("IsOffroad")
     network_type = sm['deviceState'].networkType if not force_wifi else NetworkType.wifi
     if network_type == NetworkType.none:
       if allow_sleep:
@@ -4,11 +4,14 @@ import json
 import matplotlib.patches as mpatches
 import matplotlib.pyplot as plt
 import mpld3
+import multiprocessing
 import sys
 from bisect import bisect_left, bisect_right
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 
-from openpilot.tools.lib.logreader import logreader_from_route_or_segment
+from openpilot.common.profiler import TimingHistogram
+from openpilot.tools.lib.logreader import LogReader, logreader_from_route_or_segment
+from openpilot.tools.lib.route import Route, SegmentName
 
 DEMO_ROUTE = "9f583b1d93915c31|2022-05-18--10-49-51--0"
 
@@ -29,6 +32,25 @@ SERVICE_TO_DURATIONS = {
   'modeld': ['modelExecutionTime', 'gpuExecutionTime'],
   'plannerd': ['solverExecutionTime'],
 }
+# streaming: a frame is complete once a frame this much newer is seen
+STREAM_FRAME_WINDOW = 20
+STREAM_MONO_TO_FRAME_SIZE = 1000
+PERCENTILES = (50, 90, 99)
+
+def get_frame_id(msg_obj, mono_to_frame):
+  """frameId of a message, or of the message it was computed from. None if it's from before the camera loop, -1 if not found"""
+  if hasattr(msg_obj, "frameId"):
+    return msg_obj.frameId
+
+  frame_id = -1
+  for key in MONOTIME_KEYS:
+    if hasattr(msg_obj, key):
+      if getattr(msg_obj, key) == 0:
+        # Filter out controlsd messages which arrive before the camera loop
+        return None
+      elif getattr(msg_obj, key) in mono_to_frame:
+        frame_id = mono_to_frame[getattr(msg_obj, key)]
+  return frame_id
 
 def read_logs(lr):
   data = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
@@ -45,20 +67,9 @@ def read_logs(lr):
       service = MSGQ_TO_SERVICE[msg.which()]
       msg_obj = getattr(msg, msg.which())
 
-      frame_id = -1
-      if hasattr(msg_obj, "frameId"):
-        frame_id = msg_obj.frameId
-      else:
-        continue_outer = False
-        for key in MONOTIME_KEYS:
-          if hasattr(msg_obj, key):
-            if getattr(msg_obj, key) == 0:
-              # Filter out controlsd messages which arrive before the camera loop
-              continue_outer = True
-            elif getattr(msg_obj, key) in mono_to_frame:
-              frame_id = mono_to_frame[getattr(msg_obj, key)]
-        if continue_outer:
-          continue
+      frame_id = get_frame_id(msg_obj, mono_to_frame)
+      if frame_id is None:
+        continue
       if frame_id == -1:
         frame_id_fails += 1
         continue
@@ -221,6 +232,136 @@ def get_timestamps(lr):
   insert_cloudlogs(lr, data['timestamp'], data['start'], data['end'])
   return data, frame_mismatches
 
+class LatencyStats:
+  """Histograms of the per-service latency and the total latency of frames, which can be merged across segments"""
+  def __init__(self):
+    self.hists = {name: TimingHistogram() for name in SERVICES + ['total']}
+    self.frames = 0
+    self.frame_id_fails = 0
+
+  def record_frame(self, start, end):
+    self.frames += 1
+    for service in SERVICES:
+      if service in start and service in end:
+        self.hists[service].record((end[service] - start[service]) * 1e-9)
+    # first pixel to controls output, and to actuation when boardd logged it
+    if 'camerad' in start and 'controlsd' in end:
+      self.hists['total'].record((max(end.values()) - start['camerad']) * 1e-9)
+
+  def merge(self, other):
+    for name, hist in self.hists.items():
+      hist.merge(other.hists[name])
+    self.frames += other.frames
+    self.frame_id_fails += other.frame_id_fails
+
+  def summary(self):
+    return {name: {
+      'count': hist.count,
+      'mean_ms': hist.total / max(hist.count, 1) * 1e3,
+      **{f'p{q}_ms': hist.percentile(q) * 1e3 for q in PERCENTILES},
+      'max_ms': hist.max * 1e3,
+    } for name, hist in self.hists.items()}
+
+def stream_latencies(lr):
+  """
+  Per-service latencies computed frame by frame, keeping only the last STREAM_FRAME_WINDOW
+  frames in memory. Same start and end of each service as read_logs: boardd ends at its
+  last cloudlog timestamp after controlsd, other cloudlogs aren't used.
+  """
+  stats = LatencyStats()
+  frames = OrderedDict()
+  mono_to_frame = OrderedDict()
+  latest_frame_id = -1
+  latest_controls_frame_id = None
+
+  def finalize(keep):
+    while len(frames) and next(iter(frames)) < latest_frame_id - keep:
+      stats.record_frame(*frames.popitem(last=False)[1])
+
+  for msg in lr:
+    which = msg.which()
+    if which == 'logMessage':
+      if latest_controls_frame_id in frames and '"timestamp"' in msg.logMessage:
+        jmsg = json.loads(msg.logMessage)
+        timestamp = jmsg['msg'].get('timestamp') if isinstance(jmsg['msg'], dict) else None
+        if jmsg['ctx'].get('daemon') == 'boardd' and timestamp is not None and 'frame_id' not in timestamp:
+          frames[latest_controls_frame_id][1]['boardd'] = int(timestamp['time'])
+      continue
+    if which not in MSGQ_TO_SERVICE or which == 'sendcan':
+      continue
+
+    service = MSGQ_TO_SERVICE[which]
+    msg_obj = getattr(msg, which)
+    frame_id = get_frame_id(msg_obj, mono_to_frame)
+    if frame_id is None:
+      continue
+    if frame_id == -1:
+      stats.frame_id_fails += 1
+      continue
+
+    mono_to_frame[msg.logMonoTime] = frame_id
+    if len(mono_to_frame) > STREAM_MONO_TO_FRAME_SIZE:
+      mono_to_frame.popitem(last=False)
+
+    if frame_id not in frames:
+      # already recorded, or too late to be
+      if frame_id < latest_frame_id - STREAM_FRAME_WINDOW:
+        continue
+      frames[frame_id] = ({}, {})
+      if frame_id < latest_frame_id:
+        frames = OrderedDict(sorted(frames.items()))
+    start, end = frames[frame_id]
+
+    start.setdefault(SERVICES[SERVICES.index(service)+1], msg.logMonoTime)
+    end[service] = msg.logMonoTime
+    if service == SERVICES[0]:
+      start.setdefault(service, msg_obj.timestampSof)
+    elif which == 'controlsState':
+      latest_controls_frame_id = frame_id
+
+    if frame_id > latest_frame_id:
+      latest_frame_id = frame_id
+      finalize(STREAM_FRAME_WINDOW)
+
+  finalize(-1)
+  return stats
+
+def segment_latencies(log_path):
+  if log_path is None:
+    return None
+  return stream_latencies(LogReader(log_path, sort_by_time=True))
+
+def print_summary(summary):
+  print(f"{'':>10s}{'count':>8s}{'mean':>9s}" + "".join(f"{f'p{q}':>9s}" for q in PERCENTILES) + f"{'max':>9s}  (ms)")
+  for name, st in summary.items():
+    print(f"{name:>10s}{st['count']:8d}{st['mean_ms']:9.2f}" + "".join(f"{st[f'p{q}_ms']:9.2f}" for q in PERCENTILES) + f"{st['max_ms']:9.2f}")
+
+def stream_route(route_or_segment_name, jobs, output=None):
+  sn = SegmentName(route_or_segment_name, allow_route_name=True)
+  log_paths = Route(sn.route_name.canonical_name).log_paths()
+  if sn.segment_num >= 0:
+    log_paths = [log_paths[sn.segment_num]]
+
+  total = LatencyStats()
+  segments = {}
+  with multiprocessing.Pool(jobs) as pool:
+    for i, stats in enumerate(pool.imap(segment_latencies, log_paths)):
+      if stats is None:
+        print(f"segment {i}: missing rlog")
+        continue
+      total.merge(stats)
+      segments[i] = stats.summary()
+      print(f"segment {i}: {stats.frames} frames, " + ", ".join(f"{name} p50 {st['p50_ms']:.1f} ms" for name, st in segments[i].items() if st['count']))
+
+  if total.frame_id_fails > 20 * len(segments):
+    print("Warning, many frameId fetch fails", total.frame_id_fails)
+  print(f"{total.frames} frames in {len(segments)} segments")
+  print_summary(total.summary())
+
+  if output is not None:
+    with open(output, "w") as f:
+      json.dump({'route': route_or_segment_name, 'frames': total.frames, 'summary': total.summary(), 'segments': segments}, f, indent=2)
+
 if __name__ == "__main__":
   parser = argparse.ArgumentParser(description="A tool for analyzing openpilot's end-to-end latency",
                                    formatter_class = argparse.ArgumentDefaultsHelpFormatter)
@@ -228,6 +369,9 @@ if __name__ == "__main__":
   parser.add_argument("--demo", action="store_true", help="Use the demo route instead of providing one")
   parser.add_argument("--plot", action="store_true", help="If a plot should be generated")
   parser.add_argument("--offset", action="store_true", help="Vertically offset service to better visualize overlap")
+  parser.add_argument("--stream", action="store_true", help="Only summarize the latency of each service, with bounded memory over whole routes")
+  parser.add_argument("--output", help="With --stream, write the summary and per segment summaries to this JSON file")
+  parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(), help="With --stream, segments processed in parallel")
   parser.add_argument("route_or_segment_name", nargs='?', help="The route to print")
 
   if len(sys.argv) == 1:
@@ -236,6 +380,10 @@ if __name__ == "__main__":
   args = parser.parse_args()
 
   r = DEMO_ROUTE if args.demo else args.route_or_segment_name.strip()
+  if args.stream:
+    stream_route(r, args.jobs, args.output)
+    sys.exit()
+
   lr = logreader_from_route_or_segment(r, sort_by_time=True)
 
   data, _ = get_timestamps(lr)
@@ -2,6 +2,7 @@
 import os
 import sys
 import bz2
+import struct
 import urllib.parse
 import capnp
 import warnings
@@ -11,6 +12,47 @@ from cereal import log as capnp_log
 from openpilot.tools.lib.filereader import FileReader
 from openpilot.tools.lib.route import Route, SegmentName
 
+EVENT_UNION = {f.discriminantValue: f.name for f in capnp_log.Event.schema.node.struct.fields if f.discriminantValue != 0xffff}
+DISCRIMINANT_OFFSET = capnp_log.Event.schema.node.struct.discriminantOffset * 2
+MAX_SEGMENTS = 512
+
+
+def event_which(dat, start, end, n_segments, header_size):
+  # single segment events: the discriminant is read from the root struct's data section
+  if n_segments == 1:
+    ptr = start + header_size
+    lo, hi = struct.unpack_from("<iI", dat, ptr)
+    if lo & 3 == 0:
+      if (hi & 0xffff) * 8 < DISCRIMINANT_OFFSET + 2:
+        return EVENT_UNION.get(0)
+      return EVENT_UNION.get(struct.unpack_from("<H", dat, ptr + 8 + (lo >> 2) * 8 + DISCRIMINANT_OFFSET)[0])
+
+  try:
+    with capnp_log.Event.from_bytes(dat[start:end]) as evt:
+      return evt.which()
+  except Exception:
+    return None
+
+
+def split_events(dat):
+  """
+  Yields (which, start, end) of each serialized event in a log, without parsing the events.
+  Stops at the first truncated event.
+  """
+  pos = 0
+  while pos + 8 <= len(dat):
+    n_segments = struct.unpack_from("<I", dat, pos)[0] + 1
+    header_size = (4 + 4 * n_segments + 7) // 8 * 8
+    if n_segments > MAX_SEGMENTS or pos + header_size > len(dat):
+      break
+    end = pos + header_size + sum(struct.unpack_from(f"<{n_segments}I", dat, pos + 4)) * 8
+    if end > len(dat):
+      break
+
+    yield event_which(dat, pos, end, n_segments, header_size), pos, end
+    pos = end
+
+
 # this is an iterator itself, and uses private variables from LogReader
 class MultiLogIterator:
   def __init__(self, log_paths, sort_by_time=False):
@@ -74,7 +116,7 @@ class MultiLogIterator:
 
 
 class LogReader:
-  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None):
+  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None, services=None):
     self.data_version = None
     self._only_union_types = only_union_types
 
@@ -91,6 +133,11 @@ class LogReader:
     if ext == ".bz2" or dat.startswith(b'BZh9'):
       dat = bz2.decompress(dat)
 
+    if services is not None:
+      # only the events of these services are parsed
+      mv = memoryview(dat)
+      dat = b"".join(mv[start:end] for which, start, end in split_events(dat) if which in services)
+
     ents = capnp_log.Event.read_multiple_bytes(dat)
 
     _ents = []
@@ -5,6 +5,7 @@ import tempfile
 
 from collections import defaultdict
 import numpy as np
+import cereal.messaging as messaging
 from openpilot.tools.lib.framereader import FrameReader
 from openpilot.tools.lib.logreader import LogReader
 
@@ -31,6 +32,18 @@ class TestReaders(unittest.TestCase):
     lr_url = LogReader("https://github.com/commaai/comma2k19/blob/master/Example_1/b0c9d2329ad1606b%7C2018-08-02--08-34-47/40/raw_log.bz2?raw=true")
     _check_data(lr_url)
 
+  def test_logreader_services(self):
+    msgs = []
+    for i, which in enumerate(['carState', 'carControl', 'liveLocationKalman'] * 10):
+      msg = messaging.new_message(which)
+      msg.logMonoTime = i
+      msgs.append(msg)
+    dat = b"".join(m.to_bytes() for m in msgs)
+
+    lr = LogReader("", dat=dat, services=['carState', 'liveLocationKalman'])
+    expected = [m for m in msgs if m.which() != 'carControl']
+    self.assertEqual([(m.which(), m.logMonoTime) for m in lr], [(m.which(), m.logMonoTime) for m in expected])
+
   @unittest.skip("skip for bandwidth reasons")
   def test_framereader(self):
     def _check_data(f):
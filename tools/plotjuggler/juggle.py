@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import os
 import sys
+import bz2
 import multiprocessing
 import platform
 import shutil
@@ -9,12 +10,16 @@ import tarfile
 import tempfile
 import requests
 import argparse
+from functools import partial
 
+from cereal import log as capnp_log
 from openpilot.common.basedir import BASEDIR
+from openpilot.common.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
 from openpilot.selfdrive.test.openpilotci import get_url
-from openpilot.tools.lib.logreader import LogReader
+from openpilot.tools.lib.filereader import FileReader
+from openpilot.tools.lib.logreader import LogReader, split_events
 from openpilot.tools.lib.route import Route, SegmentName
-from openpilot.tools.lib.helpers import save_log
+from openpilot.tools.lib.url_file import CACHE_DIR, hash_256
 from urllib.parse import urlparse, parse_qs
 
 juggle_dir = os.path.dirname(os.path.realpath(__file__))
@@ -26,6 +31,9 @@ PLOTJUGGLER_BIN = os.path.join(juggle_dir, "bin/plotjuggler")
 MINIMUM_PLOTJUGGLER_VERSION = (3, 5, 2)
 MAX_STREAMING_BUFFER_SIZE = 1000
 
+# per segment exports of the plotted services, uncompressed
+EXPORT_DIR = os.path.join(CACHE_DIR, "plotjuggler")
+
 def install():
   m = f"{platform.system()}-{platform.machine()}"
   supported = ("Linux-x86_64", "Darwin-arm64", "Darwin-x86_64")
@@ -64,6 +72,58 @@ def load_segment(segment_name):
     return []
 
 
+def export_segment(log_path, services=None, exclude=()):
+  """
+  Writes the events of the selected services in a log to an uncompressed log in EXPORT_DIR,
+  copied as they are in the log instead of parsed and serialized again. Returns the export's path,
+  which is reused for the same log and services.
+  """
+  if log_path is None:
+    return None
+
+  key = f"{log_path}|{','.join(sorted(services or []))}|{','.join(sorted(exclude))}"
+  if os.path.isfile(log_path):
+    key += f"|{os.path.getmtime(log_path)}"
+  path = os.path.join(EXPORT_DIR, hash_256(key) + ".rlog")
+  if os.path.exists(path):
+    return path
+
+  try:
+    with FileReader(log_path) as f:
+      dat = f.read()
+    if urlparse(log_path).path.endswith(".bz2") or dat.startswith(b'BZh9'):
+      dat = bz2.decompress(dat)
+  except (AssertionError, ValueError, OSError) as e:
+    print(f"Error reading {log_path}: {e}")
+    return None
+
+  mkdirs_exists_ok(EXPORT_DIR)
+  mv = memoryview(dat)
+  with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+    for which, start, end in split_events(dat):
+      # carParams is always kept to infer the DBC
+      if which in exclude or (services is not None and which not in services and which != 'carParams'):
+        continue
+      f.write(mv[start:end])
+  return path
+
+
+def infer_dbc(paths):
+  for path in paths:
+    with open(path, "rb") as f:
+      dat = f.read()
+
+    for which, start, end in split_events(dat):
+      if which == 'carParams':
+        with capnp_log.Event.from_bytes(dat[start:end]) as evt:
+          try:
+            DBC = __import__(f"openpilot.selfdrive.car.{evt.carParams.carName}.values", fromlist=['DBC']).DBC
+            return DBC[evt.carParams.carFingerprint]['pt']
+          except Exception:
+            return None
+  return None
+
+
 def start_juggler(fn=None, dbc=None, layout=None, route_or_segment_name=None):
   env = os.environ.copy()
   env["BASEDIR"] = BASEDIR
@@ -83,7 +143,7 @@ def start_juggler(fn=None, dbc=None, layout=None, route_or_segment_name=None):
   subprocess.call(cmd, shell=True, env=env, cwd=juggle_dir)
 
 
-def juggle_route(route_or_segment_name, segment_count, qlog, can, layout, dbc=None, ci=False):
+def juggle_route(route_or_segment_name, segment_count, qlog, can, layout, dbc=None, ci=False, services=None):
   segment_start = 0
   if 'cabana' in route_or_segment_name:
     query = parse_qs(urlparse(route_or_segment_name).query)
@@ -117,27 +177,31 @@ def juggle_route(route_or_segment_name, segment_count, qlog, can, layout, dbc=No
       print("Please try a different route or segment")
       return
 
-  all_data = []
-  with multiprocessing.Pool(24) as pool:
-    for d in pool.map(load_segment, logs):
-      all_data += d
-
-  if not can:
-    all_data = [d for d in all_data if d.which() not in ['can', 'sendcan']]
-
-  # Infer DBC name from logs
-  if dbc is None:
-    for cp in [m for m in all_data if m.which() == 'carParams']:
-      try:
-        DBC = __import__(f"openpilot.selfdrive.car.{cp.carParams.carName}.values", fromlist=['DBC']).DBC
-        dbc = DBC[cp.carParams.carFingerprint]['pt']
-      except Exception:
-        pass
-      break
-
+  # segments are exported in order as they're downloaded, and exports from previous runs are reused.
+  # each export is appended to the log PlotJuggler loads as soon as it's done, while the next ones download
+  exclude = () if can else ('can', 'sendcan')
+  export = partial(export_segment, services=services, exclude=exclude)
+  paths = []
   with tempfile.NamedTemporaryFile(suffix='.rlog', dir=juggle_dir) as tmp:
-    save_log(tmp.name, all_data, compress=False)
-    del all_data
+    with multiprocessing.Pool(24) as pool:
+      for i, path in enumerate(pool.imap(export, logs)):
+        print(f"Exported segment {i + 1}/{len(logs)}", end="\r", flush=True)
+        if path is not None:
+          paths.append(path)
+          if len(logs) > 1:
+            with open(path, "rb") as f:
+              shutil.copyfileobj(f, tmp)
+    print()
+    tmp.flush()
+
+    # Infer DBC name from logs
+    if dbc is None:
+      dbc = infer_dbc(paths)
+
+    if len(logs) == 1 and len(paths) == 1:
+      start_juggler(paths[0], dbc, layout, route_or_segment_name)
+      return
+
     start_juggler(tmp.name, dbc, layout, route_or_segment_name)
 
 
@@ -152,6 +216,7 @@ if __name__ == "__main__":
   parser.add_argument("--stream", action="store_true", help="Start PlotJuggler in streaming mode")
   parser.add_argument("--layout", nargs='?', help="Run PlotJuggler with a pre-defined layout")
   parser.add_argument("--install", action="store_true", help="Install or update PlotJuggler + plugins")
+  parser.add_argument("--services", nargs="*", help="Only plot these services, instead of all of them")
   parser.add_argument("--dbc", help="Set the DBC name to load for parsing CAN data. If not set, the DBC will be automatically inferred from the logs.")
   parser.add_argument("route_or_segment_name", nargs='?', help="The route or segment name to plot (cabana share URL accepted)")
   parser.add_argument("segment_count", type=int, nargs='?', help="The number of segments to plot")
@@ -177,4 +242,4 @@ if __name__ == "__main__":
     start_juggler(layout=args.layout)
   else:
     route_or_segment_name = DEMO_ROUTE if args.demo else args.route_or_segment_name.strip()
-    juggle_route(route_or_segment_name, args.segment_count, args.qlog, args.can, args.layout, args.dbc, args.ci)
+    juggle_route(route_or_segment_name, args.segment_count, args.qlog, args.can, args.layout, args.dbc, args.ci, args.services)
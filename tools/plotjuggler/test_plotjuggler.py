@@ -3,12 +3,16 @@ import os
 import glob
 import signal
 import subprocess
+import tempfile
 import time
 import unittest
 
+import cereal.messaging as messaging
 from openpilot.common.basedir import BASEDIR
 from openpilot.common.timeout import Timeout
-from openpilot.tools.plotjuggler.juggle import install
+from openpilot.tools.lib.helpers import save_log
+from openpilot.tools.lib.logreader import LogReader
+from openpilot.tools.plotjuggler.juggle import export_segment, install
 
 PJ_DIR = os.path.join(BASEDIR, "tools/plotjuggler")
 
@@ -31,6 +35,29 @@ class TestPlotJuggler(unittest.TestCase):
       self.assertEqual(p.poll(), None)
       os.killpg(os.getpgid(p.pid), signal.SIGTERM)
 
+  def test_export_segment(self):
+    msgs = []
+    for i in range(100):
+      for s in ('carState', 'controlsState', 'carParams', 'can', 'sendcan', 'initData'):
+        msg = messaging.new_message(s, 3) if s in ('can', 'sendcan') else messaging.new_message(s)
+        msg.logMonoTime = i
+        msgs.append(msg)
+    # large events can span multiple segments
+    msgs.append(messaging.new_message('can', 10000))
+
+    with tempfile.TemporaryDirectory() as tmp:
+      fn = os.path.join(tmp, "rlog.bz2")
+      save_log(fn, msgs)
+
+      for services, exclude in [(None, ()), (None, ('can', 'sendcan')), (['carState'], ())]:
+        with self.subTest(services=services, exclude=exclude):
+          expected = [m for m in msgs if m.which() not in exclude and (services is None or m.which() in services + ['carParams'])]
+          path = export_segment(fn, services, exclude)
+          self.assertEqual(export_segment(fn, services, exclude), path)
+          with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"".join(m.to_bytes() for m in expected))
+          self.assertEqual([m.which() for m in LogReader(path)], [m.which() for m in expected])
+
   # TODO: also test that layouts successfully load
   def test_layouts(self):
     bad_strings = (
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+import multiprocessing
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from openpilot.common.params import Params
+from openpilot.selfdrive.locationd.calibrationd import Calibrator
+from openpilot.selfdrive.locationd.models.car_kf import States
+from openpilot.selfdrive.locationd.paramsd import ParamsLearner, RateLimitedParams, reset_if_not_finite, retrieve_initial_params
+from openpilot.selfdrive.locationd.torqued import TorqueEstimator
+from openpilot.selfdrive.test.process_replay.helpers import OpenpilotPrefix
+from openpilot.tools.lib.logreader import LogReader
+from openpilot.tools.lib.route import Route, RouteName
+
+# only these services are parsed from the logs
+SERVICES = ['carParams', 'carState', 'carControl', 'liveLocationKalman', 'cameraOdometry']
+# seconds of log time between two points of the convergence curves
+CURVE_INTERVAL = 1.0
+
+
+class ParamsdLearner:
+  """paramsd's ParamsLearner, initialized from and saving to LiveParameters like paramsd"""
+  def __init__(self, CP, decimated=False):
+    self.CP = CP
+    params = retrieve_initial_params(CP, Params(), replay=False)
+    self.learner = ParamsLearner(CP, params['steerRatio'], params['stiffnessFactor'], math.radians(params['angleOffsetAverageDeg']))
+    self.outputs = RateLimitedParams(params['angleOffsetAverageDeg'])
+
+  def handle_log(self, t, which, msg):
+    if which in ('liveLocationKalman', 'carState'):
+      self.learner.handle_log(t, which, msg)
+    if which == 'liveLocationKalman':
+      # paramsd publishes, which resets a diverged learner and rate limits the offsets, on every liveLocationKalman
+      self.learner = reset_if_not_finite(self.learner, self.CP)
+      self.outputs.update(self.learner.kf.x)
+
+  def get_params(self) -> Dict[str, float]:
+    x = self.learner.kf.x
+    P = np.sqrt(self.learner.kf.P.diagonal())
+    return {
+      'steerRatio': float(x[States.STEER_RATIO].item()),
+      'steerRatioStd': float(P[States.STEER_RATIO].item()),
+      'stiffnessFactor': float(x[States.STIFFNESS].item()),
+      'stiffnessFactorStd': float(P[States.STIFFNESS].item()),
+      'angleOffsetAverageDeg': self.outputs.angle_offset_average,
+      'angleOffsetDeg': self.outputs.angle_offset,
+      'roll': self.outputs.roll,
+    }
+
+  def save(self):
+    params = self.get_params()
+    Params().put("LiveParameters", json.dumps({
+      'carFingerprint': self.CP.carFingerprint,
+      'steerRatio': params['steerRatio'],
+      'stiffnessFactor': params['stiffnessFactor'],
+      'angleOffsetAverageDeg': params['angleOffsetAverageDeg'],
+    }))
+
+
+class TorquedLearner:
+  """torqued's TorqueEstimator, restored from and cached to LiveTorqueParameters like torqued"""
+  def __init__(self, CP, decimated=False):
+    self.CP = CP
+    self.estimator = TorqueEstimator(CP, decimated=decimated)
+    self.llk_frame = 0
+    self.msg = self.estimator.get_msg()
+
+  def handle_log(self, t, which, msg):
+    if which in ('carControl', 'carState', 'liveLocationKalman'):
+      self.estimator.handle_log(t, which, msg)
+    if which == 'liveLocationKalman':
+      # torqued publishes, which also updates the filtered params, every 5th liveLocationKalman
+      if self.llk_frame % 5 == 0:
+        self.msg = self.estimator.get_msg()
+      self.llk_frame += 1
+
+  def get_params(self) -> Dict[str, float]:
+    ltp = self.msg.liveTorqueParameters
+    return {
+      'liveValid': ltp.liveValid,
+      'latAccelFactor': ltp.latAccelFactorFiltered,
+      'latAccelOffset': ltp.latAccelOffsetFiltered,
+      'frictionCoefficient': ltp.frictionCoefficientFiltered,
+      'totalBucketPoints': ltp.totalBucketPoints,
+    }
+
+  def save(self):
+    params = Params()
+    params.put("LiveTorqueCarParams", self.CP.as_builder().to_bytes())
+    params.put("LiveTorqueParameters", self.estimator.get_msg(with_points=True).to_bytes())
+
+
+class CalibrationdLearner:
+  """calibrationd's Calibrator, restored from CalibrationParams, which is written at the end of the route"""
+  def __init__(self, CP, decimated=False):
+    self.calibrator = Calibrator(param_put=True)
+    self.calibrator.param_put = False
+    self.calibrator.not_car = CP.notCar
+    self.v_ego = 0.
+
+  def handle_log(self, t, which, msg):
+    if which == 'carState':
+      self.v_ego = msg.vEgo
+    elif which == 'cameraOdometry':
+      self.calibrator.handle_v_ego(self.v_ego)
+      self.calibrator.handle_cam_odom(msg.trans, msg.rot, msg.wideFromDeviceEuler, msg.transStd,
+                                      msg.roadTransformTrans, msg.roadTransformTransStd)
+
+  def get_params(self) -> Dict[str, Any]:
+    cal = self.calibrator.get_msg().liveCalibration
+    return {
+      'calStatus': str(cal.calStatus),
+      'calPerc': cal.calPerc,
+      'validBlocks': cal.validBlocks,
+      'rpyCalib': list(cal.rpyCalib),
+      'height': list(cal.height),
+    }
+
+  def save(self):
+    Params().put("CalibrationParams", self.calibrator.get_msg().to_bytes())
+
+
+LEARNERS = {
+  'paramsd': ParamsdLearner,
+  'torqued': TorquedLearner,
+  'calibrationd': CalibrationdLearner,
+}
+
+
+def learn_route(route: str, learners: List[str], qlog: bool = False, data_dir: Optional[str] = None) -> Dict[str, Any]:
+  """
+  Feeds the selected services of a route's logs to the learners, segment by segment. The learners
+  start from the parameters saved by the previous route in the current params. Returns the learned
+  parameters at the end of the route and their values every CURVE_INTERVAL seconds of log time.
+  """
+  r = Route(route, data_dir=data_dir)
+  log_paths = [p for p in (r.qlog_paths() if qlog else r.log_paths()) if p is not None]
+
+  running: Dict[str, Any] = {}
+  curves: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+  car_fingerprint = None
+  start_t = next_sample_t = None
+  for path in log_paths:
+    for msg in LogReader(path, sort_by_time=True, services=SERVICES):
+      which = msg.which()
+      if which == 'carParams':
+        # the learners need the CarParams, everything before the first one is skipped
+        if not running:
+          CP = msg.carParams
+          car_fingerprint = CP.carFingerprint
+          running = {name: LEARNERS[name](CP, decimated=qlog) for name in learners}
+        continue
+      if not running:
+        continue
+
+      t = msg.logMonoTime * 1e-9
+      for learner in running.values():
+        learner.handle_log(t, which, getattr(msg, which))
+
+      if start_t is None:
+        start_t = next_sample_t = t
+      if t >= next_sample_t:
+        for name, learner in running.items():
+          curves[name].append({'t': t - start_t, **learner.get_params()})
+        next_sample_t = t + CURVE_INTERVAL
+
+  for learner in running.values():
+    learner.save()
+
+  return {
+    'route': route,
+    'carFingerprint': car_fingerprint,
+    'segments': len(log_paths),
+    'params': {name: learner.get_params() for name, learner in running.items()},
+    'curves': dict(curves),
+  }
+
+
+def learn_vehicle(routes: List[str], learners: List[str], qlog: bool = False, data_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+  """Learns over the routes of one vehicle in order, in its own params"""
+  with OpenpilotPrefix():
+    ret = []
+    for route in routes:
+      ret.append(learn_route(route, learners, qlog, data_dir))
+      print(f"{route}: {ret[-1]['carFingerprint']}, {ret[-1]['segments']} segments")
+    return ret
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Runs the paramsd, torqued and calibrationd learners over the logs of many routes, " +
+                                               "the routes of each vehicle (dongle id) in order and the vehicles in parallel",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("routes", nargs="+", help="route names, e.g. a2a0ccea32023010|2023-07-27--13-01-19")
+  parser.add_argument("--learners", nargs="*", default=list(LEARNERS), choices=list(LEARNERS))
+  parser.add_argument("--qlog", action="store_true", help="use qlogs instead of rlogs")
+  parser.add_argument("--data-dir", help="local directory with the routes")
+  parser.add_argument("--output", help="write the learned parameters and convergence curves as JSON to this path")
+  parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(), help="vehicles learned in parallel")
+  args = parser.parse_args()
+
+  vehicles = defaultdict(list)
+  for route in args.routes:
+    name = RouteName(route)
+    vehicles[name.dongle_id].append(name.canonical_name)
+
+  jobs = [(sorted(routes), args.learners, args.qlog, args.data_dir) for routes in vehicles.values()]
+  with multiprocessing.Pool(min(args.jobs, len(jobs))) as pool:
+    results = [r for vehicle in pool.starmap(learn_vehicle, jobs) for r in vehicle]
+
+  for res in results:
+    print(res['route'], res['carFingerprint'])
+    for name, params in res['params'].items():
+      print(f"  {name:>12s}: " + ", ".join(f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}" for k, v in params.items()))
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+  main()